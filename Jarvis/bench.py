@@ -0,0 +1,1495 @@
+"""Micro-benchmarks for Jarvis internals.
+
+Run from the Jarvis folder, e.g.:
+
+    python bench.py router
+"""
+import argparse
+import atexit
+import collections
+import contextlib
+import hashlib
+import http.server
+import io
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.request
+
+# Benchmarks build indexes and caches; keep them out of the user's ~/.jarvis
+if not os.environ.get("JARVIS_DATA_DIR", "").strip():
+    os.environ["JARVIS_DATA_DIR"] = tempfile.mkdtemp(prefix="jarvis-bench-")
+    atexit.register(shutil.rmtree, os.environ["JARVIS_DATA_DIR"], ignore_errors=True)
+
+import jarvis
+
+
+def _percentiles(samples: list[float]) -> tuple[float, float, float]:
+    ordered = sorted(samples)
+    n = len(ordered)
+    return (
+        ordered[n // 2],
+        ordered[min(n - 1, int(n * 0.95))],
+        ordered[min(n - 1, int(n * 0.99))],
+    )
+
+
+def _report(label: str, samples: list[float], unit: str = "us", scale: float = 1e6) -> None:
+    p50, p95, p99 = _percentiles(samples)
+    print(f"{label:<40} p50={p50 * scale:8.1f}{unit}  p95={p95 * scale:8.1f}{unit}  "
+          f"p99={p99 * scale:8.1f}{unit}  mean={statistics.fmean(samples) * scale:8.1f}{unit}")
+
+
+class _MockLLMHandler(http.server.BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible /chat/completions endpoint."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    reply = "Paris is the capital of France."
+    delay = 0.0
+    token_delay = 0.0
+    # Fault injection: a share of requests stalls for ``slow_delay`` or fails with HTTP 503
+    slow_rate = 0.0
+    slow_delay = 0.0
+    fail_rate = 0.0
+    rng = random.Random(1)
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.fail_rate and self.rng.random() < self.fail_rate:
+            body = b'{"error": {"message": "overloaded", "type": "server_error"}}'
+            self.send_response(503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.slow_rate and self.rng.random() < self.slow_rate:
+            time.sleep(self.slow_delay)
+        if self.delay:
+            time.sleep(self.delay)
+        if request.get("stream"):
+            self._stream_reply()
+            return
+        # A buffered reply still takes as long to generate as a streamed one
+        time.sleep(self.token_delay * len(self.reply.split(" ")))
+        body = json.dumps({
+            "id": "cmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "mock",
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": self.reply}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _stream_reply(self) -> None:
+        """Send the reply as SSE chunks, one word every ``token_delay`` seconds."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def _event(payload: str) -> None:
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        for word in self.reply.split(" "):
+            time.sleep(self.token_delay)
+            _event(json.dumps({
+                "id": "cmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": "mock",
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            }))
+        _event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def _start_mock_server(handler) -> tuple[http.server.ThreadingHTTPServer, str]:
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+# Command words said on their own: each must ask for its argument, never act on an empty one
+_BARE_COMMANDS = (
+    "run", "execute", "open", "launch", "type", "search", "open file", "find file", "open file named",
+    "open folder", "open folder named", "open directory", "go to folder", "cd to", "in that open", "in that go to",
+    "in that run", "in that open file", "create folder", "delete folder", "delete file", "git clone", "queue",
+    "play radio", "play album", "search amazon", "youtube search", "rename",
+)
+
+
+def _check_bare_commands() -> None:
+    """Dispatch every bare command with side effects trapped; each must only speak a question."""
+    spoken: list[str] = []
+
+    def side_effect(*a, **k):
+        raise AssertionError(f"side effect {a!r}")
+
+    patches = {"_speak_and_log": spoken.append, "speak": spoken.append, "_run_shell_string": side_effect,
+               "_find_first": side_effect, "_search_user_common_roots": side_effect,
+               "_resolve_name_to_path": side_effect, "_find_audio_file": side_effect, "_queue_online": side_effect,
+               "_play_online_radio": side_effect, "_git_clone": side_effect, "_create_folder": side_effect,
+               "_delete_folder": side_effect, "_optional_import": side_effect, "_find_app_executable": side_effect}
+    saved = {name: getattr(jarvis, name) for name in patches}
+    saved_popen, saved_open = subprocess.Popen, jarvis.wb.open
+    try:
+        for name, fn in patches.items():
+            setattr(jarvis, name, fn)
+        subprocess.Popen = jarvis.wb.open = side_effect
+        for query in _BARE_COMMANDS:
+            spoken.clear()
+            intent = jarvis.intent_router.match(query)
+            assert intent is not None and intent.handler is not None, f"{query!r} did not route to a handler"
+            intent.handler(query)
+            assert spoken and (spoken[-1].endswith("?") or "say" in spoken[-1].lower()), \
+                f"{query!r} ({intent.name}) answered {spoken!r}"
+    finally:
+        for name, fn in saved.items():
+            setattr(jarvis, name, fn)
+        subprocess.Popen, jarvis.wb.open = saved_popen, saved_open
+    print(f"bare commands: all {len(_BARE_COMMANDS)} ask for their argument")
+
+
+def bench_router(args) -> None:
+    """Routing latency as the number of registered custom commands grows (after checking bare commands)."""
+    _check_bare_commands()
+    utterances = [
+        "what time is it",
+        "open file named quarterly report dot xlsx in my pc",
+        "play song bohemian rhapsody online",
+        "go to projects and run npm start",
+        "could you tell me something interesting about the roman empire",
+        "in that open file app dot py",
+    ]
+    for extra in (0, 100, 500, 1000, 5000):
+        router = jarvis.IntentRouter()
+        jarvis._register_builtin_intents(router)
+        for i in range(extra):
+            router.register(f"custom_{i}", lambda q: None, keywords=(f"custom command {i}",),
+                            prefixes=(f"macro {i}",), priority=40)
+        router.match("warm up")
+        samples = []
+        for _ in range(args.iterations):
+            for u in utterances:
+                t0 = time.perf_counter()
+                router.match(u)
+                samples.append(time.perf_counter() - t0)
+        _report(f"router match ({extra} custom intents)", samples)
+
+
+def bench_apps(args) -> None:
+    """App resolution latency against a generated fake install tree."""
+    with tempfile.TemporaryDirectory() as tmp:
+        install = os.path.join(tmp, "Program Files")
+        for i in range(args.apps):
+            folder = os.path.join(install, f"Vendor{i % 50}", f"Product{i}")
+            os.makedirs(folder, exist_ok=True)
+            open(os.path.join(folder, f"product{i}.exe"), "w").close()
+        catalog = jarvis.AppCatalog(os.path.join(tmp, "apps.json"), sources=[("install", [install])],
+                                    use_registry=False)
+        t0 = time.perf_counter()
+        catalog.rebuild()
+        print(f"catalog build ({args.apps} apps): {(time.perf_counter() - t0) * 1e3:.1f}ms")
+        for label, name in (("exact", f"product{args.apps // 2}"), ("prefix", "product1"),
+                            ("fuzzy", f"prodct{args.apps // 3}"), ("miss", "nonexistent")):
+            samples = []
+            for _ in range(args.iterations):
+                t0 = time.perf_counter()
+                catalog.resolve(name)
+                samples.append(time.perf_counter() - t0)
+            _report(f"resolve {label}", samples, unit="ms", scale=1e3)
+
+
+def bench_llm_clients(args) -> None:
+    """Per-request overhead of rebuilding vs reusing the LLM client (local mock server)."""
+    server, base_url = _start_mock_server(_MockLLMHandler)
+    os.environ.update({"LLM_PROVIDER": "openai", "OPENAI_API_KEY": "sk-bench", "OPENAI_BASE_URL": base_url})
+    # The same question every time would otherwise be answered by the response cache
+    cache_enabled, jarvis.llm_cache.enabled = jarvis.llm_cache.enabled, False
+    try:
+        jarvis.llm_generate_response("warm up")
+        for label, rebuild in (("client rebuilt per request", True), ("cached client", False)):
+            samples = []
+            for _ in range(args.iterations):
+                if rebuild:
+                    # Old behaviour: fresh SDK client and fresh connection pool
+                    if jarvis._LLM_HTTP_CLIENT is not None:
+                        jarvis._LLM_HTTP_CLIENT.close()
+                        jarvis._LLM_HTTP_CLIENT = None
+                    jarvis.llm_providers.reset()
+                t0 = time.perf_counter()
+                jarvis.llm_generate_response("What is the capital of France?")
+                samples.append(time.perf_counter() - t0)
+            _report(label, samples, unit="ms", scale=1e3)
+    finally:
+        jarvis.llm_cache.enabled = cache_enabled
+        server.shutdown()
+
+
+def bench_llm_stream(args) -> None:
+    """Time to first spoken sentence, buffered vs streamed replies (local mock server)."""
+
+    class Handler(_MockLLMHandler):
+        reply = ("Paris is the capital of France. It sits on the Seine in the north of the country. "
+                 "About two million people live in the city proper, and more than twelve million in "
+                 "the wider metropolitan area.")
+        delay = args.first_token_delay
+        token_delay = args.token_delay
+
+    server, base_url = _start_mock_server(Handler)
+    os.environ.update({"LLM_PROVIDER": "openai", "OPENAI_API_KEY": "sk-bench", "OPENAI_BASE_URL": base_url})
+    first_spoken: list[float] = []
+    real_speak = jarvis.speak
+    jarvis.speak = lambda text: first_spoken.append(time.perf_counter())
+    cache_enabled, jarvis.llm_cache.enabled = jarvis.llm_cache.enabled, False
+    try:
+        jarvis.llm_generate_response("warm up")
+        for label, streaming in (("buffered reply", False), ("streamed reply", True)):
+            samples = []
+            for _ in range(args.iterations):
+                first_spoken.clear()
+                t0 = time.perf_counter()
+                if streaming:
+                    jarvis._speak_streamed_reply("Tell me about Paris")
+                else:
+                    jarvis.speak(jarvis.llm_generate_response("Tell me about Paris"))
+                samples.append(first_spoken[0] - t0)
+            _report(f"time to first sentence, {label}", samples, unit="ms", scale=1e3)
+    finally:
+        jarvis.speak = real_speak
+        jarvis.llm_cache.enabled = cache_enabled
+        server.shutdown()
+
+
+def bench_llm_race(args) -> None:
+    """Answer latency with one provider vs failover vs hedging (two local mock servers with injected faults)."""
+
+    class Flaky(_MockLLMHandler):
+        delay = args.delay
+        slow_rate = args.slow_rate
+        slow_delay = args.slow_delay
+        fail_rate = args.fail_rate
+        rng = random.Random(1)
+
+    class Backup(_MockLLMHandler):
+        delay = args.delay * 1.5
+
+    flaky, flaky_url = _start_mock_server(Flaky)
+    backup, backup_url = _start_mock_server(Backup)
+    os.environ.update({"LLM_PROVIDER": "openrouter", "OPENROUTER_API_KEY": "sk-bench", "OPENROUTER_BASE_URL": flaky_url,
+                       "OPENAI_API_KEY": "sk-bench", "OPENAI_BASE_URL": backup_url})
+    saved = jarvis.llm_router
+    faults = (Flaky.fail_rate, Flaky.slow_rate)
+    try:
+        os.environ["JARVIS_LLM_PROVIDERS"] = "openai"
+        # Primary down: every answer must come from the backup
+        Flaky.fail_rate, Flaky.slow_rate = 1.0, 0.0
+        router = jarvis.LLMRouter(jarvis.llm_providers)
+        for i in range(3):
+            assert router.complete(f"check {i}") == Backup.reply, "failover did not return the backup's answer"
+        assert router.failovers >= 1, "primary failures were not counted as failovers"
+        # Primary stalls: the hedged request to the backup must answer well before the stall ends
+        Flaky.fail_rate, Flaky.slow_rate = 0.0, 1.0
+        router = jarvis.LLMRouter(jarvis.llm_providers, hedge=True, default_hedge_delay=0.1, min_hedge_delay=0.05)
+        t0 = time.perf_counter()
+        assert router.complete("check hedge") == Backup.reply
+        elapsed = time.perf_counter() - t0
+        assert router.hedged == 1, f"hedging did not fire on a stalled primary (hedged={router.hedged})"
+        assert elapsed < args.slow_delay, f"hedged answer took {elapsed:.2f}s, the stall is {args.slow_delay}s"
+        print(f"checks passed: failover answers with the primary down, hedge answers a stalled primary in "
+              f"{elapsed * 1e3:.0f}ms")
+        Flaky.fail_rate, Flaky.slow_rate = faults
+        for label, backups, hedge in (("single provider", "", False), ("failover", "openai", False),
+                                      ("failover + hedging", "openai", True)):
+            os.environ["JARVIS_LLM_PROVIDERS"] = backups
+            jarvis.llm_router = router = jarvis.LLMRouter(jarvis.llm_providers, hedge=hedge)
+            Flaky.rng = random.Random(1)
+            samples, errors = [], 0
+            for i in range(args.iterations):
+                t0 = time.perf_counter()
+                try:
+                    router.complete(f"question {i}")
+                except Exception:
+                    errors += 1
+                    continue
+                samples.append(time.perf_counter() - t0)
+            _report(label, samples, unit="ms", scale=1e3)
+            print(f"  errors: {errors}/{args.iterations}, hedged: {router.hedged}, failovers: {router.failovers}")
+            if backups:
+                assert errors == 0, f"{label}: {errors} errors with a healthy backup"
+                assert not Flaky.fail_rate or router.failovers > 0, f"{label}: injected failures caused no failover"
+            if hedge:
+                assert not Flaky.slow_rate or router.hedged > 0, f"{label}: injected stalls were never hedged"
+    finally:
+        Flaky.fail_rate, Flaky.slow_rate = faults
+        jarvis.llm_router = saved
+        os.environ.pop("JARVIS_LLM_PROVIDERS", None)
+        flaky.shutdown()
+        backup.shutdown()
+
+
+def bench_tts(args) -> None:
+    """Speech pipeline overhead with the silent null backend."""
+    backend = jarvis._NullBackend(chars_per_second=0)
+    started: list[float] = []
+    real_speak = backend.speak
+    backend.speak = lambda text: (started.append(time.perf_counter()), real_speak(text))
+    threads_before = threading.active_count()
+    pipeline = jarvis.SpeechPipeline(backend_factory=lambda cache: backend)
+    samples = []
+    for i in range(args.messages):
+        started.clear()
+        t0 = time.perf_counter()
+        pipeline.say(f"Message number {i} is long enough that it is never merged with the next one.")
+        pipeline.wait_idle(5)
+        samples.append(started[0] - t0)
+    _report("enqueue to backend start", samples, unit="ms", scale=1e3)
+    backend.spoken.clear()
+    for i in range(args.messages):
+        pipeline.say("Paused." if i % 2 else "Next.")
+    pipeline.wait_idle(30)
+    print(f"{args.messages} short messages spoken as {len(backend.spoken)} utterances; "
+          f"threads created: {threading.active_count() - threads_before}")
+
+
+# Vowel-like formant sequences standing in for spoken words in synthetic wake fixtures
+_SYNTH_WAKE = ((730, 1090), (270, 2290), (640, 1190), (300, 2500), (3500, 5000))
+_SYNTH_OTHERS = (
+    ((300, 870), (530, 1840), (660, 1720)),
+    ((390, 1990), (270, 2290), (440, 1020), (570, 840)),
+    ((640, 1190), (730, 1090), (300, 870)),
+    ((3500, 5000), (270, 2290), (530, 1840), (730, 1090)),
+)
+
+
+def _numpy():
+    """numpy for the audio benchmarks, which synthesize and analyze PCM; exits with a hint when it is missing."""
+    try:
+        import numpy
+    except ImportError:
+        raise SystemExit("this benchmark needs numpy for its audio fixtures: pip install numpy")
+    return numpy
+
+
+def _synth_word(formants, seconds: float, rng, rate: int = 16000) -> bytes:
+    """A crude voiced 'word': harmonics of a pitch shaped by a formant sequence, plus noise."""
+    np = _numpy()
+    f0 = rng.uniform(95, 170)
+    seg = int(seconds * rng.uniform(0.85, 1.15) * rate / len(formants))
+    t = np.arange(seg) / rate
+    out = []
+    for f1, f2 in formants:
+        if f1 > 3000:
+            # Fricative ("s"): band-limited noise
+            y = np.diff(rng.normal(0, 1, seg + 1)) * 0.5
+        else:
+            y = np.zeros(seg)
+            for h in range(1, int(4000 / f0)):
+                f = h * f0
+                gain = np.exp(-((f - f1) / 120.0) ** 2) + 0.6 * np.exp(-((f - f2) / 180.0) ** 2) + 0.02
+                y += gain * np.sin(2 * np.pi * f * t + rng.uniform(0, 2 * np.pi))
+        out.append(y / (np.abs(y).max() + 1e-9))
+    y = np.concatenate(out) * np.hanning(seg * len(formants)) ** 0.3 * rng.uniform(4000, 9000)
+    return y.astype("<i2").tobytes()
+
+
+def _write_wav(path: str, pcm: bytes, rate: int = 16000) -> None:
+    import wave
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm)
+
+
+def _synth_wake_fixtures(root: str, count: int, seed: int = 7) -> None:
+    """templates/, positive/ and negative/ folders of synthetic 16 kHz recordings."""
+    np = _numpy()
+    rng = np.random.default_rng(seed)
+
+    def _padded(pcm: bytes) -> bytes:
+        pad = lambda sec: rng.normal(0, 40, int(16000 * sec)).astype("<i2").tobytes()
+        return pad(rng.uniform(0.5, 1.0)) + pcm + pad(1.2)
+
+    for name in ("templates", "positive", "negative"):
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+    for i in range(3):
+        _write_wav(os.path.join(root, "templates", f"t{i}.wav"), _padded(_synth_word(_SYNTH_WAKE, 0.6, rng)))
+    for i in range(count):
+        _write_wav(os.path.join(root, "positive", f"p{i}.wav"), _padded(_synth_word(_SYNTH_WAKE, 0.6, rng)))
+        other = _SYNTH_OTHERS[i % len(_SYNTH_OTHERS)]
+        _write_wav(os.path.join(root, "negative", f"n{i}.wav"), _padded(_synth_word(other, 0.15 * len(other) + 0.2, rng)))
+
+
+def bench_wake(args) -> None:
+    """Offline wake-word detection on WAV fixtures: latency, CPU per audio second, false accepts."""
+    tmp = None
+    root = args.fixtures
+    if not root:
+        tmp = tempfile.TemporaryDirectory()
+        root = tmp.name
+        _synth_wake_fixtures(root, args.count)
+        print(f"using {args.count} synthetic positive/negative fixtures (pass --fixtures DIR for recordings)")
+    detector = jarvis.TemplateWakeDetector(os.path.join(root, "templates"))
+    if not detector.ready:
+        raise SystemExit(f"need at least {detector.MIN_TEMPLATES} templates in {root}/templates (and numpy)")
+    print(f"threshold {detector.threshold:.2f}")
+    results = {}
+    for label in ("positive", "negative"):
+        folder = os.path.join(root, label)
+        phrases = accepted = 0
+        audio_seconds = 0.0
+        latencies = []
+        cpu0 = time.process_time()
+        for name in sorted(os.listdir(folder)):
+            if not name.lower().endswith(".wav"):
+                continue
+            stream = jarvis.AudioStream(lambda: jarvis.WavFileSource(os.path.join(folder, name)))
+            stream.start()
+            cursor = 0
+            hit = False
+            while True:
+                audio, cursor = stream.capture_phrase(cursor, timeout=2, phrase_limit=3, pause=args.pause)
+                if audio is None:
+                    break
+                phrases += 1
+                t0 = time.perf_counter()
+                if detector.detect(audio):
+                    hit = True
+                    # Endpointing waits for the pause after the word, then scoring runs
+                    latencies.append(args.pause + time.perf_counter() - t0)
+                if stream.ended:
+                    break
+            stream.stop()
+            accepted += hit
+            audio_seconds += stream.position * stream.frame_seconds
+        cpu = time.process_time() - cpu0
+        results[label] = (phrases, accepted, audio_seconds, latencies, cpu)
+    p_phrases, p_hits, p_audio, p_lat, p_cpu = results["positive"]
+    n_phrases, n_hits, n_audio, _, n_cpu = results["negative"]
+    files = len([n for n in os.listdir(os.path.join(root, "positive")) if n.lower().endswith(".wav")])
+    print(f"detection rate          {p_hits}/{files} ({100.0 * p_hits / max(1, files):.1f}%)")
+    if p_lat:
+        _report("detection latency (end of word)", p_lat, unit="ms", scale=1e3)
+    print(f"CPU per audio second    {1e3 * (p_cpu + n_cpu) / max(1e-9, p_audio + n_audio):.1f}ms")
+    print(f"false accepts           {n_hits}/{n_phrases} phrases "
+          f"({3600.0 * n_hits / max(1e-9, n_audio):.1f} per hour of non-wake audio)")
+    print(f"cloud recognizer calls  {p_hits + n_hits} of {p_phrases + n_phrases} phrases "
+          f"(without the local gate: {p_phrases + n_phrases})")
+    if tmp is not None:
+        tmp.cleanup()
+
+
+def _word_errors(reference: str, hypothesis: str) -> tuple[int, int]:
+    """(word edit distance, reference length) for word error rate."""
+    ref, hyp = jarvis._tokenize(reference), jarvis._tokenize(hypothesis or "")
+    row = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (r != h))
+    return row[-1], len(ref)
+
+
+def _labeled_wavs(folder: str) -> list[tuple[str, str]]:
+    """(path, transcript) pairs; the transcript is in a .txt next to the WAV, else the file name."""
+    pairs = []
+    for name in sorted(os.listdir(folder)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() != ".wav":
+            continue
+        label_path = os.path.join(folder, stem + ".txt")
+        if os.path.isfile(label_path):
+            with open(label_path, encoding="utf-8") as fh:
+                label = fh.read().strip()
+        else:
+            label = re.sub(r"[_\-]+", " ", re.sub(r"[_\-]?\d+$", "", stem))
+        pairs.append((os.path.join(folder, name), label))
+    return pairs
+
+
+def bench_stt(args) -> None:
+    """Transcription latency and accuracy per recognizer backend on a folder of labeled WAVs."""
+    import wave
+    samples = _labeled_wavs(args.wavs)
+    if not samples:
+        raise SystemExit(f"no .wav files in {args.wavs}")
+    clips = []
+    for path, label in samples:
+        with wave.open(path, "rb") as w:
+            clips.append((jarvis.sr.AudioData(w.readframes(w.getnframes()), w.getframerate(), w.getsampwidth()), label))
+    for name in args.backends.split(","):
+        stt = jarvis.SpeechToText([name.strip()])
+        if not stt.backends():
+            print(f"{name}: not available")
+            continue
+        if not args.grammar:
+            stt.backends()[0].supports_grammar = False
+        latencies = []
+        errors = words = exact = fast = 0
+        for audio, label in clips:
+            t0 = time.perf_counter()
+            try:
+                text = stt.transcribe(audio)
+            except Exception:
+                text = None
+            latencies.append(time.perf_counter() - t0)
+            e, n = _word_errors(label, text or "")
+            errors += e
+            words += n
+            exact += e == 0
+            fast += (stt.last_backend or "").endswith("-grammar") and text is not None
+        _report(f"{name} transcribe", latencies, unit="ms", scale=1e3)
+        print(f"  WER {100.0 * errors / max(1, words):.1f}%  exact {exact}/{len(clips)}  grammar fast path {fast}/{len(clips)}")
+
+
+class _DelayedSTT:
+    """Recognizer backend stand-in that answers after a fixed delay (a cloud round trip)."""
+
+    name = "delayed"
+    supports_grammar = False
+    available = True
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+
+    def transcribe(self, audio, grammar=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        return "what time is it"
+
+
+def _synth_command_fixtures(root: str, count: int, seed: int = 11) -> None:
+    """Synthetic commands: 2-4 'words' with short gaps, some ending in a quiet fricative."""
+    np = _numpy()
+    rng = np.random.default_rng(seed)
+    words = (_SYNTH_WAKE,) + _SYNTH_OTHERS
+    noise = lambda sec: rng.normal(0, 40, int(16000 * sec)).astype("<i2").tobytes()
+    for i in range(count):
+        pcm = noise(rng.uniform(0.4, 0.8))
+        for k in range(int(rng.integers(2, 5))):
+            if k:
+                pcm += noise(rng.uniform(0.08, 0.25))
+            pcm += _synth_word(words[int(rng.integers(len(words)))], rng.uniform(0.35, 0.6), rng)
+        if i % 2:
+            # Trailing "s": quiet noise that an energy-only endpointer cuts off
+            pcm += (np.diff(rng.normal(0, 1, 3201)) * 80).astype("<i2").tobytes()
+        _write_wav(os.path.join(root, f"command_{i}.wav"), pcm + noise(1.5))
+
+
+def _speech_end(path: str, frame_ms: int = jarvis.AUDIO_FRAME_MS) -> float:
+    """Seconds to the last frame clearly above the recording's leading background level."""
+    import wave
+    np = _numpy()
+    with wave.open(path, "rb") as w:
+        rate = w.getframerate()
+        x = np.frombuffer(w.readframes(w.getnframes()), dtype="<i2").astype(np.float64)
+    n = int(rate * frame_ms / 1000)
+    rms = np.sqrt((x[:len(x) // n * n].reshape(-1, n) ** 2).mean(axis=1))
+    loud = np.nonzero(rms > 1.5 * np.median(rms[:10]))[0]
+    return (int(loud[-1]) + 1) * frame_ms / 1000 if len(loud) else 0.0
+
+
+def bench_endpoint(args) -> None:
+    """End-of-speech to transcript latency: energy endpointing vs VAD with speculative recognition (realtime replay)."""
+    _numpy()
+    tmp = None
+    root = args.fixtures
+    if not root:
+        tmp = tempfile.TemporaryDirectory()
+        root = tmp.name
+        _synth_command_fixtures(root, args.count)
+        print(f"using {args.count} synthetic commands (pass --fixtures DIR for recordings); "
+              f"recognizer answers after {args.stt_delay * 1e3:.0f}ms")
+    paths = [os.path.join(root, n) for n in sorted(os.listdir(root)) if n.lower().endswith(".wav")]
+    modes = (
+        ("energy, 0.8s pause, recognise after", dict(pause=0.8, phrase_limit=8, vad=False, speculate=False)),
+        (f"VAD, {args.silence}s silence, speculative", dict(pause=args.silence, phrase_limit=jarvis.COMMAND_MAX_SECONDS,
+                                                          vad=True, speculate=True)),
+    )
+    for label, mode in modes:
+        backend = _DelayedSTT(args.stt_delay)
+        stt = jarvis.SpeechToText([])
+        stt._backends = [backend]
+        latencies = []
+        clipped = hits = 0
+        for path in paths:
+            speech_end = _speech_end(path)
+            source = jarvis.WavFileSource(path, realtime=True)
+            stream = jarvis.AudioStream(lambda: source)
+            if not mode["vad"]:
+                stream.FRICATIVE_ZCR = float("inf")
+            stream.start()
+            session = jarvis.RecognitionSession(stt, stream.sample_rate, stream.sample_width) if mode["speculate"] else None
+            audio, end = stream.capture_phrase(0, timeout=5, phrase_limit=mode["phrase_limit"], pause=mode["pause"],
+                                               listener=session)
+            if audio is None:
+                stream.stop()
+                continue
+            text = session.finish(audio) if session is not None else stt.transcribe(audio)
+            latencies.append(time.monotonic() - (source._t0 + speech_end))
+            pause_frames = max(1, int(mode["pause"] / stream.frame_seconds))
+            clipped += (end - pause_frames) * stream.frame_seconds < speech_end - stream.frame_seconds / 2
+            hits += bool(session and session.speculative_hit and text)
+            stream.stop()
+        _report(label, latencies, unit="ms", scale=1e3)
+        print(f"  ended before the last speech frame: {clipped}/{len(paths)}  speculative hits: {hits}  "
+              f"recognizer calls: {backend.calls}")
+    if tmp is not None:
+        tmp.cleanup()
+
+
+class _LabelSTT(_DelayedSTT):
+    """Answers with the label of the clip being replayed, after a fixed delay."""
+
+    label = ""
+
+    def transcribe(self, audio, grammar=None):
+        super().transcribe(audio, grammar)
+        return self.label
+
+
+_SESSION_COMMANDS = ("what time is it", "pause", "next song", "pwd", "what is the date", "can you hear me")
+
+
+def bench_speculate(args) -> None:
+    """Perceived latency (end of speech to first reply audio) with and without speculative intents."""
+    np = _numpy()
+    tmp = tempfile.TemporaryDirectory()
+    folder = args.sessions
+    if not folder:
+        folder = os.path.join(tmp.name, "session")
+        os.makedirs(folder)
+        rng = np.random.default_rng(5)
+        words = (_SYNTH_WAKE,) + _SYNTH_OTHERS
+        noise = lambda sec: rng.normal(0, 40, int(16000 * sec)).astype("<i2").tobytes()
+        for i in range(args.count):
+            label = _SESSION_COMMANDS[i % len(_SESSION_COMMANDS)]
+            pcm = noise(0.5)
+            for k, _ in enumerate(label.split()):
+                pcm += (noise(0.06) if k else b"") + _synth_word(words[int(rng.integers(len(words)))], 0.35, rng)
+            _write_wav(os.path.join(folder, f"{i:02d}.wav"), pcm + noise(1.5))
+            with open(os.path.join(folder, f"{i:02d}.txt"), "w", encoding="utf-8") as fh:
+                fh.write(label)
+        print(f"replaying {args.count} synthetic commands (pass a folder of labeled WAVs to replay a recorded session); "
+              f"recognizer answers after {args.stt_delay * 1e3:.0f}ms")
+    clips = _labeled_wavs(folder)
+    backend = jarvis._NullBackend(chars_per_second=0)
+    first_audio: list[float] = []
+    for method in ("speak", "play"):
+        real = getattr(backend, method)
+        setattr(backend, method, lambda arg, real=real: (first_audio.append(time.monotonic()), real(arg)))
+    stt_backend = _LabelSTT(args.stt_delay)
+    saved = (jarvis.tts, jarvis.audio_stream, jarvis.speech_to_text, jarvis.SPECULATIVE_INTENTS)
+    jarvis.tts = jarvis.SpeechPipeline(backend_factory=lambda cache: backend,
+                                       phrase_audio=jarvis.PhraseAudioCache(os.path.join(tmp.name, "phrases")))
+    jarvis.speech_to_text = jarvis.SpeechToText([])
+    jarvis.speech_to_text._backends = [stt_backend]
+    try:
+        for label, speculate in (("final transcript only", False), ("speculative intents", True)):
+            jarvis.SPECULATIVE_INTENTS = speculate
+            samples = []
+            prerendered = 0
+            for path, text in clips:
+                speech_end = _speech_end(path)
+                source = jarvis.WavFileSource(path, realtime=True)
+                jarvis.audio_stream = jarvis.AudioStream(lambda: source)
+                stt_backend.label = text
+                jarvis.tts.wait_idle(5)
+                hits_before = jarvis.tts.phrase_audio.hits
+                first_audio.clear()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    query = jarvis.takecommand(0)
+                    if query is not None:
+                        jarvis._handle_query(query)
+                jarvis.tts.wait_idle(5)
+                if first_audio:
+                    samples.append(first_audio[0] - (source._t0 + speech_end))
+                prerendered += jarvis.tts.phrase_audio.hits > hits_before
+                jarvis.audio_stream.stop()
+            _report(f"perceived latency, {label}", samples, unit="ms", scale=1e3)
+            print(f"  replies played from pre-rendered audio: {prerendered}/{len(clips)}")
+    finally:
+        jarvis.tts, jarvis.audio_stream, jarvis.speech_to_text, jarvis.SPECULATIVE_INTENTS = saved
+        tmp.cleanup()
+
+
+def bench_memory(args) -> None:
+    """Prompt size and context-assembly time over a long conversation with the token-budgeted memory."""
+    import random
+    rng = random.Random(3)
+    words = "the weather in paris tomorrow will be sunny with a light breeze and temperatures near twenty degrees".split()
+    sentence = lambda n: " ".join(rng.choice(words) for _ in range(n)).capitalize() + "."
+    summaries = []
+    memory = jarvis.ConversationMemory(budget=args.budget, summary_budget=args.summary_budget,
+                                      summarizer=lambda text, limit: summaries.append(text) or sentence(limit // 2))
+    prompt_tokens, samples = [], []
+    for _ in range(args.turns):
+        question = sentence(rng.randint(4, 14)) + " And what about tomorrow?"
+        t0 = time.perf_counter()
+        system_prompt, history = memory.context(question)
+        samples.append(time.perf_counter() - t0)
+        prompt_tokens.append(sum(jarvis._estimate_tokens(m["content"]) for m in
+                                 jarvis._llm_messages(system_prompt, history, question)))
+        memory.add(question, " ".join(sentence(rng.randint(8, 20)) for _ in range(rng.randint(1, 4))))
+    _report("context()", samples)
+    print(f"estimated prompt tokens over {args.turns} turns: first={prompt_tokens[0]} "
+          f"max={max(prompt_tokens)} last={prompt_tokens[-1]} (budget {args.budget})")
+    print(f"  history kept: {memory.stats()}, background summaries: {len(summaries)}")
+    try:
+        import tiktoken
+    except ImportError:
+        return
+    enc = tiktoken.get_encoding("cl100k_base")
+    text = " ".join(summaries[-5:]) or sentence(200)
+    print(f"  estimate vs cl100k_base on {len(text)} chars: {jarvis._estimate_tokens(text)} vs {len(enc.encode(text))}")
+
+
+def bench_files(args) -> None:
+    """File index lookups (exact, prefix, substring, miss) on a generated tree, and a check that none scans the table."""
+    rng = random.Random(2)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9)))
+                  for _ in range(2000)]
+    word = lambda: rng.choice(vocabulary)
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, "home")
+        names = []
+        for i in range(args.files):
+            folder = os.path.join(root, f"dir{i % 50}", f"sub{i % 7}")
+            os.makedirs(folder, exist_ok=True)
+            name = f"{word()}_{word()}_{i}.txt"
+            open(os.path.join(folder, name), "w").close()
+            names.append(name)
+        index = jarvis.FileIndex(os.path.join(tmp, "files.sqlite3"))
+        t0 = time.perf_counter()
+        index.refresh(root)
+        print(f"indexed {args.files} files in {time.perf_counter() - t0:.2f}s")
+        picks = [rng.choice(names) for _ in range(args.iterations)]
+        for label, make in (("exact", lambda n: n), ("prefix", lambda n: n[:8]),
+                            ("substring", lambda n: n[len(n) // 3:len(n) // 3 + 9]), ("miss", lambda n: "zzq" + n[:5])):
+            samples, found = [], 0
+            for name in picks:
+                t0 = time.perf_counter()
+                path = index.lookup(make(name), roots=[root])
+                samples.append(time.perf_counter() - t0)
+                found += path is not None and make(name) in os.path.basename(path)
+            _report(f"lookup {label}", samples, unit="ms", scale=1e3)
+            if label != "miss":
+                assert found == len(picks), f"{label}: {found}/{len(picks)} found"
+        with index._lock:
+            plan = index._db().execute("EXPLAIN QUERY PLAN SELECT path, name FROM entries WHERE rowid IN "
+                                       "(SELECT id FROM grams WHERE gram=? INTERSECT SELECT id FROM grams WHERE gram=?) "
+                                       "AND is_dir=0 AND instr(name, ?)>0", ("rep", "ort", "report")).fetchall()
+        scans = [row[-1] for row in plan if row[-1].startswith("SCAN entries")]
+        assert not scans, f"substring lookup scans the table: {scans}"
+        print("  query plan: no full scan of entries")
+
+
+def bench_music(args) -> None:
+    """Music library: initial scan, unchanged rescan and lookup latency on a generated library."""
+    rng = random.Random(9)
+    syllables = ["la", "mo", "ri", "ka", "ne", "so", "vu", "pe", "ta", "lin", "dor", "mar", "sel", "quin", "bra"]
+    word = lambda: "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+    artists = [f"{word()} {word()}".title() for _ in range(max(1, args.tracks // 40))]
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, "Music")
+        titles = []
+        for i in range(args.tracks):
+            artist = artists[i % len(artists)]
+            title = " ".join(word() for _ in range(rng.randint(1, 4))).title()
+            folder = os.path.join(root, artist, f"Album {i // 12 % 4}")
+            os.makedirs(folder, exist_ok=True)
+            open(os.path.join(folder, f"{i % 12 + 1:02d} {artist} - {title}.mp3"), "w").close()
+            titles.append((title, artist))
+        library = jarvis.MusicLibrary(os.path.join(tmp, "music.sqlite3"), roots=[root])
+        t0 = time.perf_counter()
+        library.start()
+        while not library.ready():
+            time.sleep(0.01)
+        print(f"initial scan ({args.tracks} tracks): {(time.perf_counter() - t0):.2f}s")
+        t0 = time.perf_counter()
+        changed = library.scan()
+        print(f"rescan, nothing changed: {(time.perf_counter() - t0) * 1e3:.0f}ms ({changed} changed)")
+        misheard = lambda text: text[:2] + text[3:] if len(text) > 5 else text
+        picks = [titles[rng.randrange(len(titles))] for _ in range(args.iterations)]
+        for label, make in (("exact title", lambda t, a: t), ("title by artist", lambda t, a: f"{t} by {a}"),
+                            ("artist", lambda t, a: a), ("misheard title", lambda t, a: misheard(t)),
+                            ("miss", lambda t, a: "zzyzx qwv")):
+            samples = []
+            hits = 0
+            for title, artist in picks:
+                query = make(title, artist).lower()
+                t0 = time.perf_counter()
+                found = library.search(query, limit=5)
+                samples.append(time.perf_counter() - t0)
+                hits += any(title in path for _score, path in found)
+            _report(f"lookup {label}", samples, unit="ms", scale=1e3)
+            if label != "miss" and label != "artist":
+                print(f"  wanted track in top 5: {hits}/{len(picks)}")
+
+
+def bench_stream_cache(args) -> None:
+    """Online play resolution: full search vs cached query vs re-resolving an expired stream URL."""
+
+    class StubExtractor:
+        def __init__(self):
+            self.searches = self.resolves = 0
+
+        def _info(self, video_id, ttl):
+            expire = int(time.time() + ttl)
+            return {"id": video_id, "title": f"Video {video_id}", "duration": 200,
+                    "url": f"https://stream.example/{video_id}?expire={expire}&sig=x"}
+
+        def search(self, query):
+            self.searches += 1
+            time.sleep(args.search_delay)
+            return self._info(hashlib.sha1(query.encode()).hexdigest()[:11], args.url_ttl)
+
+        def resolve(self, video_id, background=False):
+            self.resolves += 1
+            time.sleep(args.resolve_delay)
+            return self._info(video_id, args.url_ttl)
+
+    queries = [f"song number {i} by artist {i % 7}" for i in range(args.queries)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stream_cache.json")
+        extractor = StubExtractor()
+        cache = jarvis.StreamCache(path, extractor=extractor)
+        for label, spoken in (("cold (search + extract)", lambda q: q),
+                              ("warm replay", lambda q: q),
+                              ("warm, different phrasing", lambda q: f"  {q.upper()}!")):
+            samples = []
+            for q in queries:
+                t0 = time.perf_counter()
+                url, _title = cache.resolve(spoken(q))
+                samples.append(time.perf_counter() - t0)
+                assert url
+            _report(label, samples, unit="ms", scale=1e3)
+        reloaded = jarvis.StreamCache(path, extractor=extractor)
+        samples = []
+        for q in queries:
+            t0 = time.perf_counter()
+            reloaded.resolve(q)
+            samples.append(time.perf_counter() - t0)
+        _report("warm after restart", samples, unit="ms", scale=1e3)
+        for entry in reloaded._streams.values():
+            entry["expires"] = time.time() - 1
+        samples = []
+        for q in queries:
+            t0 = time.perf_counter()
+            reloaded.resolve(q)
+            samples.append(time.perf_counter() - t0)
+        _report("expired URL (resolve by id)", samples, unit="ms", scale=1e3)
+        for entry in reloaded._streams.values():
+            entry["expires"] = time.time() + reloaded.REFRESH_AHEAD / 2
+        before = extractor.resolves
+        samples = []
+        for q in queries:
+            t0 = time.perf_counter()
+            reloaded.resolve(q)
+            samples.append(time.perf_counter() - t0)
+        _report("expiring URL (background refresh)", samples, unit="ms", scale=1e3)
+        deadline = time.time() + 10
+        while reloaded._refreshing and time.time() < deadline:
+            time.sleep(0.01)
+        print(f"  background refreshes: {extractor.resolves - before}; extractor totals: "
+              f"{extractor.searches} searches, {extractor.resolves} resolves")
+        assert extractor.resolves - before >= 1, "expiring URLs were never refreshed in the background"
+        print(f"  {reloaded.stats()}")
+
+
+def bench_online_queue(args) -> None:
+    """Online queue on a stub VLC: track-to-track gap with and without next-track prefetch, and object counts."""
+    counts = {"players": 0, "media": 0, "released": 0}
+    gaps: list[float] = []
+
+    class Media:
+        def __init__(self, url):
+            counts["media"] += 1
+            self.url, self.parsed = url, False
+
+        def parse_with_options(self, flags, timeout):
+            time.sleep(args.open_delay)
+            self.parsed = True
+
+        def release(self):
+            counts["released"] += 1
+
+    class Player:
+        def __init__(self):
+            counts["players"] += 1
+            self.media, self.playing, self.generation, self.callbacks = None, False, 0, []
+
+        def event_manager(self):
+            return self
+
+        def event_attach(self, event, callback):
+            self.callbacks.append(callback)
+
+        def audio_set_volume(self, volume):
+            pass
+
+        def set_media(self, media):
+            self.media = media
+
+        def is_playing(self):
+            return self.playing
+
+        def pause(self):
+            self.playing = False
+
+        def stop(self):
+            self.generation += 1
+            self.playing = False
+
+        def play(self):
+            self.generation += 1
+            generation, media = self.generation, self.media
+
+            def run():
+                if not media.parsed:
+                    time.sleep(args.open_delay)
+                if ended[0] is not None:
+                    gaps.append(time.perf_counter() - ended[0])
+                    ended[0] = None
+                self.playing = True
+                time.sleep(args.track)
+                if generation == self.generation:
+                    self.playing = False
+                    ended[0] = time.perf_counter()
+                    for callback in self.callbacks:
+                        callback(None)
+
+            threading.Thread(target=run, daemon=True).start()
+
+    class Instance:
+        def media_player_new(self):
+            return Player()
+
+        def media_new(self, url):
+            return Media(url)
+
+    class StubExtractor:
+        def _info(self, video_id):
+            return {"id": video_id, "title": f"Track {video_id}",
+                    "url": f"https://stream.example/{video_id}?expire={int(time.time() + 3600)}"}
+
+        def search(self, query):
+            time.sleep(args.resolve_delay)
+            return self._info(hashlib.sha1(query.encode()).hexdigest()[:11])
+
+        def resolve(self, video_id, background=False):
+            time.sleep(args.resolve_delay)
+            return self._info(video_id)
+
+        def search_many(self, query, count):
+            time.sleep(args.resolve_delay)
+            return [{"id": f"{query[:4]}{i:07d}", "title": f"{query} part {i}"} for i in range(count)]
+
+    vlc = types.SimpleNamespace(Instance=Instance, EventType=types.SimpleNamespace(MediaPlayerEndReached="end"),
+                                MediaParseFlag=types.SimpleNamespace(network=1))
+    jarvis._OPTIONAL_MODULES["vlc"] = vlc
+    jarvis._speak_and_log = lambda text: None
+    for prefetch in (False, True):
+        counts.update(players=0, media=0, released=0)
+        gaps.clear()
+        ended = [None]
+        jarvis.stream_cache = jarvis.StreamCache(None, extractor=StubExtractor())
+        jarvis._AudioPlayer.PREFETCH = prefetch
+        player = jarvis._AudioPlayer()
+        player.play_radio("bench", count=args.tracks)
+        while len(gaps) < args.tracks - 1 and (player.is_active() or player.upcoming()):
+            time.sleep(0.01)
+        player.stop()
+        _report(f"gap between tracks, prefetch {'on' if prefetch else 'off'}", gaps, unit="ms", scale=1e3)
+        print(f"  players created {counts['players']}, media alive {counts['media'] - counts['released']} "
+              f"of {counts['media']}, queue kept {len(player._queue)} entries")
+        assert counts["players"] == 1, f"expected one reused player, created {counts['players']}"
+        assert counts["media"] - counts["released"] <= 2, "media objects leak across tracks"
+
+
+class _AudioFileHandler(http.server.BaseHTTPRequestHandler):
+    """Serves ``/track/<id>`` as ``size`` bytes of filler audio at a throttled rate."""
+
+    size = 1 << 20
+    rate = 8 << 20  # bytes per second
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/webm")
+        self.send_header("Content-Length", str(self.size))
+        self.end_headers()
+        chunk = b"\0" * (64 << 10)
+        try:
+            for _ in range(self.size // len(chunk)):
+                self.wfile.write(chunk)
+                time.sleep(len(chunk) / self.rate)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the player only wanted the first bytes
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_audio_cache(args) -> None:
+    """Offline audio cache: hit ratio under Zipf-distributed replays and time to a playable source."""
+    _AudioFileHandler.size = args.track_kb << 10
+    server, base = _start_mock_server(_AudioFileHandler)
+    base = base.rsplit("/", 1)[0]
+
+    class StubExtractor:
+        def _info(self, video_id):
+            return {"id": video_id, "title": f"Track {video_id}", "url": f"{base}/track/{video_id}"}
+
+        def search(self, query):
+            time.sleep(args.resolve_delay)
+            return self._info(query.split()[-1])
+
+        def resolve(self, video_id, background=False):
+            time.sleep(args.resolve_delay)
+            return self._info(video_id)
+
+    rng = random.Random(5)
+    weights = [1 / (rank + 1) ** args.zipf for rank in range(args.tracks)]
+    plays = rng.choices(range(args.tracks), weights=weights, k=args.plays)
+    jarvis._speak_and_log = lambda text: None
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            budget = args.budget_mb << 20
+            jarvis.stream_cache = jarvis.StreamCache(None, extractor=StubExtractor())
+            cache = jarvis.audio_cache = jarvis.AudioCache(os.path.join(tmp, "audio"), max_bytes=budget)
+            player = jarvis._AudioPlayer()
+            hit_samples, miss_samples = [], []
+            lru: collections.OrderedDict[int, None] = collections.OrderedDict()
+            lru_hits = 0
+            for track in plays:
+                entry = {"query": f"song {track:05d}", "title": None, "url": None}
+                t0 = time.perf_counter()
+                source = player._resolve(entry)
+                elapsed = time.perf_counter() - t0
+                if entry.get("local"):
+                    hit_samples.append(elapsed)
+                else:
+                    # Streaming starts once the first bytes arrive; the download then fills the cache
+                    with urllib.request.urlopen(source) as resp:
+                        resp.read(1 << 16)
+                    miss_samples.append(time.perf_counter() - t0)
+                    cache.fetch_later(entry["id"], source)
+                    while entry["id"] in cache._fetching:
+                        time.sleep(0.005)
+                if track in lru:
+                    lru_hits += 1
+                    lru.move_to_end(track)
+                else:
+                    lru[track] = None
+                    while len(lru) * _AudioFileHandler.size > budget:
+                        lru.popitem(last=False)
+            _report("cache hit, local file", hit_samples, unit="ms", scale=1e3)
+            _report("miss, resolve + first bytes", miss_samples, unit="ms", scale=1e3)
+            s = cache.stats()
+            print(f"{args.plays} plays over {args.tracks} tracks, budget {args.budget_mb} MB "
+                  f"({budget // _AudioFileHandler.size} tracks): hit ratio {s['hit_ratio']:.1%} "
+                  f"(plain LRU would get {lru_hits / len(plays):.1%}), {s['evictions']} evictions, "
+                  f"{s['bytes'] >> 20} MB on disk")
+            assert s["bytes"] <= budget, f"cache holds {s['bytes']} bytes over a {budget} byte budget"
+            assert hit_samples, "replayed tracks were never served from the cache"
+    finally:
+        server.shutdown()
+
+
+def bench_player(args) -> None:
+    """Local playback: a process per track (the old os.startfile path) vs the shared in-process player."""
+
+    class State:
+        NothingSpecial, Opening, Playing, Paused, Stopped, Ended, Error = range(7)
+
+    class Player:
+        def __init__(self):
+            self.media, self.state, self.started, self.offset = None, State.NothingSpecial, 0.0, 0.0
+
+        def event_manager(self):
+            return self
+
+        def event_attach(self, event, callback):
+            pass
+
+        def audio_set_volume(self, volume):
+            pass
+
+        def set_media(self, media):
+            self.media = media
+
+        def play(self):
+            if self.state != State.Paused:
+                self.offset = 0.0
+            self.state, self.started = State.Playing, time.perf_counter()
+
+        def pause(self):
+            self.offset, self.state = self.get_time() / 1000, State.Paused
+
+        def stop(self):
+            self.state = State.Stopped
+
+        def is_playing(self):
+            return self.state == State.Playing
+
+        def get_state(self):
+            return self.state
+
+        def get_time(self):
+            running = time.perf_counter() - self.started if self.state == State.Playing else 0.0
+            return int((self.offset + running) * 1000)
+
+        def set_time(self, ms):
+            self.offset, self.started = ms / 1000, time.perf_counter()
+
+        def get_length(self):
+            return 240_000
+
+    class Media:
+        def __init__(self, path):
+            self.path = path
+
+        def release(self):
+            pass
+
+    class Instance:
+        def media_player_new(self):
+            return Player()
+
+        def media_new(self, path):
+            return Media(path)
+
+    jarvis._OPTIONAL_MODULES["vlc"] = types.SimpleNamespace(
+        Instance=Instance, State=State, EventType=types.SimpleNamespace(MediaPlayerEndReached="end"),
+        MediaParseFlag=types.SimpleNamespace(network=1))
+    jarvis._speak_and_log = lambda text: None
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(args.tracks):
+            paths.append(os.path.join(tmp, f"Artist {i % 5} - Song {i}.mp3"))
+            open(paths[-1], "wb").close()
+        samples = []
+        for path in paths:
+            t0 = time.perf_counter()
+            subprocess.Popen([sys.executable, "-c", "pass"]).wait()
+            samples.append(time.perf_counter() - t0)
+        _report("process per track (lower bound)", samples, unit="ms", scale=1e3)
+        jarvis._AudioPlayer.PREFETCH = False
+        player = jarvis._AudioPlayer()
+        actions = (("play_file", player.play_file), ("pause", lambda p: player.pause()),
+                   ("resume", lambda p: player.resume()), ("seek +30s", lambda p: player.seek(30)),
+                   ("now_playing", lambda p: player.now_playing()))
+        samples = {label: [] for label, _action in actions}
+        for path in paths:
+            for label, action in actions:
+                t0 = time.perf_counter()
+                ok = action(path)
+                samples[label].append(time.perf_counter() - t0)
+                assert ok, label
+        for label, _action in actions:
+            _report(f"in-process {label}", samples[label], unit="ms", scale=1e3)
+        for path in paths[1:4]:
+            player.enqueue_file(path)
+        print(f"  now playing: {player.now_playing()}")
+        print(f"  after next: {player.next() and player.now_playing()['title']}, queue {player.upcoming()}")
+        player.pause()
+        print(f"  after pause: {player.now_playing()['state']}; after stop: active={player.stop() and player.is_active()}")
+        assert not player.stop(), "stop() claimed to stop a player that was already stopped"
+
+
+def bench_commands(args) -> None:
+    """Burst of commands: a thread per command (old) vs the event loop core's bounded executors."""
+    jarvis.intent_router.register("bench_work", lambda q: time.sleep(args.work), exact=("bench work",), priority=90)
+    peak = [threading.active_count()]
+    stop = threading.Event()
+
+    def watch():
+        while not stop.is_set():
+            peak[0] = max(peak[0], threading.active_count())
+            time.sleep(0.001)
+
+    threading.Thread(target=watch, daemon=True).start()
+    for label in ("thread per command", "event loop core"):
+        base = threading.active_count()
+        peak[0] = base
+        t0 = time.perf_counter()
+        done: list[float] = []
+        if label == "thread per command":
+            threads = [threading.Thread(target=lambda: (jarvis._handle_query("bench work"),
+                                                         done.append(time.perf_counter() - t0)), daemon=True)
+                       for _ in range(args.count)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            deferred = 0
+        else:
+            core = jarvis.AssistantCore(workers=args.workers, queue_limit=args.queue)
+            core.start()
+            futures = [core.submit("bench work") for _ in range(args.count)]
+            for f in futures:
+                f.result()
+                done.append(time.perf_counter() - t0)
+            deferred = core.deferred
+            assert all(f.result() for f in futures) and len(done) == args.count, "commands were dropped"
+        print(f"{label}: {args.count} commands in {(time.perf_counter() - t0) * 1e3:.0f}ms, "
+              f"peak extra threads {peak[0] - base}, held back by a full queue {deferred}")
+    stop.set()
+
+
+def bench_ui(args) -> None:
+    """Transcript stress test: log lines from several threads and measure how long the Tk loop stalls."""
+    if not jarvis._load_tk():
+        raise SystemExit("tkinter is not available")
+    try:
+        ui = jarvis.UI()
+    except jarvis.tk.TclError as exc:
+        raise SystemExit(f"cannot open a window: {exc}")
+    root = ui.root
+    gaps: list[float] = []
+    last = [time.perf_counter()]
+
+    def heartbeat():
+        now = time.perf_counter()
+        gaps.append(now - last[0])
+        last[0] = now
+        root.after(10, heartbeat)
+
+    per_thread = args.lines // args.threads
+
+    def producer(n):
+        for i in range(per_thread):
+            ui.log("System" if i % 3 else "You", f"thread {n} line {i} " + "x" * (i % 60))
+            if i % 500 == 0:
+                ui.stream_assistant(f"chunk {i} ", done=i % 1000 == 0)
+
+    start = time.perf_counter()
+    producers = [threading.Thread(target=producer, args=(n,), daemon=True) for n in range(args.threads)]
+    for t in producers:
+        t.start()
+    finished: list[float] = []
+
+    def poll():
+        if any(t.is_alive() for t in producers) or ui._updates:
+            root.after(20, poll)
+            return
+        finished.append(time.perf_counter() - start)
+        root.quit()
+
+    root.after(10, heartbeat)
+    root.after(20, poll)
+    root.mainloop()
+    lines = int(ui.text.index('end-1c').split('.')[0])
+    root.destroy()
+    print(f"{per_thread * args.threads} lines from {args.threads} threads drained in {finished[0] * 1e3:.0f}ms; "
+          f"transcript holds {lines} lines (limit {ui.MAX_LINES})")
+    # A 10ms heartbeat: anything above that is time the loop could not react to input
+    _report("Tk loop heartbeat interval", gaps, unit="ms", scale=1e3)
+    print(f"  longest stall: {max(gaps) * 1e3:.1f}ms")
+
+
+def _jarvis_imports(env: dict) -> list[tuple[str, float]]:
+    """Direct imports of jarvis with their cumulative time in ms, from ``python -X importtime``."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import jarvis"],
+                          capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    children: list[tuple[str, float]] = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            _, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        except ValueError:
+            continue
+        # Children are printed before their parent, indented two spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((name.strip(), int(cumulative_us) / 1e3))
+        elif depth == 0:
+            if name.strip() == "jarvis":
+                return children
+            children = []
+    return []
+
+
+def _time_to_ready(env: dict, timeout: float) -> float:
+    """Seconds from launching ``jarvis.py`` headless until it prints jarvis.READY_MARKER; the app is then killed."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(here, "jarvis.py")], stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env, cwd=here)
+    watchdog = threading.Timer(timeout, proc.kill)
+    watchdog.start()
+    output: list[str] = []
+    try:
+        for line in proc.stdout:
+            if line.strip() == jarvis.READY_MARKER:
+                return time.perf_counter() - t0
+            output.append(line.rstrip())
+    finally:
+        watchdog.cancel()
+        proc.kill()
+        proc.wait()
+    tail = "\n".join(output[-5:]) or "no output"
+    raise SystemExit(f"jarvis exited or timed out after {timeout:.0f}s before printing "
+                     f"{jarvis.READY_MARKER!r}:\n{tail}")
+
+
+def bench_startup(args) -> None:
+    """Launch of the whole app (headless) until it is ready for input, and cold import time of jarvis."""
+    env = dict(os.environ)
+    env.update(JARVIS_HEADLESS="1", PYTHONUNBUFFERED="1")
+    ready = [_time_to_ready(env, args.timeout) for _ in range(args.iterations)]
+    script = ("import time; t0 = time.perf_counter(); import jarvis; "
+              "print(time.perf_counter() - t0)")
+    samples = []
+    for _ in range(args.iterations):
+        proc = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=env,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+        if proc.returncode != 0:
+            raise SystemExit(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+        samples.append(float(proc.stdout.strip().splitlines()[-1]))
+    rows = sorted(_jarvis_imports(env), key=lambda r: r[1], reverse=True)
+    top = [{"module": name, "cumulative_ms": ms} for name, ms in rows[:args.top]]
+    if args.json:
+        result = {}
+        for key, values in (("ready_ms", ready), ("import_ms", samples)):
+            p50, p95, p99 = _percentiles(values)
+            result[key] = {"p50": p50 * 1e3, "p95": p95 * 1e3, "p99": p99 * 1e3}
+        print(json.dumps({**result, "top_imports": top}))
+        return
+    _report("launch to ready (headless)", ready, unit="ms", scale=1e3)
+    _report("import jarvis", samples, unit="ms", scale=1e3)
+    for row in top:
+        print(f"  {row['module']:<38} {row['cumulative_ms']:8.1f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("router", help=bench_router.__doc__)
+    p.add_argument("--iterations", type=int, default=2000)
+    p.set_defaults(func=bench_router)
+    p = sub.add_parser("apps", help=bench_apps.__doc__)
+    p.add_argument("--apps", type=int, default=5000)
+    p.add_argument("--iterations", type=int, default=200)
+    p.set_defaults(func=bench_apps)
+    p = sub.add_parser("llm-clients", help=bench_llm_clients.__doc__)
+    p.add_argument("--iterations", type=int, default=200)
+    p.set_defaults(func=bench_llm_clients)
+    p = sub.add_parser("llm-stream", help=bench_llm_stream.__doc__)
+    p.add_argument("--iterations", type=int, default=10)
+    p.add_argument("--first-token-delay", type=float, default=0.3)
+    p.add_argument("--token-delay", type=float, default=0.02)
+    p.set_defaults(func=bench_llm_stream)
+    p = sub.add_parser("llm-race", help=bench_llm_race.__doc__)
+    p.add_argument("--iterations", type=int, default=200)
+    p.add_argument("--delay", type=float, default=0.05, help="normal response time of the primary")
+    p.add_argument("--slow-rate", type=float, default=0.05)
+    p.add_argument("--slow-delay", type=float, default=1.5)
+    p.add_argument("--fail-rate", type=float, default=0.05)
+    p.set_defaults(func=bench_llm_race)
+    p = sub.add_parser("tts", help=bench_tts.__doc__)
+    p.add_argument("--messages", type=int, default=500)
+    p.set_defaults(func=bench_tts)
+    p = sub.add_parser("wake", help=bench_wake.__doc__)
+    p.add_argument("--fixtures", help="folder with templates/, positive/ and negative/ WAV files")
+    p.add_argument("--count", type=int, default=40, help="synthetic fixtures per class when --fixtures is not given")
+    p.add_argument("--pause", type=float, default=jarvis.WAKE_PHRASE_PAUSE, help="endpointing pause after the wake word")
+    p.set_defaults(func=bench_wake)
+    p = sub.add_parser("stt", help=bench_stt.__doc__)
+    p.add_argument("wavs", help="folder of WAV files labeled by a same-named .txt or by file name")
+    p.add_argument("--backends", default="vosk,command,google", help="comma-separated JARVIS_STT backend names")
+    p.add_argument("--no-grammar", dest="grammar", action="store_false", help="skip the command grammar fast path")
+    p.set_defaults(func=bench_stt)
+    p = sub.add_parser("endpoint", help=bench_endpoint.__doc__)
+    p.add_argument("--fixtures", help="folder of WAV recordings of single commands")
+    p.add_argument("--count", type=int, default=8, help="synthetic commands when --fixtures is not given")
+    p.add_argument("--silence", type=float, default=jarvis.VAD_TRAILING_SILENCE, help="VAD trailing silence")
+    p.add_argument("--stt-delay", type=float, default=0.35, help="simulated recognizer latency")
+    p.set_defaults(func=bench_endpoint)
+    p = sub.add_parser("speculate", help=bench_speculate.__doc__)
+    p.add_argument("sessions", nargs="?", help="folder of recorded commands labeled like for the stt benchmark")
+    p.add_argument("--count", type=int, default=12, help="synthetic commands when no folder is given")
+    p.add_argument("--stt-delay", type=float, default=0.08, help="simulated (local) recognizer latency")
+    p.set_defaults(func=bench_speculate)
+    p = sub.add_parser("memory", help=bench_memory.__doc__)
+    p.add_argument("--turns", type=int, default=500)
+    p.add_argument("--budget", type=int, default=1500)
+    p.add_argument("--summary-budget", type=int, default=300)
+    p.set_defaults(func=bench_memory)
+    p = sub.add_parser("files", help=bench_files.__doc__)
+    p.add_argument("--files", type=int, default=50_000)
+    p.add_argument("--iterations", type=int, default=200)
+    p.set_defaults(func=bench_files)
+    p = sub.add_parser("music", help=bench_music.__doc__)
+    p.add_argument("--tracks", type=int, default=100_000)
+    p.add_argument("--iterations", type=int, default=200)
+    p.set_defaults(func=bench_music)
+    p = sub.add_parser("stream-cache", help=bench_stream_cache.__doc__)
+    p.add_argument("--queries", type=int, default=20)
+    p.add_argument("--search-delay", type=float, default=2.5)
+    p.add_argument("--resolve-delay", type=float, default=0.8)
+    p.add_argument("--url-ttl", type=float, default=6 * 3600)
+    p.set_defaults(func=bench_stream_cache)
+    p = sub.add_parser("online-queue", help=bench_online_queue.__doc__)
+    p.add_argument("--tracks", type=int, default=20)
+    p.add_argument("--track", type=float, default=1.5)
+    p.add_argument("--open-delay", type=float, default=0.4)
+    p.add_argument("--resolve-delay", type=float, default=0.8)
+    p.set_defaults(func=bench_online_queue)
+    p = sub.add_parser("audio-cache", help=bench_audio_cache.__doc__)
+    p.add_argument("--tracks", type=int, default=200)
+    p.add_argument("--plays", type=int, default=600)
+    p.add_argument("--zipf", type=float, default=1.0)
+    p.add_argument("--budget-mb", type=int, default=20)
+    p.add_argument("--track-kb", type=int, default=1024)
+    p.add_argument("--resolve-delay", type=float, default=0.05)
+    p.set_defaults(func=bench_audio_cache)
+    p = sub.add_parser("player", help=bench_player.__doc__)
+    p.add_argument("--tracks", type=int, default=50)
+    p.set_defaults(func=bench_player)
+    p = sub.add_parser("commands", help=bench_commands.__doc__)
+    p.add_argument("--count", type=int, default=200)
+    p.add_argument("--work", type=float, default=0.05, help="seconds each command blocks")
+    p.add_argument("--workers", type=int, default=jarvis.COMMAND_WORKERS)
+    p.add_argument("--queue", type=int, default=jarvis.COMMAND_QUEUE_LIMIT)
+    p.set_defaults(func=bench_commands)
+    p = sub.add_parser("ui", help=bench_ui.__doc__)
+    p.add_argument("--lines", type=int, default=100_000)
+    p.add_argument("--threads", type=int, default=4)
+    p.set_defaults(func=bench_ui)
+    p = sub.add_parser("startup", help=bench_startup.__doc__)
+    p.add_argument("--iterations", type=int, default=10)
+    p.add_argument("--top", type=int, default=15)
+    p.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for the ready marker")
+    p.add_argument("--json", action="store_true", help="machine-readable output for CI")
+    p.set_defaults(func=bench_startup)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
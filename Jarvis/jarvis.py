@@ -1,74 +1,331 @@
 import pyttsx3
+import array
 import datetime
 import speech_recognition as sr
-import wikipedia
 import webbrowser as wb
 import os
 import sys
 import random
-import pyautogui
 import subprocess
 import re
 import shutil
-import pyjokes
 import threading
 import queue
 import time
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import bisect
 import ctypes
+import difflib
+import functools
+import hashlib
+import importlib
+import io
+import itertools
+import json
+import math
+import sqlite3
+import statistics
+import tempfile
 import urllib.parse
 import urllib.request
-try:
-    import vlc  # type: ignore
-except Exception:
-    vlc = None  # type: ignore
-try:
-    import yt_dlp  # type: ignore
-except Exception:
-    yt_dlp = None  # type: ignore
-
-try:
-    import tkinter as tk
-    from tkinter.scrolledtext import ScrolledText
-except Exception:
-    tk = None
+import wave
 try:
     from dotenv import load_dotenv
 except Exception:
     load_dotenv = None
-try:
-    # OpenAI
-    from openai import OpenAI  # type: ignore
-except Exception:
-    OpenAI = None  # type: ignore
-try:
-    # Google Gemini
-    import google.generativeai as genai  # type: ignore
-except Exception:
-    genai = None  # type: ignore
-try:
-    # Anthropic Claude
-    import anthropic  # type: ignore
-except Exception:
-    anthropic = None  # type: ignore
+
+# Heavy or optional packages (pyautogui, wikipedia, pyjokes, vlc, yt_dlp, the
+# LLM SDKs, httpx) are imported on first use through _optional_import so the
+# assistant starts quickly; tkinter is loaded when the UI is built.
+_OPTIONAL_MODULES: dict[str, object] = {}
+_OPTIONAL_LOCK = threading.Lock()
+
+
+def _optional_import(name: str):
+    """Import ``name`` on first use and cache it; returns None when it is not installed."""
+    try:
+        return _OPTIONAL_MODULES[name]
+    except KeyError:
+        pass
+    with _OPTIONAL_LOCK:
+        if name not in _OPTIONAL_MODULES:
+            try:
+                _OPTIONAL_MODULES[name] = importlib.import_module(name)
+            except Exception:
+                _OPTIONAL_MODULES[name] = None
+        return _OPTIONAL_MODULES[name]
+
+
+tk = None
+ScrolledText = None
+
+
+def _load_tk() -> bool:
+    global tk, ScrolledText
+    if tk is None:
+        module = _optional_import('tkinter')
+        scrolled = _optional_import('tkinter.scrolledtext')
+        if module is None or scrolled is None:
+            return False
+        ScrolledText = scrolled.ScrolledText
+        tk = module
+    return True
 try:
     import winreg  # Windows registry access
 except Exception:
     winreg = None
+try:
+    import winsound  # in-memory WAV playback for pre-rendered phrases
+except Exception:
+    winsound = None
 
 # Hardcoded API defaults (env vars override when present)
 DEFAULT_LLM_PROVIDER = os.environ.get('LLM_PROVIDER', '').strip() or 'openrouter'
 DEFAULT_OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY', '').strip() or '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'
 DEFAULT_OPENROUTER_BASE = os.environ.get('OPENROUTER_BASE_URL', '').strip() or 'https://openrouter.ai/api/v1'
 DEFAULT_OPENROUTER_MODEL = os.environ.get('OPENROUTER_MODEL', '').strip() or 'openai/gpt-4o'
+# Indexes and caches live here; override with JARVIS_DATA_DIR
+JARVIS_DATA_DIR = os.environ.get('JARVIS_DATA_DIR', '').strip() or os.path.join(os.path.expanduser("~"), ".jarvis")
+
+
+def _data_path(name: str) -> str:
+    try:
+        os.makedirs(JARVIS_DATA_DIR, exist_ok=True)
+    except Exception:
+        pass
+    return os.path.join(JARVIS_DATA_DIR, name)
+
+
+# ----- Tracing -----
+class _Trace:
+    """Spans recorded for one utterance, from capture to the end of the spoken reply."""
+
+    def __init__(self, source: str):
+        self.id = f"{int(time.time() * 1000):x}-{next(_TRACE_IDS)}"
+        self.source = source
+        self.query = None
+        self.wall = time.time()
+        self.t0 = time.perf_counter()
+        self.spans: list[tuple[str, float, float]] = []
+        self.lock = threading.Lock()
+        self.pending_speech = 0
+        self.first_queued = None
+        self.speaking = None
+        self.handled = False
+        self.written = False
+        self.error = None
+
+    def add(self, stage: str, start: float, end: float) -> None:
+        with self.lock:
+            self.spans.append((stage, start - self.t0, end - start))
+
+
+_TRACE_IDS = itertools.count(1)
+
+
+class Tracer:
+    """Per-stage timing of every utterance.
+
+    ``begin`` starts a trace for an utterance and makes it current for the
+    code that handles it (a context variable, so it follows the command into
+    executor threads). ``span(stage)`` times a block against the current
+    trace; without one it does nothing. Speech is tracked separately: the
+    time from the first reply being queued to audio starting is
+    ``tts_start`` and from there to the last reply finishing is ``tts_end``.
+    A trace is written as one JSON line once its handler has returned and
+    its speech has ended; the file rotates at ``max_bytes`` keeping
+    ``backups`` old files. ``stats`` gives p50/p95/p99 per stage over the
+    last ``window`` traces (including ones written by earlier sessions).
+    """
+
+    STAGES = ("capture", "stt", "route", "handler", "file_search", "llm", "tts_start", "tts_end", "total")
+
+    def __init__(self, path: str | None, max_bytes: int = 1 << 20, backups: int = 3, window: int = 1000,
+                 enabled: bool = True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.window = window
+        self.enabled = enabled
+        self._current: contextvars.ContextVar = contextvars.ContextVar('jarvis_trace', default=None)
+        self._lock = threading.Lock()
+        self._samples: dict[str, collections.deque] = {}
+        self._loaded = False
+
+    def begin(self, source: str) -> _Trace | None:
+        if not self.enabled:
+            return None
+        trace = _Trace(source)
+        self._current.set(trace)
+        return trace
+
+    def activate(self, trace: _Trace | None) -> None:
+        self._current.set(trace)
+
+    def current(self) -> _Trace | None:
+        return self._current.get()
+
+    @contextlib.contextmanager
+    def span(self, stage: str):
+        trace = self._current.get()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if trace is not None:
+                trace.add(stage, start, time.perf_counter())
+
+    def record(self, stage: str, start: float, end: float | None = None) -> None:
+        """Add a span measured by the caller (``perf_counter`` times)."""
+        trace = self._current.get()
+        if trace is not None:
+            trace.add(stage, start, time.perf_counter() if end is None else end)
+
+    def handled(self, trace: _Trace | None, query: str | None = None, error: str | None = None) -> None:
+        """The handler has returned (or raised ``error``); the trace is written once its speech is done too."""
+        if trace is None:
+            return
+        with trace.lock:
+            trace.query = query if query is not None else trace.query
+            trace.error = error or trace.error
+            trace.handled = True
+        self._maybe_write(trace)
+
+    # Speech thread hooks
+    def speech_queued(self, trace: _Trace | None) -> None:
+        if trace is None:
+            return
+        with trace.lock:
+            trace.pending_speech += 1
+            if trace.first_queued is None:
+                trace.first_queued = time.perf_counter()
+
+    def speech_started(self, trace: _Trace | None) -> None:
+        if trace is None:
+            return
+        now = time.perf_counter()
+        with trace.lock:
+            if trace.speaking is not None or trace.first_queued is None:
+                return
+            trace.speaking = now
+        trace.add("tts_start", trace.first_queued, now)
+
+    def speech_done(self, trace: _Trace | None, spoken: bool = True) -> None:
+        if trace is None:
+            return
+        now = time.perf_counter()
+        with trace.lock:
+            trace.pending_speech -= 1
+            last = trace.pending_speech <= 0
+        if last and spoken and trace.speaking is not None:
+            trace.add("tts_end", trace.speaking, now)
+        if last:
+            self._maybe_write(trace)
+
+    def _maybe_write(self, trace: _Trace) -> None:
+        with trace.lock:
+            if trace.written or not trace.handled or trace.pending_speech > 0:
+                return
+            trace.written = True
+            end = time.perf_counter()
+            trace.spans.append(("total", 0.0, end - trace.t0))
+            record = {"id": trace.id, "source": trace.source, "query": trace.query,
+                      "time": round(trace.wall, 3),
+                      "spans": [{"stage": s, "start_ms": round(o * 1e3, 2), "ms": round(d * 1e3, 2)}
+                                for s, o, d in trace.spans]}
+            if trace.error:
+                record["error"] = trace.error
+        # Earlier sessions first, so the rolling windows keep the newest samples
+        self._ensure_loaded()
+        self._observe(record)
+        if not self.path:
+            return
+        try:
+            line = json.dumps(record) + "\n"
+            with self._lock:
+                if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+                    self._rotate()
+                with open(self.path, "a", encoding="utf-8") as fh:
+                    fh.write(line)
+        except Exception:
+            pass
+
+    def _rotate(self) -> None:
+        for i in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{i}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def _observe(self, record: dict) -> None:
+        with self._lock:
+            totals: dict[str, float] = {}
+            for span in record.get("spans", ()):
+                # A stage that ran several times (e.g. file searches) counts once with its total
+                totals[span["stage"]] = totals.get(span["stage"], 0.0) + span["ms"]
+            for stage, ms in totals.items():
+                self._samples.setdefault(stage, collections.deque(maxlen=self.window)).append(ms)
+
+    def _ensure_loaded(self) -> None:
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+        if not self.path:
+            return
+        records = []
+        for path in (f"{self.path}.1", self.path):
+            try:
+                with open(path, "r", encoding="utf-8") as fh:
+                    records.extend(fh.readlines()[-self.window:])
+            except Exception:
+                pass
+        for line in records[-self.window:]:
+            try:
+                self._observe(json.loads(line))
+            except Exception:
+                pass
+
+    def stats(self) -> dict[str, dict]:
+        """``{stage: {"count", "p50", "p95", "p99"}}`` in milliseconds."""
+        self._ensure_loaded()
+        with self._lock:
+            result = {}
+            for stage in sorted(self._samples, key=lambda s: (self.STAGES.index(s) if s in self.STAGES else 99, s)):
+                ordered = sorted(self._samples[stage])
+                if not ordered:
+                    continue
+                n = len(ordered)
+                result[stage] = {"count": n, "p50": ordered[n // 2], "p95": ordered[min(n - 1, int(n * 0.95))],
+                                 "p99": ordered[min(n - 1, int(n * 0.99))]}
+            return result
+
+
+tracer = Tracer(
+    _data_path("traces.jsonl"),
+    enabled=os.environ.get('JARVIS_TRACE', '1').strip() != '0',
+    max_bytes=int(os.environ.get('JARVIS_TRACE_MAX_BYTES', str(1 << 20)) or 1 << 20),
+)
+
+
 try:
     import win32com.client  # for Windows startup shortcut and SAPI voice fallback
 except Exception:
     win32com = None
 
-engine = pyttsx3.init(driverName='sapi5')
-voices = engine.getProperty('voices')
+engine = None
+_engine_lock = threading.Lock()
+
+
 # Sensible defaults: prefer a female voice if available, else first voice
-def _choose_default_voice_id():
+def _choose_default_voice_id(voices):
     try:
         for v in voices:
             name = (getattr(v, 'name', '') or '').lower()
@@ -91,43 +348,62 @@ if load_dotenv is not None:
     except Exception:
         pass
 
-default_voice_id = _choose_default_voice_id()
-if default_voice_id:
-    engine.setProperty('voice', default_voice_id)
-engine.setProperty('rate', 175)
-engine.setProperty('volume', 1)
+
+
+def _get_engine():
+    """Return the pyttsx3 engine, initialising it on first use.
+
+    Initialisation enumerates the installed voices, which is slow, so it is
+    kept off the import path and warmed in the background at startup.
+    """
+    global engine
+    with _engine_lock:
+        if engine is None:
+            eng = pyttsx3.init(driverName='sapi5')
+            default_voice_id = _choose_default_voice_id(eng.getProperty('voices'))
+            if default_voice_id:
+                eng.setProperty('voice', default_voice_id)
+            eng.setProperty('rate', 175)
+            eng.setProperty('volume', 1)
+            engine = eng
+        return engine
 
 
 def set_voice_by_index(index: int) -> None:
     try:
-        vs = engine.getProperty('voices')
+        eng = _get_engine()
+        vs = eng.getProperty('voices')
         if 0 <= index < len(vs):
-            engine.setProperty('voice', vs[index].id)
+            eng.setProperty('voice', vs[index].id)
     except Exception:
         pass
 
 
 def enable_system_voice() -> None:
     global USE_SAPI
-    USE_SAPI = True
+    with _STATE_LOCK:
+        USE_SAPI = True
 
 
 def enable_engine_voice() -> None:
     global USE_SAPI
-    USE_SAPI = False
+    with _STATE_LOCK:
+        USE_SAPI = False
 
 
 def _speak_sync(audio: str) -> None:
     global engine
     try:
-        engine.say(audio)
-        engine.runAndWait()
+        eng = _get_engine()
+        eng.say(audio)
+        eng.runAndWait()
     except Exception:
         try:
             # Reinitialize engine once if needed
-            engine = pyttsx3.init(driverName='sapi5')
-            engine.say(audio)
-            engine.runAndWait()
+            engine = None
+            eng = _get_engine()
+            eng.say(audio)
+            eng.runAndWait()
         except Exception:
             # Fallback to native SAPI voice if available
             try:
@@ -140,89 +416,599 @@ def _speak_sync(audio: str) -> None:
                 pass
 
 
-class TTSWorker:
+SPEECH_PRIORITY_HIGH = 0
+SPEECH_PRIORITY_NORMAL = 5
+# 'sapi', 'engine', 'espeak' or 'null'; empty picks sapi/engine from USE_SAPI
+SPEECH_BACKEND = os.environ.get('JARVIS_TTS_BACKEND', '').strip().lower()
+
+
+def _wav_duration(data: bytes) -> float:
+    try:
+        with wave.open(io.BytesIO(data)) as w:
+            return w.getnframes() / float(w.getframerate() or 1)
+    except Exception:
+        return 0.0
+
+
+_WAV_PLAYER: list[str] | None | bool = False  # False until looked up
+
+
+def _wav_player() -> list[str] | None:
+    """Command that plays WAV from stdin where winsound is missing, or None when it is not installed (looked up once)."""
+    global _WAV_PLAYER
+    if _WAV_PLAYER is False:
+        command = os.environ.get('JARVIS_AUDIO_PLAYER', '').split() or ["aplay", "-q", "-"]
+        _WAV_PLAYER = command if shutil.which(command[0]) else None
+        if _WAV_PLAYER is None:
+            print(f"Audio player {command[0]!r} not found; pre-rendered phrases will be spoken live instead.")
+    return _WAV_PLAYER
+
+
+def _play_wav_bytes(data: bytes, cancel: threading.Event) -> None:
+    """Play WAV bytes from memory, returning early once ``cancel`` is set.
+
+    Raises when there is no player or it fails, so the caller can fall back
+    to live synthesis.
+    """
+    if winsound is not None:
+        # Blocking; _stop_wav_playback() purges it from another thread
+        winsound.PlaySound(data, winsound.SND_MEMORY | winsound.SND_NODEFAULT)
+        return
+    player = _wav_player()
+    if player is None:
+        raise RuntimeError("no audio player for pre-rendered speech")
+    proc = subprocess.Popen(player, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        proc.stdin.write(data)
+        proc.stdin.close()
+    except Exception:
+        pass
+    while proc.poll() is None:
+        if cancel.wait(0.02):
+            proc.terminate()
+            return
+    if proc.returncode and not cancel.is_set():
+        # e.g. no sound device: aplay exits at once
+        raise RuntimeError(f"{player[0]} exited with status {proc.returncode}")
+
+
+def _stop_wav_playback() -> None:
+    if winsound is not None:
+        try:
+            winsound.PlaySound(None, 0)
+        except Exception:
+            pass
+
+
+class _EngineBackend:
+    """Speaks through the module-level pyttsx3 engine."""
+
     def __init__(self):
-        self._queue = queue.Queue()
-        self._thread = threading.Thread(target=self._run, daemon=True)
-        self._thread.start()
+        self._cancel = threading.Event()
+
+    def voice_key(self) -> str:
+        eng = _get_engine()
+        return f"engine:{eng.getProperty('voice')}:{eng.getProperty('rate')}"
 
-    def say(self, text: str) -> None:
+    def speak(self, text: str) -> None:
+        _speak_sync(text)
+
+    def render(self, text: str, path: str) -> bool:
+        eng = _get_engine()
+        eng.save_to_file(text, path)
+        eng.runAndWait()
+        return os.path.isfile(path)
+
+    def play(self, data: bytes) -> None:
+        self._cancel.clear()
+        _play_wav_bytes(data, self._cancel)
+
+    def stop(self) -> None:
+        self._cancel.set()
+        _stop_wav_playback()
         try:
-            self._queue.put(str(text), block=False)
+            if engine is not None:
+                engine.stop()
         except Exception:
             pass
 
-    def _run(self) -> None:
-        while True:
+
+class _SapiBackend:
+    """Native SAPI voice, dispatched once on the speech thread.
+
+    Speech is started asynchronously and polled so that ``stop`` can purge it
+    mid-sentence.
+    """
+
+    _SVSF_ASYNC = 1
+    _SVSF_PURGE = 2
+    _SSFM_CREATE_FOR_WRITE = 3
+
+    def __init__(self):
+        self._voice = None
+        self._cancel = threading.Event()
+
+    def _ensure_voice(self):
+        if self._voice is None:
             try:
-                text = self._queue.get()
-                if text is None:
-                    continue
-                _speak_sync(text)
+                import pythoncom  # type: ignore
+                pythoncom.CoInitialize()
             except Exception:
                 pass
+            v = win32com.client.Dispatch('SAPI.SpVoice')
+            v.Rate = 1
+            v.Volume = 100
+            self._voice = v
+        return self._voice
+
+    def voice_key(self) -> str:
+        try:
+            v = self._ensure_voice()
+            return f"sapi:{v.Voice.GetDescription()}:{v.Rate}"
+        except Exception:
+            return "sapi"
+
+    def speak(self, text: str) -> None:
+        self._cancel.clear()
+        try:
+            v = self._ensure_voice()
+        except Exception:
+            _speak_sync(text)
+            return
+        v.Speak(text, self._SVSF_ASYNC)
+        while not v.WaitUntilDone(50):
+            if self._cancel.is_set():
+                v.Speak("", self._SVSF_ASYNC | self._SVSF_PURGE)
+                break
+
+    def render(self, text: str, path: str) -> bool:
+        v = self._ensure_voice()
+        renderer = win32com.client.Dispatch('SAPI.SpVoice')
+        renderer.Voice = v.Voice
+        renderer.Rate = v.Rate
+        renderer.Volume = v.Volume
+        stream = win32com.client.Dispatch('SAPI.SpFileStream')
+        stream.Open(path, self._SSFM_CREATE_FOR_WRITE)
+        try:
+            renderer.AudioOutputStream = stream
+            renderer.Speak(text)
+        finally:
+            stream.Close()
+        return os.path.isfile(path)
+
+    def play(self, data: bytes) -> None:
+        self._cancel.clear()
+        _play_wav_bytes(data, self._cancel)
+
+    def stop(self) -> None:
+        self._cancel.set()
+        _stop_wav_playback()
+
+
+class _CommandBackend:
+    """Runs an external synthesizer per utterance (``espeak`` by default, JARVIS_TTS_COMMAND overrides)."""
+
+    def __init__(self, command: list[str] | None = None):
+        self._command = command or (os.environ.get('JARVIS_TTS_COMMAND', '').split() or ["espeak"])
+        self._cancel = threading.Event()
+
+    def voice_key(self) -> str:
+        return "command:" + " ".join(self._command)
+
+    def _run(self, args: list[str]) -> None:
+        self._cancel.clear()
+        proc = subprocess.Popen(self._command + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        while proc.poll() is None:
+            if self._cancel.wait(0.02):
+                proc.terminate()
+                break
+
+    def speak(self, text: str) -> None:
+        self._run([text])
+
+    def render(self, text: str, path: str) -> bool:
+        # espeak-compatible "-w <file>" option
+        self._run(["-w", path, text])
+        return os.path.isfile(path)
+
+    def play(self, data: bytes) -> None:
+        self._cancel.clear()
+        _play_wav_bytes(data, self._cancel)
+
+    def stop(self) -> None:
+        self._cancel.set()
+        _stop_wav_playback()
+
+
+class _NullBackend:
+    """Silent stand-in that takes as long as speech would, for tests and benchmarks."""
+
+    def __init__(self, chars_per_second: float = 15.0):
+        self.chars_per_second = chars_per_second
+        self.spoken: list[str] = []
+        self.played: list[bytes] = []
+        self._cancel = threading.Event()
+
+    def voice_key(self) -> str:
+        return f"null:{self.chars_per_second}"
+
+    def speak(self, text: str) -> None:
+        self._cancel.clear()
+        self.spoken.append(text)
+        self._cancel.wait(len(text) / self.chars_per_second if self.chars_per_second else 0)
+
+    def render(self, text: str, path: str) -> bool:
+        seconds = len(text) / self.chars_per_second if self.chars_per_second else 0
+        with wave.open(path, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(16000)
+            w.writeframes(b"\0\0" * int(16000 * seconds))
+        return True
+
+    def play(self, data: bytes) -> None:
+        self._cancel.clear()
+        self.played.append(data)
+        self._cancel.wait(_wav_duration(data))
+
+    def stop(self) -> None:
+        self._cancel.set()
+
+
+_SPEECH_BACKENDS = {
+    'sapi': _SapiBackend,
+    'engine': _EngineBackend,
+    'espeak': _CommandBackend,
+    'null': _NullBackend,
+}
+
+
+def _default_speech_backend(cache: dict):
+    name = SPEECH_BACKEND or ('sapi' if USE_SAPI and win32com is not None else 'engine')
+    if name not in cache:
+        cache[name] = _SPEECH_BACKENDS.get(name, _EngineBackend)()
+    return cache[name]
+
+
+class PhraseAudioCache:
+    """Pre-rendered audio for the assistant's fixed phrases.
+
+    Audio is keyed by phrase plus the backend's voice and rate, stored as WAV
+    files under the data folder and kept in memory once loaded. Rendering is
+    done by the speech thread itself while it is idle, so the voice object is
+    never used from two threads. One-off replies can be ``prepare``d: they are
+    rendered ahead of any other pending phrase and kept in memory only.
+    """
+
+    TRANSIENT_MAX = 8
+
+    def __init__(self, directory: str):
+        self._dir = directory
+        self._lock = threading.Lock()
+        self._phrases: set[str] = set()
+        self._memory: dict[str, bytes] = {}
+        self._pending: collections.deque[str] = collections.deque()
+        self._transient: collections.OrderedDict[str, bytes | None] = collections.OrderedDict()
+        self.hits = 0
+
+    def register(self, phrases) -> None:
+        """Mark phrases for pre-rendering; the speech thread renders them when idle."""
+        with self._lock:
+            for p in phrases:
+                p = (p or "").strip()
+                if p and p not in self._phrases:
+                    self._phrases.add(p)
+                    self._pending.append(p)
+
+    def prepare(self, text: str) -> None:
+        """Render a one-off reply next, ahead of the fixed phrases; it is not saved to disk."""
+        text = (text or "").strip()
+        with self._lock:
+            if not text or text in self._phrases or text in self._transient:
+                return
+            self._transient[text] = None
+            self._pending.appendleft(text)
+            while len(self._transient) > self.TRANSIENT_MAX:
+                self._transient.popitem(last=False)
+
+    def knows(self, text: str) -> bool:
+        text = text.strip()
+        return text in self._phrases or text in self._transient
+
+    def _path(self, text: str, voice_key: str) -> str:
+        digest = hashlib.sha1(f"{voice_key}\x1f{text}".encode("utf-8")).hexdigest()
+        return os.path.join(self._dir, f"{digest}.wav")
+
+    def get(self, text: str, backend) -> bytes | None:
+        """Return cached audio for ``text`` in the backend's current voice, or None."""
+        text = text.strip()
+        if text in self._transient:
+            data = self._transient.get(text)
+            if data:
+                self.hits += 1
+            return data
+        if text not in self._phrases:
+            return None
+        try:
+            path = self._path(text, backend.voice_key())
+        except Exception:
+            return None
+        data = self._memory.get(path)
+        if data is None and os.path.isfile(path):
+            try:
+                with open(path, "rb") as fh:
+                    data = fh.read()
+                self._memory[path] = data
+            except OSError:
+                data = None
+        if data is None:
+            # Voice changed or never rendered: render it next time we're idle
+            with self._lock:
+                if text not in self._pending:
+                    self._pending.append(text)
+            return None
+        self.hits += 1
+        return data
+
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def has_urgent(self) -> bool:
+        """A prepared reply is waiting to be rendered."""
+        pending = self._pending
+        return bool(pending) and pending[0] in self._transient
+
+    def render_next(self, backend) -> None:
+        """Render (or load from disk) one pending phrase for ``backend``."""
+        with self._lock:
+            if not self._pending:
+                return
+            text = self._pending.popleft()
+        if text in self._transient:
+            self._render_transient(text, backend)
+            return
+        try:
+            path = self._path(text, backend.voice_key())
+            if not os.path.isfile(path):
+                os.makedirs(self._dir, exist_ok=True)
+                tmp = path + ".tmp.wav"
+                if not backend.render(text, tmp):
+                    return
+                os.replace(tmp, path)
+            with open(path, "rb") as fh:
+                self._memory[path] = fh.read()
+        except Exception:
+            pass
+
+    def _render_transient(self, text: str, backend) -> None:
+        fd, path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            if backend.render(text, path):
+                with open(path, "rb") as fh:
+                    data = fh.read()
+                with self._lock:
+                    if text in self._transient:
+                        self._transient[text] = data
+        except Exception:
+            pass
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class SpeechPipeline:
+    """The single long-lived speech thread.
+
+    Messages are spoken in order within a priority level (lower numbers
+    first). ``stop`` cancels the current utterance and everything queued
+    (barge-in). Short messages that arrive back to back are merged into one
+    utterance so e.g. "The current time is" and "10:30 PM" are not spoken as
+    two separate, separately-paced sentences. The backend is looked up per
+    utterance through ``backend_factory`` so the voice can be switched live.
+    Phrases found in ``phrase_audio`` are played from pre-rendered audio, and
+    pending renders are done whenever the queue has been idle briefly.
+    """
+
+    SHORT_CHARS = 40
+    MERGE_MAX_CHARS = 160
+    MERGE_WINDOW = 0.03
+
+    def __init__(self, backend_factory=None, phrase_audio: PhraseAudioCache | None = None):
+        self.phrase_audio = phrase_audio
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._backend_factory = backend_factory or _default_speech_backend
+        self._backends: dict = {}
+        self._current = None
+        self._idle = threading.Event()
+        self._idle.set()
+        self.utterances = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def say(self, text: str, priority: int = SPEECH_PRIORITY_NORMAL, interrupt: bool = False) -> None:
+        if interrupt:
+            self.stop()
+        trace = tracer.current()
+        tracer.speech_queued(trace)
+        with self._lock:
+            self._idle.clear()
+            self._queue.put((priority, next(self._seq), self._generation, str(text), trace))
 
     def stop(self) -> None:
         """Immediately stop current speech and clear any queued items."""
-        try:
+        with self._lock:
+            self._generation += 1
+        while True:
             try:
-                engine.stop()
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            tracer.speech_done(item[4], spoken=False)
+        backend = self._current
+        with self._lock:
+            # The worker may be parked in a blocking get() and never loop back
+            if backend is None and self._queue.empty():
+                self._idle.set()
+        if backend is not None:
+            try:
+                backend.stop()
             except Exception:
                 pass
-            # Drain the queue
-            while not self._queue.empty():
+
+    def wait_idle(self, timeout: float | None = None) -> bool:
+        """Block until everything queued has been spoken."""
+        return self._idle.wait(timeout)
+
+    def prepare(self, text: str) -> None:
+        """Pre-render a reply that is likely to be spoken shortly (see PhraseAudioCache.prepare)."""
+        if self.phrase_audio is not None:
+            self.phrase_audio.prepare(text)
+            # Wake the speech thread so it renders now rather than at its next poll
+            with self._lock:
+                self._queue.put((SPEECH_PRIORITY_HIGH, next(self._seq), -1, "", None))
+
+    def _next_utterance(self, first) -> tuple[str, list]:
+        """Return the text to speak and the traces of the messages merged into it."""
+        priority, _seq, generation, text, trace = first
+        parts = [text]
+        traces = [trace]
+        total = len(text)
+        if len(text) > self.SHORT_CHARS or self._prerendered(text):
+            return text, traces
+        deadline = time.monotonic() + self.MERGE_WINDOW
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item[2] != generation:
+                tracer.speech_done(item[4], spoken=False)
+                continue
+            if (item[0] != priority or len(item[3]) > self.SHORT_CHARS or self._prerendered(item[3])
+                    or total + len(item[3]) > self.MERGE_MAX_CHARS):
+                self._queue.put(item)
+                break
+            parts.append(item[3])
+            traces.append(item[4])
+            total += len(item[3]) + 1
+        return " ".join(parts), traces
+
+    def _prerendered(self, text: str) -> bool:
+        # Known phrases are never merged, or they would miss their audio
+        return self.phrase_audio is not None and self.phrase_audio.knows(text)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                timeout = None
+                if self.phrase_audio is not None:
+                    if self.phrase_audio.has_urgent() and self._queue.empty():
+                        self.phrase_audio.render_next(self._backend_factory(self._backends))
+                        continue
+                    timeout = 0.05 if self.phrase_audio.has_pending() else 0.2
                 try:
-                    self._queue.get_nowait()
-                except Exception:
-                    break
-        except Exception:
-            pass
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    if self.phrase_audio.has_pending():
+                        self.phrase_audio.render_next(self._backend_factory(self._backends))
+                    continue
+                with self._lock:
+                    stale = item[2] != self._generation
+                if stale or not item[3].strip():
+                    tracer.speech_done(item[4], spoken=False)
+                else:
+                    utterance, traces = self._next_utterance(item)
+                    try:
+                        backend = self._backend_factory(self._backends)
+                        audio = self.phrase_audio.get(utterance, backend) if self.phrase_audio is not None else None
+                        self._current = backend
+                        for trace in traces:
+                            tracer.speech_started(trace)
+                        if audio:
+                            try:
+                                backend.play(audio)
+                            except Exception:
+                                # The pre-rendered audio could not be played: synthesize it live
+                                backend.speak(utterance)
+                        else:
+                            backend.speak(utterance)
+                        self.utterances += 1
+                    finally:
+                        self._current = None
+                        for trace in traces:
+                            tracer.speech_done(trace)
+            except Exception:
+                pass
+            finally:
+                # Also runs on the ``continue`` paths, so a queue drained by
+                # phrase pre-rendering or a get() timeout still reads as idle
+                with self._lock:
+                    if self._queue.empty():
+                        self._idle.set()
 
 
-tts = TTSWorker()
 USE_SAPI = True  # default to system voice for reliability
+# Guards settings that commands, the UI and the listeners change at runtime
+# (USE_SAPI, WAKE_ENABLED, CURRENT_DIR, PLAY_ON_WEB_BY_DEFAULT)
+_STATE_LOCK = threading.RLock()
+# Fixed phrases worth pre-rendering; wishme adds the personalised greeting
+_COMMON_PHRASES = (
+    "Yes, I'm listening.",
+    "Sure",
+    "Sorry, I didn't catch that.",
+    "Paused.",
+    "Resumed.",
+    "Stopped.",
+    "Next.",
+    "Welcome back, sir!",
+    "Good morning!",
+    "Good afternoon!",
+    "Good evening!",
+    "Good night, see you tomorrow.",
+    "I didn't hear anything. Please try again.",
+)
+phrase_audio = PhraseAudioCache(_data_path("phrase_audio"))
+tts = SpeechPipeline(phrase_audio=phrase_audio)
 WAKE_ENABLED = True  # allow always-on wake word "jarvis"
 
 
-def _sapi_speak(text: str) -> None:
-    try:
-        if win32com is not None:
-            v = win32com.client.Dispatch('SAPI.SpVoice')
-            v.Rate = 1
-            v.Volume = 100
-            v.Speak(text)
-            return
-    except Exception:
-        pass
-    _speak_sync(text)
-
-
-def speak(audio) -> None:
-    """Speak text using a dedicated worker; prefer native SAPI for maximum reliability."""
-    message = str(audio)
-    if USE_SAPI and win32com is not None:
-        threading.Thread(target=_sapi_speak, args=(message,), daemon=True).start()
-    else:
-        tts.say(message)
+def speak(audio, priority: int = SPEECH_PRIORITY_NORMAL, interrupt: bool = False) -> None:
+    """Queue text on the speech pipeline; ``interrupt`` cuts off whatever is being said."""
+    tts.say(str(audio), priority=priority, interrupt=interrupt)
 
 
 def stop_speaking() -> None:
-    """Stop the current TTS playback and clear queued speech."""
+    """Stop the current TTS playback, clear queued speech and cancel other commands."""
     try:
         tts.stop()
     except Exception:
         pass
+    core.cancel()
+
+
+def _time_reply(query: str = "") -> str:
+    return f"The current time is {datetime.datetime.now().strftime('%I:%M:%S %p')}"
+
+
+def _date_reply(query: str = "") -> str:
+    now = datetime.datetime.now()
+    return f"The current date is {now.day} {now.strftime('%B')} {now.year}"
 
 
 def time_announce() -> None:
     """Tells the current time."""
-    current_time = datetime.datetime.now().strftime("%I:%M:%S %p")
-    speak("The current time is")
-    speak(current_time)
-    print("The current time is", current_time)
+    reply = _time_reply()
+    print(reply)
+    speak(reply)
     try:
         if UI.instance is not None:
-            UI.instance.log_assistant(f"The current time is {current_time}")
+            UI.instance.log_assistant(reply)
     except Exception:
         pass
 
@@ -230,12 +1016,11 @@ def time_announce() -> None:
 def date_announce() -> None:
     """Tells the current date."""
     now = datetime.datetime.now()
-    speak("The current date is")
-    speak(f"{now.day} {now.strftime('%B')} {now.year}")
+    speak(_date_reply())
     print(f"The current date is {now.day}/{now.month}/{now.year}")
     try:
         if UI.instance is not None:
-            UI.instance.log_assistant(f"The current date is {now.day} {now.strftime('%B')} {now.year}")
+            UI.instance.log_assistant(_date_reply())
     except Exception:
         pass
 
@@ -259,24 +1044,49 @@ def wishme() -> None:
         speak("Good night, see you tomorrow.")
 
     assistant_name = load_name()
+    phrase_audio.register([f"{assistant_name} at your service. Please tell me how may I assist you."])
     speak(f"{assistant_name} at your service. Please tell me how may I assist you.")
     print(f"{assistant_name} at your service. Please tell me how may I assist you.")
 
 
 def screenshot() -> None:
     """Takes a screenshot and saves it."""
-    img = pyautogui.screenshot()
+    img = _optional_import('pyautogui').screenshot()
     img_path = os.path.expanduser("~\\Pictures\\screenshot.png")
     img.save(img_path)
     speak(f"Screenshot saved as {img_path}.")
     print(f"Screenshot saved as {img_path}.")
 
 
+# Run without the Tk window (console push-to-talk), e.g. for benchmarks and CI
+HEADLESS = os.environ.get('JARVIS_HEADLESS', '0').strip() == '1'
+# Printed once the assistant accepts input; bench.py startup times launch to this line
+READY_MARKER = "Jarvis ready."
+
+
+def _announce_ready() -> None:
+    print(READY_MARKER, flush=True)
+
+
 class UI:
+    """Tk window with the transcript, push-to-talk and voice controls.
+
+    ``log``, ``stream_assistant`` and ``set_status`` may be called from any
+    thread: they only queue the update, and the Tk main loop applies queued
+    updates every FLUSH_MS in one batch. The transcript keeps the last
+    MAX_LINES lines.
+    """
+
     instance = None
+    FLUSH_MS = 50
+    MAX_BATCH = 5000
+    # Pending updates kept while the Tk loop is stalled; the oldest are dropped
+    # first, which only loses lines the transcript would have trimmed anyway
+    MAX_PENDING = 4 * MAX_BATCH
+    MAX_LINES = int(os.environ.get('JARVIS_UI_MAX_LINES', '2000') or 2000)
 
     def __init__(self):
-        if tk is None:
+        if not _load_tk():
             UI.instance = None
             return
         self.root = tk.Tk()
@@ -314,7 +1124,12 @@ class UI:
         self.text.tag_configure('user', foreground="#80CBC4")   # teal
         self.text.tag_configure('assistant', foreground="#C3E88D")  # green
         self.text.tag_configure('system', foreground="#9E9E9E")  # gray
+        self._streaming = False
+        self._updates: collections.deque = collections.deque(maxlen=max(self.MAX_PENDING, self.MAX_LINES))
+        self._status_text: str | None = None
+        self._closing = False
         UI.instance = self
+        self.root.after(self.FLUSH_MS, self._flush)
 
         # Bind push-to-talk (Press N)
         self.root.bind('<KeyPress-n>', self._on_ptt)
@@ -347,7 +1162,6 @@ class UI:
         except Exception:
             pass
         self.stop_btn.pack(pady=2)
-        self._listening_lock = threading.Lock()
         # Type-to-speak input
         bar = tk.Frame(self.root, bg=panel)
         bar.pack(fill='x', padx=6, pady=4)
@@ -364,94 +1178,1002 @@ class UI:
         except Exception:
             pass
         speak_btn.pack(side='right')
+        # Enter runs the typed text as a command
+        self.input.bind('<Return>', self._on_submit)
         # Bind Stop Voice (Press S)
-        self.root.bind('<KeyPress-s>', lambda e: stop_speaking())
+        self.root.bind('<KeyPress-s>', self._on_stop_key)
 
     def log(self, prefix: str, message: str) -> None:
         if tk is None:
             return
-        self.text.configure(state='normal')
-        tag = 'system'
-        if prefix.lower().startswith('you'):
-            tag = 'user'
-        elif prefix.lower().startswith('assistant'):
-            tag = 'assistant'
-        self.text.insert('end', f"{prefix}: ", tag)
-        self.text.insert('end', f"{message}\n")
-        self.text.see('end')
-        self.text.configure(state='disabled')
-
-    def log_user(self, message: str) -> None:
-        self.log("You", message)
+        self._updates.append(('line', prefix, message))
 
-    def log_assistant(self, message: str) -> None:
-        self.log("Assistant", message)
+    def stream_assistant(self, chunk: str, done: bool = False) -> None:
+        """Append to the assistant line that is still being streamed; ``done`` ends it."""
+        if tk is None:
+            return
+        self._updates.append(('stream', chunk, done))
+
+    def _flush(self) -> None:
+        """Apply queued transcript updates in one insert (runs on the Tk main loop)."""
+        try:
+            updates = self._updates
+            # Whole lines beyond what the transcript keeps would be trimmed right away
+            while len(updates) > self.MAX_LINES and updates[0][0] == 'line':
+                updates.popleft()
+            args: list[str] = []
+            for _ in range(min(len(updates), self.MAX_BATCH)):
+                kind, a, b = updates.popleft()
+                if kind == 'line':
+                    if self._streaming:
+                        args += ["\n", ()]
+                        self._streaming = False
+                    tag = 'system'
+                    if a.lower().startswith('you'):
+                        tag = 'user'
+                    elif a.lower().startswith('assistant'):
+                        tag = 'assistant'
+                    args += [f"{a}: ", tag, f"{b}\n", ()]
+                else:
+                    if not self._streaming:
+                        args += ["Assistant: ", 'assistant']
+                        self._streaming = True
+                    if a:
+                        args += [a, ()]
+                    if b:
+                        args += ["\n", ()]
+                        self._streaming = False
+            if args:
+                self.text.configure(state='normal')
+                self.text.insert('end', *args)
+                lines = int(self.text.index('end-1c').split('.')[0])
+                if lines > self.MAX_LINES:
+                    self.text.delete('1.0', f"{lines - self.MAX_LINES + 1}.0")
+                self.text.see('end')
+                self.text.configure(state='disabled')
+            status, self._status_text = self._status_text, None
+            if status is not None:
+                self.status.configure(text=status)
+        except Exception:
+            pass
+        if self._closing:
+            self.root.quit()
+            return
+        self.root.after(self.FLUSH_MS, self._flush)
+
+    def log_user(self, message: str) -> None:
+        self.log("You", message)
+
+    def log_assistant(self, message: str) -> None:
+        self.log("Assistant", message)
 
     def run(self):
         if tk is not None:
             self.root.mainloop()
 
     def set_status(self, message: str) -> None:
-        try:
-            self.status.configure(text=message)
-        except Exception:
-            pass
+        self._status_text = message
+
+    def _typing(self, event) -> bool:
+        # Root-level hotkeys also see keys typed into the command box
+        return isinstance(getattr(event, 'widget', None), tk.Entry)
 
     def _on_ptt(self, event):
+        if self._typing(event):
+            return
         self._start_listen_once()
 
+    def _on_stop_key(self, event):
+        if self._typing(event):
+            return
+        stop_speaking()
+
     def _on_ptt_button(self):
         self._start_listen_once()
 
     def _start_listen_once(self):
-        if not self._listening_lock.acquire(blocking=False):
-            return
-        self.set_status("Listening… Speak now")
-        threading.Thread(target=_listen_once_thread, daemon=True).start()
+        core.listen()
+
+    def _on_submit(self, event=None):
+        text = self.input_var.get().strip()
+        if text:
+            self.input_var.set("")
+            self.log_user(text)
+            core.submit(text.lower())
+
+    def close(self) -> None:
+        """Quit the main loop (safe from any thread)."""
+        self._closing = True
 
     def _toggle_wake(self):
         global WAKE_ENABLED
-        WAKE_ENABLED = bool(self.wake_var.get())
+        with _STATE_LOCK:
+            WAKE_ENABLED = bool(self.wake_var.get())
         self.set_status("Wake word enabled" if WAKE_ENABLED else "Wake word disabled")
 
 
-def takecommand() -> str | None:
-    """Listen from the microphone and return recognized lowercased text or None."""
-    recognizer = sr.Recognizer()
-    recognizer.dynamic_energy_threshold = True
-    recognizer.pause_threshold = 0.8
-    recognizer.phrase_threshold = 0.2
-    try:
-        with sr.Microphone() as source:
-            print("Listening… (calibrating background noise)")
+# ----- Audio capture -----
+AUDIO_FRAME_MS = 30
+AUDIO_BUFFER_SECONDS = float(os.environ.get('JARVIS_AUDIO_BUFFER_SECONDS', '30') or 30)
+# Silence that ends a command, and the longest command accepted
+VAD_TRAILING_SILENCE = float(os.environ.get('JARVIS_VAD_SILENCE', '0.5') or 0.5)
+COMMAND_MAX_SECONDS = float(os.environ.get('JARVIS_MAX_COMMAND_SECONDS', '30') or 30)
+# Resolve cheap commands from partial transcripts while the user is still speaking
+SPECULATIVE_INTENTS = os.environ.get('JARVIS_SPECULATE', '1').strip() != '0'
+
+
+def _frame_stats(frame: bytes) -> tuple[float, float]:
+    """(RMS energy, zero-crossing rate) of 16-bit PCM samples; RMS is on sr's energy_threshold scale."""
+    samples = array.array('h', frame[:len(frame) - len(frame) % 2])
+    if not samples:
+        return 0.0, 0.0
+    crossings = sum(1 for a, b in zip(samples, samples[1:]) if (a < 0) != (b < 0))
+    return math.sqrt(sum(s * s for s in samples) / len(samples)), crossings / len(samples)
+
+
+class _MicrophoneSource:
+    """The default input device, opened once through speech_recognition/PyAudio."""
+
+    def __init__(self, sample_rate: int = 16000, device_index: int | None = None):
+        self._rate = sample_rate
+        self._device_index = device_index
+        self._mic = None
+        self.sample_rate = sample_rate
+        self.sample_width = 2
+
+    def open(self) -> None:
+        mic = sr.Microphone(device_index=self._device_index, sample_rate=self._rate)
+        mic.__enter__()
+        self._mic = mic
+        self.sample_rate = mic.SAMPLE_RATE
+        self.sample_width = mic.SAMPLE_WIDTH
+
+    def read(self, frames: int) -> bytes:
+        return self._mic.stream.read(frames)
+
+    def close(self) -> None:
+        if self._mic is not None:
+            self._mic.__exit__(None, None, None)
+            self._mic = None
+
+
+class WavFileSource:
+    """Feeds WAV files through an AudioStream as if they came from the microphone.
+
+    Files must be 16-bit mono at one sample rate. With ``realtime`` reads are
+    paced like a live device. ``trailing_silence`` seconds of silence follow
+    the last file so its final phrase is endpointed, then the stream ends.
+    """
+
+    def __init__(self, paths, realtime: bool = False, trailing_silence: float = 1.0):
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.realtime = realtime
+        self.trailing_silence = trailing_silence
+        self.sample_rate = 16000
+        self.sample_width = 2
+        self._data = bytearray()
+        self._pos = 0
+        self._t0 = 0.0
+
+    def open(self) -> None:
+        data = bytearray()
+        rate = None
+        for path in self.paths:
+            with wave.open(path, 'rb') as w:
+                if w.getnchannels() != 1 or w.getsampwidth() != 2:
+                    raise ValueError(f"{path}: expected 16-bit mono WAV")
+                if rate is not None and w.getframerate() != rate:
+                    raise ValueError(f"{path}: sample rate differs from {rate} Hz")
+                rate = w.getframerate()
+                data += w.readframes(w.getnframes())
+        self.sample_rate = rate or self.sample_rate
+        data += b"\0\0" * int(self.sample_rate * self.trailing_silence)
+        self._data = data
+        self._pos = 0
+        self._t0 = time.monotonic()
+
+    def read(self, frames: int) -> bytes:
+        chunk = bytes(self._data[self._pos:self._pos + frames * self.sample_width])
+        self._pos += len(chunk)
+        if self.realtime and chunk:
+            delay = self._t0 + self._pos / (self.sample_rate * self.sample_width) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return chunk
+
+    def close(self) -> None:
+        pass
+
+
+def _default_audio_source():
+    # JARVIS_AUDIO_SOURCE=a.wav;b.wav replays recordings instead of using the microphone
+    wavs = os.environ.get('JARVIS_AUDIO_SOURCE', '').strip()
+    if wavs:
+        return WavFileSource(wavs.split(os.pathsep), realtime=True)
+    return _MicrophoneSource()
+
+
+class AudioStream:
+    """One long-lived capture stream shared by the wake listener and command capture.
+
+    A background thread reads fixed-size frames from the source into a ring
+    buffer holding the last ``buffer_seconds`` of audio and tracks the noise
+    floor on every frame. Consumers read by absolute frame index, so command
+    capture can begin at the frame right after the wake word no matter how
+    long recognising the wake word took. Durations passed to
+    ``capture_phrase`` are measured in audio time, which keeps WAV replays
+    deterministic.
+
+    The noise floor is saved to ``calibration_path`` and reloaded on the next
+    start, so capture is calibrated from the first frame. It is re-measured
+    from scratch only when the recent background level drifts more than
+    ``DRIFT`` times away from it.
+    """
+
+    SPEECH_RATIO = 3.0
+    MIN_ENERGY = 100.0
+    # Unvoiced consonants ("s", "f", "th") are quiet but cross zero often
+    FRICATIVE_ZCR = 0.3
+    FRICATIVE_RATIO = 1.8
+    DRIFT = 2.0
+    DRIFT_WINDOW = 5.0
+    SAVE_INTERVAL = 30.0
+
+    def __init__(self, source_factory=None, buffer_seconds: float = AUDIO_BUFFER_SECONDS,
+                 frame_ms: int = AUDIO_FRAME_MS, calibration_path: str | None = None):
+        self._source_factory = source_factory or _default_audio_source
+        self.calibration_path = calibration_path
+        self.buffer_seconds = buffer_seconds
+        self.frame_ms = frame_ms
+        self.sample_rate = 16000
+        self.sample_width = 2
+        self._frames: collections.deque[tuple[float, float, bytes]] = collections.deque()
+        self._position = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self.noise_floor: float | None = None
+        self.recalibrations = 0
+        self._recent: collections.deque[float] = collections.deque(maxlen=max(1, int(self.DRIFT_WINDOW * 1000 / frame_ms)))
+        self._since_check = 0
+        self._saved_floor: float | None = None
+        self._saved_at = 0.0
+        self.ended = False
+        self.error: Exception | None = None
+
+    @property
+    def frame_seconds(self) -> float:
+        return self.frame_ms / 1000.0
+
+    @property
+    def position(self) -> int:
+        """Index of the next frame to be captured."""
+        with self._cond:
+            return self._position
+
+    @property
+    def threshold(self) -> float:
+        """Energy above which a frame counts as speech."""
+        return max((self.noise_floor or 0.0) * self.SPEECH_RATIO, self.MIN_ENERGY)
+
+    def is_speech(self, rms: float, zcr: float) -> bool:
+        """Voice activity decision for one frame: loud, or a quieter frame with fricative-like zero crossings."""
+        if rms > self.threshold:
+            return True
+        floor = max(self.noise_floor or 0.0, self.MIN_ENERGY / self.SPEECH_RATIO)
+        return zcr > self.FRICATIVE_ZCR and rms > floor * self.FRICATIVE_RATIO
+
+    def start(self) -> bool:
+        """Open the source and start capturing; no-op while running. False if it cannot be opened."""
+        with self._cond:
+            if self._thread is not None and (self._thread.is_alive() or (self.ended and self.error is None)):
+                # Running, or a finite source (WAV replay) that has been played out
+                return not self.ended
+            source = self._source_factory()
+            try:
+                source.open()
+            except Exception as e:
+                self.error = e
+                return False
+            self.sample_rate = source.sample_rate
+            self.sample_width = source.sample_width
+            if self.noise_floor is None:
+                self._load_calibration()
+            self._frames = collections.deque(maxlen=max(1, int(self.buffer_seconds * 1000 / self.frame_ms)))
+            self._stop.clear()
+            self.ended = False
+            self.error = None
+            self._thread = threading.Thread(target=self._run, args=(source,), daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def _run(self, source) -> None:
+        samples = int(self.sample_rate * self.frame_ms / 1000)
+        try:
+            while not self._stop.is_set():
+                data = source.read(samples)
+                if not data:
+                    break
+                rms, zcr = _frame_stats(data)
+                with self._cond:
+                    self._track_noise(rms)
+                    self._frames.append((rms, zcr, data))
+                    self._position += 1
+                    self._cond.notify_all()
+                if self._since_check == 0:
+                    self._save_calibration()
+        except Exception as e:
+            self.error = e
+        finally:
             try:
-                recognizer.adjust_for_ambient_noise(source, duration=0.6)
+                source.close()
             except Exception:
                 pass
+            with self._cond:
+                self.ended = True
+                self._cond.notify_all()
+
+    def _track_noise(self, rms: float) -> None:
+        # Falls quickly to quiet frames, rises slowly, and ignores speech; a
+        # lasting change of background level is caught by the drift check
+        if self.noise_floor is None:
+            self.noise_floor = rms
+        elif rms < self.noise_floor:
+            self.noise_floor += (rms - self.noise_floor) * 0.2
+        elif rms < self.threshold:
+            self.noise_floor += (rms - self.noise_floor) * 0.01
+        # Once per second compare against the quietest tenth of the last few seconds
+        self._recent.append(rms)
+        self._since_check = (self._since_check + 1) % max(1, int(1000 / self.frame_ms))
+        if self._since_check == 0 and len(self._recent) == self._recent.maxlen:
+            background = max(1.0, sorted(self._recent)[len(self._recent) // 10])
+            ratio = background / max(1.0, self.noise_floor)
+            if ratio > self.DRIFT or ratio < 1.0 / self.DRIFT:
+                self.noise_floor = background
+                self.recalibrations += 1
+
+    def _load_calibration(self) -> None:
+        if not self.calibration_path:
+            return
+        try:
+            with open(self.calibration_path, 'r', encoding='utf-8') as fh:
+                data = json.load(fh)
+            if int(data.get('sample_rate', 0)) == self.sample_rate and float(data['noise_floor']) >= 0:
+                self.noise_floor = self._saved_floor = float(data['noise_floor'])
+        except Exception:
+            pass
+
+    def _save_calibration(self) -> None:
+        """Persist the noise floor when it has moved noticeably (at most every SAVE_INTERVAL seconds)."""
+        floor = self.noise_floor
+        if not self.calibration_path or floor is None:
+            return
+        if self._saved_floor is not None and abs(floor - self._saved_floor) <= 0.2 * max(1.0, self._saved_floor):
+            return
+        now = time.monotonic()
+        if self._saved_floor is not None and now - self._saved_at < self.SAVE_INTERVAL:
+            return
+        try:
+            tmp = self.calibration_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as fh:
+                json.dump({'noise_floor': floor, 'sample_rate': self.sample_rate}, fh)
+            os.replace(tmp, self.calibration_path)
+            self._saved_floor, self._saved_at = floor, now
+        except Exception:
+            pass
+
+    def read(self, index: int, timeout: float | None = None) -> tuple[int, list[tuple[float, float, bytes]]]:
+        """Return (first index, [(rms, zcr, frame), ...]) for frames from ``index`` on.
+
+        Waits up to ``timeout`` for a frame if none is buffered yet. If
+        ``index`` has already left the ring buffer, reading starts at the
+        oldest frame still held.
+        """
+        with self._cond:
+            if index >= self._position and not self.ended:
+                self._cond.wait_for(lambda: self._position > index or self.ended, timeout)
+            first = self._position - len(self._frames)
+            index = min(max(index, first), self._position)
+            return index, list(itertools.islice(self._frames, index - first, None))
+
+    def _pcm(self, start: int, end: int) -> bytes:
+        with self._cond:
+            first = self._position - len(self._frames)
+            start = max(start, first)
+            return b"".join(f for _, _, f in itertools.islice(self._frames, start - first, max(start, end) - first))
+
+    def audio(self, start: int, end: int) -> sr.AudioData:
+        """The frames in [start, end) as AudioData for a recognizer."""
+        return sr.AudioData(self._pcm(start, end), self.sample_rate, self.sample_width)
+
+    def capture_phrase(self, start: int | None = None, timeout: float = 5.0, phrase_limit: float = 8.0,
+                       pause: float = 0.8, pre_roll: float = 0.3, min_speech: float = 0.15,
+                       listener=None) -> tuple[sr.AudioData | None, int]:
+        """Wait for speech from frame ``start`` on (default: now) and return (audio or None, next index).
+
+        Frames are classified with ``is_speech``. The phrase ends after
+        ``pause`` seconds of non-speech or at ``phrase_limit``; ``pre_roll``
+        seconds before the onset are kept. Bursts shorter than ``min_speech``
+        are ignored. The returned index is where the next consumer should
+        continue. A ``listener`` (see RecognitionSession) is fed each frame of
+        the phrase as it is captured via ``feed(pcm, speech, silence_seconds)``,
+        which returns True to end the phrase early, and is told to ``reset()``
+        when a burst is discarded.
+        """
+        fs = self.frame_seconds
+        index = self.position if start is None else start
+        wait_frames = max(1, int(timeout / fs))
+        pause_frames = max(1, int(pause / fs))
+        limit_frames = max(1, int(phrase_limit / fs))
+        onset = None
+        voiced = silent = waited = 0
+        # Guards against a stalled source; normal timing is in audio time
+        wall_deadline = time.monotonic() + timeout + phrase_limit + 2.0
+        while True:
+            index, frames = self.read(index, timeout=0.5)
+            if not frames:
+                if self.ended or time.monotonic() > wall_deadline:
+                    break
+                continue
+            for rms, zcr, data in frames:
+                speech = self.is_speech(rms, zcr)
+                if onset is None:
+                    if speech:
+                        onset, voiced, silent = index, 1, 0
+                        if listener is not None:
+                            listener.feed(self._pcm(onset - int(pre_roll / fs), onset), False, 0.0)
+                            listener.feed(data, True, 0.0)
+                    else:
+                        waited += 1
+                        if waited >= wait_frames:
+                            return None, index + 1
+                else:
+                    if speech:
+                        voiced += 1
+                        silent = 0
+                    else:
+                        silent += 1
+                    complete = listener is not None and listener.feed(data, speech, silent * fs)
+                    if complete or silent >= pause_frames or index + 1 - onset >= limit_frames:
+                        if voiced * fs < min_speech:
+                            onset = None
+                            if listener is not None:
+                                listener.reset()
+                        else:
+                            end = index + 1
+                            return self.audio(onset - int(pre_roll / fs), end), end
+                index += 1
+        if onset is not None and voiced * fs >= min_speech:
+            return self.audio(onset - int(pre_roll / fs), index), index
+        return None, index
+
+
+audio_stream = AudioStream(calibration_path=_data_path("audio_calibration.json"))
+# Shared by every cloud recognition call; capture and its threshold live on audio_stream
+recognizer = sr.Recognizer()
+recognizer.dynamic_energy_threshold = False
+
+
+# ----- Wake word -----
+WAKE_ENGINE = os.environ.get('JARVIS_WAKE_ENGINE', 'template').strip().lower()
+# A lone wake word is endpointed after a short pause rather than the command pause
+WAKE_PHRASE_PAUSE = 0.4
+_MEL_CACHE: dict = {}
+
+
+def _mel_filterbank(sample_rate: int, n_fft: int, n_mels: int):
+    key = (sample_rate, n_fft, n_mels)
+    if key not in _MEL_CACHE:
+        np = _optional_import('numpy')
+        to_mel = lambda f: 2595.0 * np.log10(1.0 + f / 700.0)
+        to_hz = lambda m: 700.0 * (10 ** (m / 2595.0) - 1.0)
+        edges = to_hz(np.linspace(to_mel(80.0), to_mel(min(7600.0, sample_rate / 2)), n_mels + 2))
+        bins = np.floor((n_fft + 1) * edges / sample_rate).astype(int)
+        bank = np.zeros((n_mels, n_fft // 2 + 1))
+        for m in range(1, n_mels + 1):
+            lo, mid, hi = bins[m - 1], bins[m], bins[m + 1]
+            if mid > lo:
+                bank[m - 1, lo:mid] = (np.arange(lo, mid) - lo) / (mid - lo)
+            if hi > mid:
+                bank[m - 1, mid:hi] = (hi - np.arange(mid, hi)) / (hi - mid)
+        n = np.arange(n_mels)
+        dct = np.cos(np.pi / n_mels * (n[None, :] + 0.5) * np.arange(1, 13)[:, None])
+        _MEL_CACHE[key] = (bank.T, dct.T)
+    return _MEL_CACHE[key]
+
+
+def _mfcc(pcm: bytes, sample_rate: int, trim_db: float = 25.0):
+    """MFCC frames (25 ms window, 10 ms hop, c1..c12) of 16-bit mono PCM.
+
+    Frames more than ``trim_db`` below the loudest are trimmed from both ends
+    and the cepstral mean is removed, so templates and live audio compare
+    independently of leading silence, level and microphone colouring.
+    Returns None when there is no usable audio or numpy is not installed.
+    """
+    np = _optional_import('numpy')
+    if np is None:
+        return None
+    x = np.frombuffer(pcm[:len(pcm) - len(pcm) % 2], dtype='<i2').astype(np.float64)
+    win, hop, n_fft = int(0.025 * sample_rate), int(0.010 * sample_rate), 512
+    while n_fft < win:
+        n_fft *= 2
+    if len(x) < win:
+        return None
+    x = np.append(x[0], x[1:] - 0.97 * x[:-1])
+    count = 1 + (len(x) - win) // hop
+    frames = np.lib.stride_tricks.as_strided(x, shape=(count, win), strides=(x.strides[0] * hop, x.strides[0]))
+    power = np.abs(np.fft.rfft(frames * np.hamming(win), n_fft)) ** 2
+    energy_db = 10 * np.log10(power.sum(axis=1) + 1e-9)
+    keep = np.nonzero(energy_db > energy_db.max() - trim_db)[0]
+    power = power[keep[0]:keep[-1] + 1]
+    bank, dct = _mel_filterbank(sample_rate, n_fft, 26)
+    feats = np.log(power @ bank + 1e-9) @ dct
+    return feats - feats.mean(axis=0)
+
+
+def _dtw_distance(template, query) -> float:
+    """Length-normalised subsequence DTW distance of ``template`` within ``query``.
+
+    The match may start and end anywhere in the query (the wake word can be
+    preceded by a breath or followed by the command), and each template frame
+    advances the query by 0, 1 or 2 frames, which allows up to 2x tempo
+    differences and lets every row be computed with whole-array operations.
+    """
+    np = _optional_import('numpy')
+    cost = np.sqrt(((template[:, None, :] - query[None, :, :]) ** 2).sum(axis=2))
+    acc = cost[0].copy()
+    for i in range(1, len(template)):
+        prev = acc
+        best = prev.copy()
+        best[1:] = np.minimum(best[1:], prev[:-1])
+        best[2:] = np.minimum(best[2:], prev[:-2])
+        acc = cost[i] + best
+    return float(acc.min() / len(template))
+
+
+class TemplateWakeDetector:
+    """Offline wake-word spotting: DTW over MFCCs against recordings of the wake word.
+
+    Templates are WAV files in ``directory``; they come from "train wake word"
+    or are added automatically from phrases the cloud recognizer confirmed as
+    the wake word. Until ``MIN_TEMPLATES`` exist (or without numpy) every
+    phrase is passed through, so the assistant still works while it learns.
+    The acceptance threshold is derived from how far the templates are from
+    each other (median plus MAD_K robust deviations of each template's
+    distance to its nearest sibling, so one odd template cannot open the
+    gate) unless JARVIS_WAKE_THRESHOLD is set.
+    """
+
+    MIN_TEMPLATES = 3
+    MAX_TEMPLATES = 10
+    MAD_K = 3.0
+    MARGIN = 1.35
+
+    def __init__(self, directory: str, threshold: float | None = None):
+        self._dir = directory
+        self._lock = threading.Lock()
+        self._templates: list = []
+        self._loaded = False
+        env = os.environ.get('JARVIS_WAKE_THRESHOLD', '').strip()
+        self._fixed_threshold = threshold if threshold is not None else (float(env) if env else None)
+        self.threshold = self._fixed_threshold or 0.0
+        self.last_score: float | None = None
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            names = sorted(n for n in os.listdir(self._dir) if n.lower().endswith('.wav'))
+        except OSError:
+            names = []
+        for name in names[-self.MAX_TEMPLATES:]:
+            try:
+                with wave.open(os.path.join(self._dir, name), 'rb') as w:
+                    feats = _mfcc(w.readframes(w.getnframes()), w.getframerate())
+            except Exception:
+                continue
+            if feats is not None and len(feats) >= 5:
+                self._templates.append(feats)
+        self._calibrate()
+
+    def _calibrate(self) -> None:
+        if self._fixed_threshold is not None or len(self._templates) < 2:
+            return
+        # Each template's distance to its closest sibling: a stray template only adds one
+        # outlying value here, where it would add a whole row and column of pairwise distances
+        nearest = [min(_dtw_distance(a, b) for j, b in enumerate(self._templates) if i != j)
+                   for i, a in enumerate(self._templates)]
+        median = statistics.median(nearest)
+        mad = statistics.median(abs(d - median) for d in nearest)
+        # 1.4826 * MAD estimates the standard deviation; floored so identical templates still leave some slack
+        self.threshold = (median + self.MAD_K * max(1.4826 * mad, 0.1 * median)) * self.MARGIN
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            self._load()
+            return _optional_import('numpy') is not None and len(self._templates) >= self.MIN_TEMPLATES
+
+    def score(self, audio: sr.AudioData) -> float | None:
+        """Best DTW distance of the phrase to any template (lower is closer)."""
+        feats = _mfcc(audio.get_raw_data(), audio.sample_rate)
+        if feats is None:
+            return None
+        with self._lock:
+            self._load()
+            templates = list(self._templates)
+        if not templates:
+            return None
+        return min(_dtw_distance(t, feats) for t in templates)
+
+    def detect(self, audio: sr.AudioData) -> bool:
+        """True if the phrase may contain the wake word and is worth sending to the cloud recognizer."""
+        if not self.ready:
+            return True
+        self.last_score = self.score(audio)
+        return self.last_score is not None and self.last_score <= self.threshold
+
+    def enroll(self, audio: sr.AudioData) -> bool:
+        """Save a recording of the wake word as a template."""
+        feats = _mfcc(audio.get_raw_data(), audio.sample_rate)
+        if feats is None or len(feats) < 5:
+            return False
+        with self._lock:
+            self._load()
             try:
-                audio = recognizer.listen(source, timeout=8, phrase_time_limit=8)
-            except sr.WaitTimeoutError:
-                print("No speech detected in timeout window.")
-                speak("I didn't hear anything. Please try again.")
+                os.makedirs(self._dir, exist_ok=True)
+                path = os.path.join(self._dir, f"wake_{int(time.time() * 1000)}.wav")
+                with wave.open(path, 'wb') as w:
+                    w.setnchannels(1)
+                    w.setsampwidth(audio.sample_width)
+                    w.setframerate(audio.sample_rate)
+                    w.writeframes(audio.get_raw_data())
+            except Exception:
+                return False
+            self._templates = (self._templates + [feats])[-self.MAX_TEMPLATES:]
+            self._calibrate()
+        return True
+
+    def confirmed(self, audio: sr.AudioData) -> None:
+        """The cloud recognizer heard only the wake word in ``audio``; learn from it while templates are scarce."""
+        with self._lock:
+            self._load()
+            scarce = len(self._templates) < self.MIN_TEMPLATES
+        if scarce:
+            self.enroll(audio)
+
+
+_WAKE_PHRASES = ("jarvis", "hey jarvis", "ok jarvis", "okay jarvis")
+
+
+def _is_bare_wake_phrase(text: str) -> bool:
+    """True if a transcript is the wake word alone (optionally with "hey"/"ok"), with nothing after it."""
+    return " ".join(re.findall(r"[a-z']+", text.lower())) in _WAKE_PHRASES
+
+
+class _CloudWakeDetector:
+    """No local gate: every phrase goes to the cloud recognizer (the original behaviour)."""
+
+    ready = True
+
+    def detect(self, audio: sr.AudioData) -> bool:
+        return True
+
+    def confirmed(self, audio: sr.AudioData) -> None:
+        pass
+
+
+_WAKE_DETECTORS = {
+    'template': lambda: TemplateWakeDetector(_data_path("wake_templates")),
+    'cloud': _CloudWakeDetector,
+}
+wake_detector = _WAKE_DETECTORS.get(WAKE_ENGINE, _WAKE_DETECTORS['template'])()
+
+
+# ----- Speech to text -----
+STT_BACKENDS = [n.strip().lower() for n in os.environ.get('JARVIS_STT', 'google,vosk').split(',') if n.strip()]
+STT_GRAMMAR_CONFIDENCE = float(os.environ.get('JARVIS_STT_GRAMMAR_CONFIDENCE', '0.85') or 0.85)
+
+
+def _pcm16k(audio: sr.AudioData) -> bytes:
+    return audio.get_raw_data(convert_rate=16000, convert_width=2)
+
+
+class _GoogleSTT:
+    """Google Web Speech through speech_recognition (needs network)."""
+
+    name = 'google'
+    supports_grammar = False
+
+    def __init__(self):
+        self._recognizer = recognizer
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def transcribe(self, audio: sr.AudioData, grammar: list[str] | None = None) -> str | None:
+        try:
+            return self._recognizer.recognize_google(audio, language="en-US") or None
+        except sr.UnknownValueError:
+            return None
+
+
+class _VoskSTT:
+    """Offline, CPU-only recognition with Vosk.
+
+    The model folder comes from JARVIS_VOSK_MODEL or ``vosk-model`` in the data
+    folder. With a grammar the recognizer is restricted to those phrases
+    (plus "[unk]"), which is much faster and more accurate for short commands.
+    """
+
+    name = 'vosk'
+    supports_grammar = True
+
+    def __init__(self, model_path: str | None = None):
+        self._model_path = model_path or os.environ.get('JARVIS_VOSK_MODEL', '').strip() or _data_path("vosk-model")
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return _optional_import('vosk') is not None and os.path.isdir(self._model_path)
+
+    def _get_model(self):
+        with self._lock:
+            if self._model is None:
+                vosk = _optional_import('vosk')
+                vosk.SetLogLevel(-1)
+                self._model = vosk.Model(self._model_path)
+            return self._model
+
+    def transcribe(self, audio: sr.AudioData, grammar: list[str] | None = None) -> str | None:
+        vosk = _optional_import('vosk')
+        model = self._get_model()
+        if grammar:
+            rec = vosk.KaldiRecognizer(model, 16000, json.dumps(list(grammar) + ["[unk]"]))
+        else:
+            rec = vosk.KaldiRecognizer(model, 16000)
+        rec.SetWords(True)
+        rec.AcceptWaveform(_pcm16k(audio))
+        result = json.loads(rec.FinalResult())
+        text = (result.get('text') or '').strip()
+        if grammar and text:
+            words = result.get('result') or []
+            confidence = sum(w.get('conf', 0.0) for w in words) / len(words) if words else 0.0
+            if confidence < STT_GRAMMAR_CONFIDENCE:
                 return None
-    except OSError as e:
-        print(f"Microphone error: {e}")
-        speak("I couldn't access the microphone.")
+        return text or None
+
+
+class _CommandSTT:
+    """Runs an external offline transcriber on a temporary WAV file.
+
+    JARVIS_STT_COMMAND is the command line without the file, which is appended
+    last; it should print the transcript to stdout, e.g. whisper.cpp:
+    ``whisper-cli -m ggml-base.en.bin -nt -np -f``.
+    """
+
+    name = 'command'
+    supports_grammar = False
+
+    def __init__(self, command: list[str] | None = None):
+        self._command = command or os.environ.get('JARVIS_STT_COMMAND', '').split()
+
+    @property
+    def available(self) -> bool:
+        return bool(self._command) and (os.path.isfile(self._command[0]) or shutil.which(self._command[0]) is not None)
+
+    def transcribe(self, audio: sr.AudioData, grammar: list[str] | None = None) -> str | None:
+        fd, path = tempfile.mkstemp(suffix=".wav")
+        try:
+            with os.fdopen(fd, "wb") as fh, wave.open(fh, "wb") as w:
+                w.setnchannels(1)
+                w.setsampwidth(2)
+                w.setframerate(16000)
+                w.writeframes(_pcm16k(audio))
+            proc = subprocess.run(self._command + [path], capture_output=True, text=True, timeout=60)
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        # Drop markers such as [BLANK_AUDIO] or (music)
+        text = re.sub(r"\[[^\]]*\]|\([^)]*\)", " ", proc.stdout)
+        return " ".join(text.split()) or None
+
+
+_STT_BACKENDS = {
+    'google': _GoogleSTT,
+    'vosk': _VoskSTT,
+    'command': _CommandSTT,
+    'whisper': _CommandSTT,
+}
+
+
+class SpeechToText:
+    """Transcribes captured commands with the configured recognizer backends.
+
+    Backends are tried in JARVIS_STT order until one returns text; one that
+    raises (no network, engine missing) is skipped, so a local engine listed
+    after "google" takes over offline. Before open transcription, backends
+    that support grammars get a constrained pass over the router's complete
+    command phrases, and a confident whole-phrase match is returned at once.
+    """
+
+    def __init__(self, names: list[str] | None = None, router: 'IntentRouter | None' = None):
+        self.names = list(names if names is not None else STT_BACKENDS)
+        self._router = router
+        self._backends = None
+        self.last_backend: str | None = None
+
+    def backends(self) -> list:
+        if self._backends is None:
+            backends = []
+            for name in self.names:
+                factory = _STT_BACKENDS.get(name)
+                try:
+                    backend = factory() if factory is not None else None
+                    if backend is not None and backend.available:
+                        backends.append(backend)
+                except Exception:
+                    pass
+            self._backends = backends
+        return self._backends
+
+    def grammar(self) -> list[str]:
+        router = self._router or intent_router
+        return router.vocabulary()
+
+    def transcribe(self, audio: sr.AudioData) -> str | None:
+        """Return the transcript, None if nothing intelligible was heard; sr.RequestError if no backend could run."""
+        backends = self.backends()
+        grammar_backends = [b for b in backends if b.supports_grammar]
+        if grammar_backends:
+            phrases = self.grammar()
+            allowed = set(phrases)
+            for backend in grammar_backends:
+                try:
+                    text = backend.transcribe(audio, grammar=phrases)
+                except Exception:
+                    continue
+                if text and text.lower() in allowed:
+                    self.last_backend = f"{backend.name}-grammar"
+                    return text
+        errors = []
+        for backend in backends:
+            try:
+                text = backend.transcribe(audio)
+            except Exception as e:
+                errors.append(e)
+                continue
+            if text:
+                self.last_backend = backend.name
+                return text
+        if backends and len(errors) == len(backends):
+            raise sr.RequestError(str(errors[-1]))
+        return None
+
+
+speech_to_text = SpeechToText()
+
+
+class RecognitionSession:
+    """Recognition that starts while a command is still being captured.
+
+    The endpointer feeds every captured frame. As soon as a pause of
+    ``speculate_after`` seconds begins, the audio so far is transcribed in the
+    background. If that pause turns out to end the command, its transcript is
+    ready (or nearly) when capture returns; if speech resumes, it is dropped
+    and the next pause starts a new attempt. Finished transcripts of the
+    command so far are passed to ``on_partial(text, session)``; if it returns
+    True (the transcript is already a complete command) and no speech has
+    followed, ``feed`` tells the endpointer to stop waiting for the trailing
+    silence. An attempt counts as finished only after ``on_partial`` returned,
+    so ``finish`` never races a late speculation.
+    """
+
+    MAX_ATTEMPTS = 4
+
+    def __init__(self, stt: SpeechToText, sample_rate: int, sample_width: int, on_partial=None,
+                 speculate_after: float = 0.15):
+        self._stt = stt
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.on_partial = on_partial
+        self.speculate_after = speculate_after
+        self._pcm = bytearray()
+        self._voiced_at = 0
+        self._job: dict | None = None
+        self._attempts = 0
+        self._complete_at = -1
+        self.speculative_hit = False
+
+    def reset(self) -> None:
+        self._pcm = bytearray()
+        self._voiced_at = 0
+        self._job = None
+        self._complete_at = -1
+
+    def feed(self, pcm: bytes, speech: bool, silence: float) -> bool:
+        """Add a captured frame; True means the command is complete and capture may end."""
+        self._pcm += pcm
+        if speech:
+            self._voiced_at = len(self._pcm)
+            return False
+        if (silence >= self.speculate_after and self._voiced_at
+                and (self._job is None or self._job['voiced_at'] != self._voiced_at)
+                and self._attempts < self.MAX_ATTEMPTS):
+            self._speculate()
+        return self._complete_at == self._voiced_at
+
+    def _speculate(self) -> None:
+        self._attempts += 1
+        job = {'voiced_at': self._voiced_at, 'done': threading.Event(), 'text': None, 'error': None}
+        audio = sr.AudioData(bytes(self._pcm), self.sample_rate, self.sample_width)
+
+        def _run():
+            try:
+                job['text'] = self._stt.transcribe(audio)
+                if job['text'] and self.on_partial is not None:
+                    try:
+                        if self.on_partial(job['text'], self) is True:
+                            self._complete_at = job['voiced_at']
+                    except Exception:
+                        pass
+            except Exception as e:
+                job['error'] = e
+            finally:
+                job['done'].set()
+
+        self._job = job
+        threading.Thread(target=_run, daemon=True).start()
+
+    def finish(self, audio: sr.AudioData) -> str | None:
+        """Transcript of the captured command, reusing the speculative one when no speech followed it."""
+        job = self._job
+        if job is not None and job['voiced_at'] == self._voiced_at:
+            job['done'].wait()
+            self.speculative_hit = True
+            if job['error'] is not None:
+                raise job['error']
+            return job['text']
+        return self._stt.transcribe(audio)
+
+
+def takecommand(start: int | None = None) -> str | None:
+    """Listen from the microphone and return recognized lowercased text or None.
+
+    Audio comes from the shared ``audio_stream``; ``start`` is the frame to
+    begin at (default: now), so a command spoken straight after the wake
+    word is not lost.
+    """
+    with tracer.span("capture"):
+        if not audio_stream.start():
+            print(f"Microphone error: {audio_stream.error}")
+            speak("I couldn't access the microphone.")
+            return None
+        print("Listening…")
+        session = RecognitionSession(speech_to_text, audio_stream.sample_rate, audio_stream.sample_width,
+                                     on_partial=_speculate_partial if SPECULATIVE_INTENTS else None)
+        audio, _ = audio_stream.capture_phrase(start, timeout=8, phrase_limit=COMMAND_MAX_SECONDS,
+                                               pause=VAD_TRAILING_SILENCE, listener=session)
+    if audio is None:
+        print("No speech detected in timeout window.")
+        speak("I didn't hear anything. Please try again.")
         return None
 
+    text = None
     try:
         print("Recognizing…")
-        text = recognizer.recognize_google(audio, language="en-US")
-        print(text)
-        try:
-            if UI.instance is not None:
-                UI.instance.log_user(text)
-        except Exception:
-            pass
-        return text.lower()
-    except sr.UnknownValueError:
-        print("Unintelligible speech.")
-        return None
+        with tracer.span("stt"):
+            text = session.finish(audio)
     except sr.RequestError:
         print("Speech service unavailable.")
         speak("Speech recognition service is unavailable.")
@@ -459,13 +2181,41 @@ def takecommand() -> str | None:
     except Exception as e:
         print(f"Recognition error: {e}")
         return None
+    finally:
+        # Keep this capture's speculation only if it was about the final transcript
+        intent_router.settle(session, _strip_wake_word(text.lower().strip()) if text else None)
+    if not text:
+        print("Unintelligible speech.")
+        return None
+    print(text)
+    try:
+        if UI.instance is not None:
+            UI.instance.log_user(text)
+    except Exception:
+        pass
+    return text.lower()
+
+
+SHUFFLE_TRACKS = 10
 
 
 def play_music(song_name=None) -> None:
-    """Play music by optional name; searches common user folders and CURRENT_DIR."""
+    """Play music by optional name; searches common user folders and CURRENT_DIR.
+
+    Files play in-process on the shared player, so pause, seek and "next"
+    act on them directly; without VLC they open in the registered app.
+    Asking for no particular song queues a shuffle from the library; a
+    named song that is not found is reported, not replaced by a shuffle.
+    """
     path = None
     if song_name:
         path = _find_audio_file(song_name)
+        if path is None:
+            _speak_and_log(f"I couldn't find {song_name} in your music.")
+            return
+    shuffle = path is None
+    if shuffle:
+        path = music_library.random_track()
     if path is None:
         # fallback: pick random from Music
         song_dir = os.path.expanduser("~\\Music")
@@ -476,9 +2226,19 @@ def play_music(song_name=None) -> None:
         if items:
             path = os.path.join(song_dir, random.choice(items))
     if path and os.path.isfile(path):
+        player = _AudioPlayer.instance()
+        if player.play_file(path):
+            if shuffle:
+                for _ in range(SHUFFLE_TRACKS - 1):
+                    extra = music_library.random_track()
+                    if extra is None:
+                        break
+                    player.enqueue_file(extra)
+            _speak_and_log(f"Playing {music_library.describe(path)}")
+            return
         try:
             os.startfile(path)
-            _speak_and_log(f"Playing {os.path.basename(path)}")
+            _speak_and_log(f"Playing {music_library.describe(path)}")
         except Exception:
             _speak_and_log("I found a track but couldn't play it.")
     else:
@@ -526,14 +2286,9 @@ def _is_audio_file(filename: str) -> bool:
 
 
 def _find_audio_file(name: str) -> str | None:
-    """Find an audio file by fuzzy name in CURRENT_DIR and common user folders."""
+    """Find an audio file by title, artist or file name (see MusicLibrary), or as a path in CURRENT_DIR."""
     q = _normalize_spoken_path_tokens(name).lower()
-    roots = [
-        CURRENT_DIR,
-        os.path.expanduser("~\\Music"),
-        os.path.expanduser("~\\Downloads"),
-        os.path.expanduser("~\\Desktop"),
-    ]
+    roots = [CURRENT_DIR] + music_library.roots()
     # exact file name first
     for r in roots:
         try:
@@ -542,7 +2297,9 @@ def _find_audio_file(name: str) -> str | None:
                 return cand
         except Exception:
             pass
-    # fuzzy search by filename contains
+    if music_library.ready():
+        return music_library.find(q)
+    # The library is still being built: search file names the slow way this time
     for r in roots:
         try:
             for base, _dirs, files in os.walk(r):
@@ -598,7 +2355,7 @@ def set_name() -> None:
 
 def list_voices() -> None:
     """Lists available voices by index and name."""
-    available = engine.getProperty('voices')
+    available = _get_engine().getProperty('voices')
     lines = []
     for idx, v in enumerate(available):
         lines.append(f"{idx}: {getattr(v, 'name', 'Unknown')}")
@@ -609,7 +2366,8 @@ def list_voices() -> None:
 
 def set_voice_from_query(query: str) -> None:
     """Set voice based on user query (by index or gender keywords)."""
-    available = engine.getProperty('voices')
+    eng = _get_engine()
+    available = eng.getProperty('voices')
     if not available:
         speak("No voices are available on this system.")
         return
@@ -634,7 +2392,7 @@ def set_voice_from_query(query: str) -> None:
                 break
     if chosen is None:
         chosen = available[0]
-    engine.setProperty('voice', chosen.id)
+    eng.setProperty('voice', chosen.id)
     speak("Voice updated.")
 
 
@@ -649,15 +2407,17 @@ def load_name() -> str:
 
 def search_wikipedia(query):
     """Searches Wikipedia and returns a summary."""
+    wikipedia = _optional_import('wikipedia')
     try:
         speak("Searching Wikipedia...")
         result = wikipedia.summary(query, sentences=2)
         speak(result)
         print(result)
-    except wikipedia.exceptions.DisambiguationError:
-        speak("Multiple results found. Please be more specific.")
-    except Exception:
-        speak("I couldn't find anything on Wikipedia.")
+    except Exception as e:
+        if wikipedia is not None and isinstance(e, wikipedia.exceptions.DisambiguationError):
+            speak("Multiple results found. Please be more specific.")
+        else:
+            speak("I couldn't find anything on Wikipedia.")
 
 
 def _current_model_label() -> str:
@@ -680,105 +2440,684 @@ CURRENT_DIR = os.getcwd()
 PLAY_ON_WEB_BY_DEFAULT = False
 
 
-class _OnlineAudioPlayer:
-    _instance = None
+class _YtDlpExtractor:
+    """Finds and resolves YouTube audio through reused ``yt_dlp.YoutubeDL`` instances.
 
-    def __init__(self):
-        self._lock = threading.RLock()
-        self._playlist: list[tuple[str, str]] = []  # (url, title)
-        self._index = -1
-        self._vlc_instance = None
-        self._player = None
-        self._active = False
+    A YoutubeDL is not thread-safe, so each instance has its own lock around
+    ``extract_info``. Background refreshes get an instance of their own, so
+    they never hold up the lookup for a song the user just asked for.
+    """
 
-    @classmethod
-    def instance(cls):
-        if cls._instance is None:
-            cls._instance = _OnlineAudioPlayer()
-        return cls._instance
+    OPTIONS = {
+        'format': 'bestaudio/best',
+        'quiet': True,
+        'no_warnings': True,
+        'default_search': 'ytsearch1',
+        'skip_download': True,
+    }
 
-    def _ensure_vlc(self) -> bool:
-        if vlc is None:
-            _speak_and_log("Online player not installed. Please install requirements.")
-            return False
-        if self._vlc_instance is None:
-            try:
-                self._vlc_instance = vlc.Instance()
-            except Exception:
-                self._vlc_instance = None
-        return self._vlc_instance is not None
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: dict[str, tuple[object, threading.Lock]] = {}
 
-    def _search_stream(self, query: str) -> tuple[str | None, str | None]:
+    def _client(self, kind: str = "play"):
+        """``(YoutubeDL, lock)`` for ``kind``: "play", "background" or "flat" (search result lists)."""
+        yt_dlp = _optional_import('yt_dlp')
         if yt_dlp is None:
             return None, None
+        with self._lock:
+            if kind not in self._clients:
+                opts = {**self.OPTIONS, 'extract_flat': 'in_playlist'} if kind == "flat" else self.OPTIONS
+                self._clients[kind] = (yt_dlp.YoutubeDL(opts), threading.Lock())
+            return self._clients[kind]
+
+    def _extract(self, target: str, kind: str = "play") -> dict | None:
+        ydl, lock = self._client(kind)
+        if ydl is None:
+            return None
+        with lock:
+            info = ydl.extract_info(target, download=False)
+        if info and 'entries' in info:
+            info = info['entries'][0] if info['entries'] else None
+        return info or None
+
+    def search(self, query: str) -> dict | None:
+        """Full search: the first result's info (``id``, ``url``, ``title``, ...)."""
+        return self._extract(query)
+
+    def resolve(self, video_id: str, background: bool = False) -> dict | None:
+        """Fresh stream info for a known video, skipping the search."""
+        return self._extract(f"https://www.youtube.com/watch?v={video_id}", "background" if background else "play")
+
+    def search_many(self, query: str, count: int) -> list[dict]:
+        """Top ``count`` results as flat entries (``id`` and ``title``, no stream URL)."""
+        ydl, lock = self._client("flat")
+        if ydl is None:
+            return []
+        with lock:
+            info = ydl.extract_info(f"ytsearch{count}:{query}", download=False) or {}
+        return [e for e in info.get('entries') or [] if e and e.get('id')]
+
+
+def _stream_expiry(url: str, default_ttl: float) -> float:
+    """Expiry time of a signed stream URL (its ``expire`` parameter), else now + ``default_ttl``."""
+    try:
+        expire = urllib.parse.parse_qs(urllib.parse.urlparse(url).query).get('expire')
+        if expire:
+            return float(expire[0])
+    except Exception:
+        pass
+    return time.time() + default_ttl
+
+
+class StreamCache:
+    """Two-level cache in front of the online music search, persisted as JSON.
+
+    Level one maps a normalized query to the video it found (id, title,
+    duration) and lives for ``query_ttl``. Level two maps a video id to its
+    resolved stream URL until the URL's own expiry. A replay of a known
+    query with a live URL needs no extraction at all; with an expired URL
+    only the video is re-resolved, skipping the search. URLs within
+    REFRESH_AHEAD of expiring are still used but re-resolved in the
+    background, and ``warm`` refreshes the most recently played ones.
+    """
+
+    VERSION = 1
+    REFRESH_AHEAD = 1800.0
+    EXPIRY_MARGIN = 120.0
+
+    def __init__(self, path: str | None, extractor=None, max_queries: int = 2000,
+                 query_ttl: float = 90 * 24 * 3600, default_stream_ttl: float = 3600.0):
+        self._path = path
+        self.extractor = extractor or _YtDlpExtractor()
+        self.max_queries = max_queries
+        self.query_ttl = query_ttl
+        self.default_stream_ttl = default_stream_ttl
+        self._lock = threading.RLock()
+        self._queries: collections.OrderedDict[str, dict] = collections.OrderedDict()
+        self._streams: dict[str, dict] = {}
+        self._refreshing: set[str] = set()
+        self._loaded = False
+        self.hits = 0
+        self.stream_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self._path:
+            return
         try:
-            opts = {
-                'format': 'bestaudio/best',
-                'quiet': True,
-                'no_warnings': True,
-                'default_search': 'ytsearch1',
-                'skip_download': True,
-            }
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                info = ydl.extract_info(query, download=False)
-                if info is None:
-                    return None, None
-                if 'entries' in info:
-                    info = info['entries'][0] if info['entries'] else None
-                if not info:
-                    return None, None
-                stream_url = info.get('url')
-                title = info.get('title') or query
-                return stream_url, title
+            with open(self._path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+            if data.get("version") != self.VERSION:
+                return
+            now = time.time()
+            for key, entry in sorted(data.get("queries", {}).items(), key=lambda kv: kv[1].get("last_used", 0)):
+                if now - entry.get("created", 0) <= self.query_ttl:
+                    self._queries[key] = entry
+            live = {e["id"] for e in self._queries.values()}
+            self._streams = {vid: s for vid, s in data.get("streams", {}).items()
+                             if vid in live and s.get("expires", 0) > now}
         except Exception:
-            return None, None
+            pass
 
-    def _bind_events(self):
+    def _save(self) -> None:
+        if not self._path:
+            return
         try:
-            if not self._player:
-                return
-            em = self._player.event_manager()
-            em.event_detach_all()
-            em.event_attach(vlc.EventType.MediaPlayerEndReached, lambda e: self.next())
+            tmp = self._path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump({"version": self.VERSION, "queries": self._queries, "streams": self._streams}, fh)
+            os.replace(tmp, self._path)
         except Exception:
             pass
 
-    def play_query(self, query: str) -> bool:
-        if not self._ensure_vlc():
-            return False
-        url, title = self._search_stream(query)
-        if not url:
-            return False
+    def _store(self, key: str | None, info: dict) -> tuple[str | None, str | None]:
+        url, vid = info.get('url'), info.get('id')
+        title = info.get('title')
+        if not url or not vid:
+            return url, title
+        now = time.time()
+        with self._lock:
+            if key:
+                self._queries.pop(key, None)
+                self._queries[key] = {"id": vid, "title": title, "duration": info.get('duration'),
+                                      "created": now, "last_used": now}
+                while len(self._queries) > self.max_queries:
+                    _old, entry = self._queries.popitem(last=False)
+                    if not any(e["id"] == entry["id"] for e in self._queries.values()):
+                        self._streams.pop(entry["id"], None)
+            self._streams[vid] = {"url": url, "title": title,
+                                  "expires": _stream_expiry(url, self.default_stream_ttl)}
+            if len(self._streams) > self.max_queries:
+                # Radio/album tracks have no query entry; keep only those still in use
+                live = {e["id"] for e in self._queries.values()} | {vid}
+                self._streams = {k: v for k, v in self._streams.items() if k in live}
+            self._save()
+        return url, title
+
+    def resolve(self, query: str) -> tuple[str | None, str | None]:
+        """``(stream_url, title)`` for a spoken query, or ``(None, None)``."""
+        key = _normalize_prompt(query)
+        now = time.time()
         with self._lock:
-            self._playlist.append((url, title or query))
-            self._index = len(self._playlist) - 1
+            self._ensure_loaded()
+            entry = self._queries.get(key)
+            if entry is not None and now - entry["created"] > self.query_ttl:
+                self._queries.pop(key, None)
+                entry = None
+            if entry is not None:
+                entry["last_used"] = now
+                self._queries.move_to_end(key)
+                stream = self._streams.get(entry["id"])
+                if stream is not None and stream["expires"] - self.EXPIRY_MARGIN > now:
+                    self.hits += 1
+                    if stream["expires"] - now < self.REFRESH_AHEAD:
+                        self._refresh_later(entry["id"])
+                    return stream["url"], entry["title"]
+        if entry is not None:
+            # Known video, dead URL: re-resolve it without searching again
+            self.stream_hits += 1
             try:
-                self._player = self._vlc_instance.media_player_new()
-                media = self._vlc_instance.media_new(url)
-                self._player.set_media(media)
-                self._player.audio_set_volume(85)
-                self._bind_events()
-                self._player.play()
-                self._active = True
+                info = self.extractor.resolve(entry["id"])
             except Exception:
-                self._active = False
-                return False
-        _speak_and_log(f"Playing {title or 'music'} online")
-        return True
+                info = None
+            if info:
+                info.setdefault('id', entry["id"])
+                info.setdefault('title', entry["title"])
+                return self._store(key, info)
+        self.misses += 1
+        try:
+            info = self.extractor.search(query)
+        except Exception:
+            info = None
+        if not info:
+            return None, None
+        url, title = self._store(key, info)
+        return url, title or query
 
-    def pause(self) -> bool:
+    def known(self, query: str) -> tuple[str, str | None] | None:
+        """``(video_id, title)`` a query resolved to before, without any extraction."""
         with self._lock:
-            if self._player and self._player.is_playing():
-                try:
-                    self._player.pause()
-                    return True
-                except Exception:
+            self._ensure_loaded()
+            entry = self._queries.get(_normalize_prompt(query))
+            if entry is None or time.time() - entry["created"] > self.query_ttl:
+                return None
+            return entry["id"], entry["title"]
+
+    def resolve_video(self, video_id: str, title: str | None = None) -> tuple[str | None, str | None]:
+        """``(stream_url, title)`` for a known video id, using level two only."""
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            stream = self._streams.get(video_id)
+            if stream is not None and stream["expires"] - self.EXPIRY_MARGIN > now:
+                self.hits += 1
+                if stream["expires"] - now < self.REFRESH_AHEAD:
+                    self._refresh_later(video_id)
+                return stream["url"], title or stream.get("title")
+        self.stream_hits += 1
+        try:
+            info = self.extractor.resolve(video_id)
+        except Exception:
+            info = None
+        if not info:
+            return None, None
+        info.setdefault('id', video_id)
+        return self._store(None, info)[0], title or info.get('title')
+
+    def search_many(self, query: str, count: int = 10) -> list[tuple[str, str | None]]:
+        """``(video_id, title)`` of the top results for ``query`` (a radio/album style search)."""
+        return [(e['id'], e.get('title')) for e in self.extractor.search_many(query, count)]
+
+    def _refresh_later(self, video_id: str) -> None:
+        with self._lock:
+            if video_id in self._refreshing:
+                return
+            self._refreshing.add(video_id)
+        threading.Thread(target=self._refresh, args=(video_id,), daemon=True).start()
+
+    def _refresh(self, video_id: str) -> None:
+        try:
+            info = self.extractor.resolve(video_id, background=True)
+            if info and info.get('url'):
+                info.setdefault('id', video_id)
+                self.refreshes += 1
+                self._store(None, info)
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.discard(video_id)
+
+    def warm(self, count: int = 10) -> None:
+        """Re-resolve expired or expiring URLs of the ``count`` most recently played queries, in the background."""
+        def _run():
+            with self._lock:
+                self._ensure_loaded()
+                recent = [e["id"] for e in reversed(self._queries.values())][:count]
+                now = time.time()
+                due = [vid for vid in dict.fromkeys(recent)
+                       if self._streams.get(vid, {}).get("expires", 0) - now < self.REFRESH_AHEAD]
+            for vid in due:
+                self._refresh_later(vid)
+        threading.Thread(target=_run, daemon=True).start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._ensure_loaded()
+            return {"queries": len(self._queries), "streams": len(self._streams), "hits": self.hits,
+                    "stream_hits": self.stream_hits, "misses": self.misses, "refreshes": self.refreshes}
+
+
+stream_cache = StreamCache(_data_path("stream_cache.json"))
+
+
+# ----- Offline audio cache -----
+class AudioCache:
+    """Size-bounded on-disk copies of online tracks, keyed by video id.
+
+    Opt-in (``max_bytes`` of 0 disables it). After a track starts streaming,
+    ``fetch_later`` downloads it in the background; the next play of that
+    video opens the local file instead of resolving and streaming it. When
+    the total exceeds ``max_bytes``, the entries with the lowest aged
+    frequency are evicted: play count halved every ``half_life`` seconds
+    since the last play, so tracks played often and recently stay while
+    one-off plays and old favourites go first. The index is a JSON file
+    next to the audio files.
+    """
+
+    VERSION = 1
+
+    def __init__(self, directory: str, max_bytes: int, half_life: float = 7 * 24 * 3600,
+                 max_track_bytes: int = 64 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.half_life = half_life
+        self.max_track_bytes = min(max_track_bytes, max_bytes) if max_bytes else 0
+        self._lock = threading.RLock()
+        self._entries: dict[str, dict] = {}
+        self._fetching: set[str] = set()
+        self._pool = None
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+            if data.get("version") == self.VERSION:
+                self._entries = {vid: e for vid, e in data.get("entries", {}).items()
+                                 if os.path.isfile(os.path.join(self.directory, e["file"]))}
+        except Exception:
+            pass
+
+    def _save(self) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = self._index_path() + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump({"version": self.VERSION, "entries": self._entries}, fh)
+            os.replace(tmp, self._index_path())
+        except Exception:
+            pass
+
+    def _score(self, entry: dict, now: float) -> float:
+        return entry["plays"] * 0.5 ** ((now - entry["last_used"]) / self.half_life)
+
+    def path(self, video_id: str | None) -> str | None:
+        """Local file for ``video_id`` if cached (counted as a hit), else None (a miss)."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._entries.get(video_id) if video_id else None
+            if entry is not None:
+                path = os.path.join(self.directory, entry["file"])
+                if os.path.isfile(path):
+                    entry["plays"] += 1
+                    entry["last_used"] = time.time()
+                    self.hits += 1
+                    self._save()
+                    return path
+                del self._entries[video_id]
+            self.misses += 1
+            return None
+
+    def fetch_later(self, video_id: str | None, url: str | None) -> None:
+        """Download ``url`` into the cache in the background (one download at a time)."""
+        if not self.enabled or not video_id or not url:
+            return
+        with self._lock:
+            self._ensure_loaded()
+            if video_id in self._entries or video_id in self._fetching:
+                return
+            self._fetching.add(video_id)
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="audio-cache")
+            self._pool.submit(self._fetch, video_id, url)
+
+    def _fetch(self, video_id: str, url: str) -> None:
+        name = re.sub(r"[^\w-]", "_", video_id) + ".audio"
+        target = os.path.join(self.directory, name)
+        tmp = target + ".part"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            size = 0
+            with urllib.request.urlopen(url, timeout=30) as resp, open(tmp, "wb") as fh:
+                while True:
+                    chunk = resp.read(1 << 16)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_track_bytes:
+                        raise ValueError("track larger than the cache allows")
+                    fh.write(chunk)
+            os.replace(tmp, target)
+            now = time.time()
+            with self._lock:
+                self._entries[video_id] = {"file": name, "size": size, "plays": 1, "last_used": now}
+                self._evict(keep=video_id)
+                self._save()
+        except Exception:
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+        finally:
+            with self._lock:
+                self._fetching.discard(video_id)
+
+    def _evict(self, keep: str | None = None) -> None:
+        total = sum(e["size"] for e in self._entries.values())
+        if total <= self.max_bytes:
+            return
+        now = time.time()
+        for vid in sorted((v for v in self._entries if v != keep), key=lambda v: self._score(self._entries[v], now)):
+            if total <= self.max_bytes:
+                break
+            entry = self._entries.pop(vid)
+            total -= entry["size"]
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._ensure_loaded()
+            lookups = self.hits + self.misses
+            return {"tracks": len(self._entries), "bytes": sum(e["size"] for e in self._entries.values()),
+                    "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses,
+                    "hit_ratio": self.hits / lookups if lookups else 0.0, "evictions": self.evictions}
+
+
+audio_cache = AudioCache(_data_path("audio_cache"),
+                         max_bytes=int(float(os.environ.get('JARVIS_AUDIO_CACHE_MB', '0') or 0) * (1 << 20)))
+
+
+class _AudioPlayer:
+    """Play queue for local files and online tracks on one reused VLC media player.
+
+    The queue holds entries ``{"query", "title", "url"}``, plus ``"id"``
+    for online tracks with a known video and ``"file"`` for local files;
+    ``_index`` is the one playing. While a track plays, the next one is
+    resolved and its media opened and parsed in the background, so the
+    switch at the end of a track only swaps media. Played entries beyond
+    HISTORY are dropped and each media is released once replaced, so
+    memory stays flat.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+    HISTORY = 20
+    PREFETCH = True
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._queue: list[dict] = []
+        self._index = -1
+        self._vlc_instance = None
+        self._player = None
+        self._media = None
+        self._next: tuple[dict, object] | None = None  # (entry, prefetched media)
+        self._active = False
+
+    @classmethod
+    def instance(cls):
+        # Reached from several command workers at once; two players would fight over the audio device
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = _AudioPlayer()
+        return cls._instance
+
+    def _ensure_vlc(self, announce: bool = True) -> bool:
+        vlc = _optional_import('vlc')
+        if vlc is None:
+            if announce:
+                _speak_and_log("Music player not installed. Please install requirements.")
+            return False
+        if self._vlc_instance is None:
+            try:
+                self._vlc_instance = vlc.Instance()
+            except Exception:
+                self._vlc_instance = None
+        if self._vlc_instance is None:
+            return False
+        if self._player is None:
+            try:
+                self._player = self._vlc_instance.media_player_new()
+                self._player.audio_set_volume(85)
+                self._player.event_manager().event_attach(vlc.EventType.MediaPlayerEndReached, self._on_end)
+            except Exception:
+                self._player = None
+        return self._player is not None
+
+    def _search_stream(self, query: str) -> tuple[str | None, str | None]:
+        try:
+            return stream_cache.resolve(query)
+        except Exception:
+            return None, None
+
+    def _resolve(self, entry: dict) -> str | None:
+        """Fill in the entry's source: a cached local file, else its stream URL."""
+        if entry.get("file"):
+            return entry["url"] if os.path.isfile(entry["url"]) else None
+        try:
+            if not entry.get("id"):
+                known = stream_cache.known(entry["query"])
+                if known:
+                    entry["id"], entry["title"] = known[0], entry.get("title") or known[1]
+            local = audio_cache.path(entry.get("id"))
+            if local:
+                entry.update(url=local, local=True, title=entry.get("title") or entry["query"])
+                return local
+            if entry.get("id"):
+                url, title = stream_cache.resolve_video(entry["id"], entry.get("title"))
+            else:
+                url, title = stream_cache.resolve(entry["query"])
+                known = stream_cache.known(entry["query"])
+                if known:
+                    entry["id"] = known[0]
+        except Exception:
+            url, title = None, None
+        if url:
+            entry["url"] = url
+            entry["title"] = entry.get("title") or title or entry["query"]
+        return url
+
+    def _on_end(self, event) -> None:
+        # libvlc must not be called back from its own event thread
+        threading.Thread(target=self._advance, daemon=True).start()
+
+    def _advance(self) -> None:
+        if not self.next():
+            with self._lock:
+                self._active = False
+
+    def _take_prefetched(self, entry: dict):
+        nxt, self._next = self._next, None
+        if nxt is None:
+            return None
+        if nxt[0] is entry:
+            return nxt[1]
+        self._release(nxt[1])
+        return None
+
+    @staticmethod
+    def _release(media) -> None:
+        try:
+            if media is not None:
+                media.release()
+        except Exception:
+            pass
+
+    def _start(self, index: int) -> bool:
+        """Play queue entry ``index`` (its URL already resolved) on the shared player."""
+        entry = self._queue[index]
+        try:
+            media = self._take_prefetched(entry) or self._vlc_instance.media_new(entry["url"])
+            self._player.set_media(media)
+            self._player.play()
+        except Exception:
+            self._active = False
+            return False
+        self._release(self._media)
+        self._media = media
+        self._index = index
+        self._active = True
+        if not entry.get("local"):
+            audio_cache.fetch_later(entry.get("id"), entry["url"])
+        if self._index > self.HISTORY:
+            drop = self._index - self.HISTORY
+            del self._queue[:drop]
+            self._index -= drop
+        if self.PREFETCH:
+            threading.Thread(target=self._prefetch, daemon=True).start()
+        return True
+
+    def _prefetch(self) -> None:
+        with self._lock:
+            if self._index + 1 >= len(self._queue):
+                return
+            entry = self._queue[self._index + 1]
+            if self._next is not None and self._next[0] is entry:
+                return
+        if not self._resolve(entry):
+            return
+        vlc = _optional_import('vlc')
+        try:
+            media = self._vlc_instance.media_new(entry["url"])
+            # Opens the stream and reads its headers ahead of the switch
+            media.parse_with_options(vlc.MediaParseFlag.network, 10000)
+        except Exception:
+            return
+        with self._lock:
+            still_next = self._index + 1 < len(self._queue) and self._queue[self._index + 1] is entry
+            if not still_next:
+                self._release(media)
+                return
+            if self._next is not None:
+                self._release(self._next[1])
+            self._next = (entry, media)
+
+    @staticmethod
+    def _file_entry(path: str) -> dict:
+        return {"query": path, "title": music_library.describe(path), "url": path, "file": True, "local": True}
+
+    def _play_entry(self, entry: dict, announce: bool = True) -> bool:
+        if not self._ensure_vlc(announce) or not self._resolve(entry):
+            return False
+        with self._lock:
+            self._queue.insert(self._index + 1, entry)
+            return self._start(self._index + 1)
+
+    def _enqueue_entry(self, entry: dict) -> str | None:
+        """Append ``entry``; "playing" if the player was idle and it started, "queued" otherwise."""
+        if not self._ensure_vlc(not entry.get("file")) or not self._resolve(entry):
+            return None
+        with self._lock:
+            self._queue.append(entry)
+            if not self.is_active():
+                return "playing" if self._start(len(self._queue) - 1) else None
+            if self._index + 2 == len(self._queue) and self.PREFETCH:
+                threading.Thread(target=self._prefetch, daemon=True).start()
+        return "queued"
+
+    def play_query(self, query: str) -> bool:
+        """Play ``query`` online now, ahead of whatever is queued."""
+        entry = {"query": query, "title": None, "url": None}
+        if not self._play_entry(entry):
+            return False
+        _speak_and_log(f"Playing {entry['title'] or 'music'} online")
+        return True
+
+    def play_file(self, path: str) -> bool:
+        """Play a local file now, ahead of whatever is queued; False when VLC is unavailable."""
+        return self._play_entry(self._file_entry(path), announce=False)
+
+    def enqueue(self, query: str) -> bool:
+        """Add ``query`` (online) to the end of the queue, starting playback if idle."""
+        entry = {"query": query, "title": None, "url": None}
+        result = self._enqueue_entry(entry)
+        if result == "playing":
+            _speak_and_log(f"Playing {entry['title']} online")
+        elif result == "queued":
+            _speak_and_log(f"Queued {entry['title']}")
+        return result is not None
+
+    def enqueue_file(self, path: str) -> str | None:
+        """Add a local file to the end of the queue; see ``_enqueue_entry``."""
+        return self._enqueue_entry(self._file_entry(path))
+
+    def play_radio(self, query: str, count: int = 10) -> bool:
+        """Replace the upcoming queue with the top ``count`` results for ``query`` and start the first."""
+        if not self._ensure_vlc():
+            return False
+        try:
+            found = stream_cache.search_many(query, count)
+        except Exception:
+            found = []
+        entries = [{"query": title or query, "id": vid, "title": title, "url": None} for vid, title in found]
+        if not entries or not self._resolve(entries[0]):
+            return False
+        with self._lock:
+            self._queue[self._index + 1:] = entries
+            if not self._start(self._index + 1):
+                return False
+        _speak_and_log(f"Playing {entries[0]['title']} and {len(entries) - 1} more")
+        return True
+
+    def pause(self) -> bool:
+        with self._lock:
+            if self._player and self._player.is_playing():
+                try:
+                    self._player.pause()
+                    return True
+                except Exception:
                     return False
         return False
 
     def resume(self) -> bool:
         with self._lock:
-            if self._player and not self._player.is_playing():
+            if self._player and self._active and not self._player.is_playing():
                 try:
                     self._player.play()
                     return True
@@ -787,55 +3126,106 @@ class _OnlineAudioPlayer:
         return False
 
     def stop(self) -> bool:
+        """Stop playback; False when nothing was playing or paused, so callers can fall back."""
         with self._lock:
+            was_active = self.is_active()
             if self._player:
                 try:
                     self._player.stop()
                 except Exception:
                     pass
             self._active = False
-            return True
+            return was_active
 
     def next(self) -> bool:
+        """Skip to the next queued track; False when nothing is queued."""
+        with self._lock:
+            if self._player is None or self._index + 1 >= len(self._queue):
+                return False
+            entry = self._queue[self._index + 1]
+            prefetched = self._next is not None and self._next[0] is entry
+        if not prefetched and not self._resolve(entry):
+            return False
+        with self._lock:
+            try:
+                index = self._queue.index(entry)
+            except ValueError:
+                return False
+            return self._start(index)
+
+    def seek(self, seconds: float, relative: bool = True) -> bool:
+        """Move the playing track by ``seconds`` (or to ``seconds`` when not relative)."""
         with self._lock:
-            if not self._playlist:
+            if not self.is_active():
                 return False
-            # For now, replay the same or advance if more queued later
-            self._index = min(self._index + 1, len(self._playlist) - 1)
             try:
-                url, title = self._playlist[self._index]
-                self._player.stop()
-                media = self._vlc_instance.media_new(url)
-                self._player.set_media(media)
-                self._bind_events()
-                self._player.play()
+                target = (self._player.get_time() if relative else 0) + seconds * 1000
+                length = self._player.get_length()
+                if length > 0:
+                    target = min(target, length - 500)
+                self._player.set_time(int(max(0, target)))
                 return True
             except Exception:
                 return False
 
+    def upcoming(self) -> list[str]:
+        with self._lock:
+            return [e["title"] or e["query"] for e in self._queue[self._index + 1:]]
+
+    def now_playing(self) -> dict | None:
+        """Title, state ("playing"/"paused"), position and length in seconds of the current track."""
+        with self._lock:
+            if not self.is_active():
+                return None
+            entry = self._queue[self._index]
+            try:
+                playing = self._player.is_playing()
+                position, length = self._player.get_time() / 1000, self._player.get_length() / 1000
+            except Exception:
+                playing, position, length = True, 0.0, 0.0
+            return {"title": entry["title"] or entry["query"], "state": "playing" if playing else "paused",
+                    "position": max(0.0, position), "length": max(0.0, length), "local": bool(entry.get("file")),
+                    "upcoming": len(self._queue) - self._index - 1}
+
     def is_active(self) -> bool:
-        return bool(self._active and self._player)
+        """Whether a track is loaded and neither stopped, finished nor failed."""
+        with self._lock:
+            if not (self._active and self._player):
+                return False
+            vlc = _optional_import('vlc')
+            try:
+                return self._player.get_state() not in (vlc.State.Ended, vlc.State.Error, vlc.State.Stopped)
+            except Exception:
+                return True
 
 
 def _play_online_background(song_query: str) -> bool:
-    player = _OnlineAudioPlayer.instance()
+    player = _AudioPlayer.instance()
     return player.play_query(song_query or "music")
 
 
-def pause_online() -> bool:
-    return _OnlineAudioPlayer.instance().pause()
+def _queue_online(song_query: str) -> bool:
+    return _AudioPlayer.instance().enqueue(song_query)
+
+
+def _play_online_radio(query: str) -> bool:
+    return _AudioPlayer.instance().play_radio(query)
+
 
+def pause_playback() -> bool:
+    return _AudioPlayer.instance().pause()
 
-def resume_online() -> bool:
-    return _OnlineAudioPlayer.instance().resume()
 
+def resume_playback() -> bool:
+    return _AudioPlayer.instance().resume()
 
-def stop_online() -> bool:
-    return _OnlineAudioPlayer.instance().stop()
 
+def stop_playback() -> bool:
+    return _AudioPlayer.instance().stop()
 
-def next_online() -> bool:
-    return _OnlineAudioPlayer.instance().next()
+
+def next_track() -> bool:
+    return _AudioPlayer.instance().next()
 
 
 def _open_in_chrome(url: str) -> None:
@@ -904,156 +3294,370 @@ def _open_discord() -> bool:
     return False
 
 
-def _find_app_executable(app_name: str) -> str | None:
-    """Find an application executable by a friendly name.
-
-    Search order:
-    - Known aliases mapping
-    - PATH (shutil.which)
-    - Registry App Paths (HKCU/HKLM)
-    - Start Menu shortcuts (*.lnk) under ProgramData and AppData
-    - Common install directories under Program Files / LocalAppData
-    """
-    try:
-        name = (app_name or "").strip().lower().strip('"')
-        if not name:
-            return None
-
-        # Known aliases
-        known: dict[str, list[str]] = {
-            "discord": ["Discord.exe", "Discord"],
-            "visual studio code": ["Code.exe", "code"],
-            "vscode": ["Code.exe", "code"],
-            "code": ["Code.exe", "code"],
-            "chrome": ["chrome.exe"],
-            "google chrome": ["chrome.exe"],
-            "edge": ["msedge.exe"],
-            "microsoft edge": ["msedge.exe"],
-            "firefox": ["firefox.exe"],
-            "spotify": ["Spotify.exe"],
-            "steam": ["Steam.exe"],
-            "whatsapp": ["WhatsApp.exe"],
-            "notepad++": ["notepad++.exe"],
-            "postman": ["Postman.exe"],
-            "pycharm": ["pycharm64.exe", "pycharm.exe"],
-            "android studio": ["studio64.exe", "studio.exe"],
-            "intellij": ["idea64.exe", "idea.exe"],
-            "git bash": ["git-bash.exe"],
-            "vlc": ["vlc.exe"],
-        }
-        candidates: list[str] = []
-        if name in known:
-            candidates.extend(known[name])
-        # Also try raw token
-        base_token = name.replace(" ", "")
-        candidates.extend([name, f"{name}.exe", base_token, f"{base_token}.exe"])  # heuristic
-
-        # PATH lookup
-        for c in candidates:
-            from shutil import which
-            p = which(c)
-            if p:
-                return p
-
-        # Registry App Paths
-        if winreg is not None:
-            subkey = r"SOFTWARE\Microsoft\Windows\CurrentVersion\App Paths"
-            for hive in (winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE):
-                try:
-                    with winreg.OpenKey(hive, subkey) as root:
-                        i = 0
-                        while True:
-                            try:
-                                kname = winreg.EnumKey(root, i)
-                            except OSError:
-                                break
-                            i += 1
-                            lower = kname.lower()
-                            if any(tok in lower for tok in (name, base_token)):
-                                try:
-                                    with winreg.OpenKey(root, kname) as k:
-                                        val, _ = winreg.QueryValueEx(k, None)
-                                        if val and os.path.isfile(val):
-                                            return val
-                                except Exception:
-                                    pass
-                except Exception:
-                    pass
-
-        # Start Menu shortcuts
-        start_roots = [
+_APP_ALIASES: dict[str, list[str]] = {
+    "discord": ["Discord.exe", "Discord"],
+    "visual studio code": ["Code.exe", "code"],
+    "vscode": ["Code.exe", "code"],
+    "code": ["Code.exe", "code"],
+    "chrome": ["chrome.exe"],
+    "google chrome": ["chrome.exe"],
+    "edge": ["msedge.exe"],
+    "microsoft edge": ["msedge.exe"],
+    "firefox": ["firefox.exe"],
+    "spotify": ["Spotify.exe"],
+    "steam": ["Steam.exe"],
+    "whatsapp": ["WhatsApp.exe"],
+    "notepad++": ["notepad++.exe"],
+    "postman": ["Postman.exe"],
+    "pycharm": ["pycharm64.exe", "pycharm.exe"],
+    "android studio": ["studio64.exe", "studio.exe"],
+    "intellij": ["idea64.exe", "idea.exe"],
+    "git bash": ["git-bash.exe"],
+    "vlc": ["vlc.exe"],
+}
+
+
+def _app_key(name: str) -> str:
+    """Normalize an app or file name for matching: 'Visual Studio Code.lnk' -> 'visualstudiocode'."""
+    base = (name or "").strip().strip('"').lower()
+    for ext in (".exe", ".lnk"):
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+    return re.sub(r"[^a-z0-9+]", "", base)
+
+
+# Scratch folders under the install roots (mostly LOCALAPPDATA): rewritten all
+# the time and never hold apps, so they are neither scanned nor stamped
+_VOLATILE_APP_DIRS = frozenset({
+    "temp", "tmp", "cache", "caches", "crashdumps", "crashreports", "d3dscache", "packages", "logs",
+    "connecteddevicesplatform", "inetcache", "history",
+})
+
+
+def _default_app_sources() -> list[tuple[str, list[str]]]:
+    """(source kind, directories) in the order _find_app_executable has always preferred."""
+    return [
+        ("path", [p for p in os.environ.get('PATH', '').split(os.pathsep) if p]),
+        ("start_menu", [
             os.path.join(os.environ.get('PROGRAMDATA', ''), 'Microsoft', 'Windows', 'Start Menu', 'Programs'),
             os.path.join(os.environ.get('APPDATA', ''), 'Microsoft', 'Windows', 'Start Menu', 'Programs'),
-        ]
-        for root in start_roots:
-            try:
-                for base, _dirs, files in os.walk(root):
-                    for f in files:
-                        if not f.lower().endswith('.lnk'):
-                            continue
-                        lower = f.lower()
-                        if name in lower or base_token in lower:
-                            return os.path.join(base, f)
-            except Exception:
-                pass
-
-        # Common install dirs
-        common_dirs = [
+        ]),
+        ("install", [p for p in (
             os.environ.get('ProgramFiles', ''),
             os.environ.get('ProgramFiles(x86)', ''),
             os.environ.get('LOCALAPPDATA', ''),
-        ]
-        for root in common_dirs:
+        ) if p]),
+    ]
+
+
+class AppCatalog:
+    """Persisted catalog of launchable applications.
+
+    Built once by scanning PATH, the App Paths registry keys, Start Menu
+    shortcuts and the common install folders, then saved as JSON. The mtimes
+    of every source folder and its direct subfolders (less the scratch ones
+    in _VOLATILE_APP_DIRS) are saved with it; when one changes (an app was
+    installed or removed) the catalog is rebuilt in the background while
+    the old one keeps answering. Only the very first build, with no saved
+    catalog, makes resolves wait, and for at most COLD_WAIT seconds.
+    """
+
+    VERSION = 1
+    MAX_AGE = 24 * 3600
+    REVALIDATE_INTERVAL = 30.0
+    COLD_WAIT = 10.0
+
+    def __init__(self, cache_path: str, sources=None, aliases=None, use_registry: bool = True):
+        self._cache_path = cache_path
+        self._sources = sources
+        self._aliases = _APP_ALIASES if aliases is None else aliases
+        self._use_registry = use_registry
+        self._lock = threading.RLock()
+        self._by_key: dict[str, list[tuple[int, str]]] | None = None
+        self._trigrams: dict[str, list[str]] = {}
+        self._stamps: dict[str, float] = {}
+        self._built_at = 0.0
+        self._last_check = 0.0
+        self._building = False
+        self._loading = False
+        self._loaded = threading.Event()
+
+    def _source_list(self):
+        return self._sources if self._sources is not None else _default_app_sources()
+
+    def _stamp_sources(self) -> dict[str, float]:
+        """mtimes that change when an app is installed or removed.
+
+        PATH folders only hold executables directly, so their subfolders
+        (System32 is full of busy ones) are not stamped.
+        """
+        stamps = {}
+        for kind, dirs in self._source_list():
+            stamps.update(self._stamp_dirs([d for d in dirs if d and os.path.isdir(d)], children=kind != "path"))
+        return stamps
+
+    @staticmethod
+    def _stamp_dirs(dirs, children: bool = True) -> dict[str, float]:
+        stamps = {}
+        for d in dirs:
             try:
-                if not root or not os.path.isdir(root):
+                stamps[d] = os.stat(d).st_mtime
+                if not children:
                     continue
-                for base, _dirs, files in os.walk(root):
-                    for f in files:
-                        if f.lower().endswith('.exe'):
-                            lower = f.lower()
-                            if name in lower or base_token in lower:
-                                return os.path.join(base, f)
+                with os.scandir(d) as it:
+                    for e in it:
+                        if e.is_dir(follow_symlinks=False) and e.name.lower() not in _VOLATILE_APP_DIRS:
+                            stamps[e.path] = e.stat(follow_symlinks=False).st_mtime
+            except OSError:
+                continue
+        return stamps
+
+    def _scan(self):
+        entries: list[tuple[str, str, int]] = []  # (key, path, rank)
+        stamps = self._stamp_sources()
+        rank = 0
+        pathext = {e.lower() for e in os.environ.get('PATHEXT', '.EXE').split(';') if e} if os.name == 'nt' else set()
+        for kind, dirs in self._source_list():
+            dirs = [d for d in dirs if d and os.path.isdir(d)]
+            if kind == "path":
+                for d in dirs:
+                    try:
+                        with os.scandir(d) as it:
+                            for e in it:
+                                try:
+                                    if not e.is_file():
+                                        continue
+                                except OSError:
+                                    continue
+                                ext = os.path.splitext(e.name)[1].lower()
+                                if (ext in pathext) if os.name == 'nt' else os.access(e.path, os.X_OK):
+                                    entries.append((_app_key(e.name), e.path, rank))
+                    except OSError:
+                        continue
+            else:
+                suffix = '.lnk' if kind == "start_menu" else '.exe'
+                for d in dirs:
+                    for base, subdirs, files in os.walk(d):
+                        subdirs[:] = [sub for sub in subdirs if sub.lower() not in _VOLATILE_APP_DIRS]
+                        for f in files:
+                            if f.lower().endswith(suffix):
+                                entries.append((_app_key(f), os.path.join(base, f), rank))
+            rank += 1
+            if kind == "path" and self._use_registry and winreg is not None:
+                entries.extend((k, p, rank) for k, p in self._scan_registry())
+                rank += 1
+        return entries, stamps
+
+    @staticmethod
+    def _scan_registry():
+        found = []
+        subkey = r"SOFTWARE\Microsoft\Windows\CurrentVersion\App Paths"
+        for hive in (winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE):
+            try:
+                with winreg.OpenKey(hive, subkey) as root:
+                    i = 0
+                    while True:
+                        try:
+                            kname = winreg.EnumKey(root, i)
+                        except OSError:
+                            break
+                        i += 1
+                        try:
+                            with winreg.OpenKey(root, kname) as k:
+                                val, _ = winreg.QueryValueEx(k, None)
+                                val = (val or "").strip('"')
+                                if val and os.path.isfile(val):
+                                    found.append((_app_key(kname), val))
+                        except Exception:
+                            pass
             except Exception:
                 pass
-    except Exception:
-        pass
-    return None
+        return found
+
+    def _install(self, entries, stamps, built_at) -> None:
+        by_key: dict[str, list[tuple[int, str]]] = {}
+        for key, path, rank in entries:
+            if key:
+                by_key.setdefault(key, []).append((rank, path))
+        for hits in by_key.values():
+            hits.sort()
+        trigrams: dict[str, list[str]] = {}
+        for key in by_key:
+            for gram in {key[i:i + 3] for i in range(max(1, len(key) - 2))}:
+                trigrams.setdefault(gram, []).append(key)
+        with self._lock:
+            self._by_key = by_key
+            self._trigrams = trigrams
+            self._stamps = stamps
+            self._built_at = built_at
+        self._loaded.set()
 
+    def _load(self) -> bool:
+        try:
+            with open(self._cache_path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+            if data.get("version") != self.VERSION:
+                return False
+            self._install([tuple(e) for e in data.get("entries", [])], data.get("stamps", {}), data.get("built_at", 0.0))
+            return True
+        except Exception:
+            return False
 
-def _natural_ack(text: str) -> None:
-    _speak_and_log(text)
+    def rebuild(self) -> None:
+        """Rescan every source and persist the result."""
+        entries, stamps = self._scan()
+        built_at = time.time()
+        self._install(entries, stamps, built_at)
+        try:
+            tmp = self._cache_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump({"version": self.VERSION, "built_at": built_at, "stamps": stamps,
+                           "entries": entries}, fh)
+            os.replace(tmp, self._cache_path)
+        except Exception:
+            pass
 
+    def is_stale(self) -> bool:
+        with self._lock:
+            stamps, built_at = dict(self._stamps), self._built_at
+        if time.time() - built_at > self.MAX_AGE:
+            return True
+        return self._stamp_sources() != stamps
 
-def _empathetic_response(query: str) -> str | None:
-    """Return a kind, supportive response if the query sounds personal/sad."""
-    q = (query or "").lower()
-    triggers_any = (
-        "how are you" in q or
-        "bad day" in q or
-        "sad" in q or
-        "upset" in q or
-        "lonely" in q or
-        "stressed" in q or
-        "anxious" in q or
-        "depressed" in q or
-        "not okay" in q or
-        "feeling down" in q or
-        "i feel bad" in q or
-        "i'm tired" in q or
-        "i am tired" in q or
-        "burned out" in q or
-        "heartbroken" in q or
-        "i'm angry" in q or
-        "i am angry" in q
-    )
-    if not triggers_any:
-        return None
-    options = [
-        "I'm here with you. I'm sorry it's been rough—want to tell me more about it?",
-        "That sounds heavy. You don't have to carry it alone; I'm listening if you want to share.",
-        "It's okay to feel this way. Take a deep breath. Would a small break or a glass of water help?",
-        "I'm on your side. One step at a time—we'll get through this together.",
-        "Thanks for being honest with me. You matter more than you know. How can I support you right now?",
+    def _revalidate(self) -> None:
+        try:
+            if self.is_stale():
+                self.rebuild()
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._building = False
+
+    def warm(self) -> None:
+        """Load or build the catalog in the background, then revalidate it."""
+        threading.Thread(target=lambda: (self._ensure_loaded(), self._maybe_revalidate(force=True)), daemon=True).start()
+
+    def _ensure_loaded(self) -> bool:
+        """Load the saved catalog or build the first one; False if that is still running after COLD_WAIT."""
+        if self._loaded.is_set():
+            return True
+        with self._lock:
+            first, self._loading = not self._loading, True
+        if not first:
+            # Another thread is scanning; nothing to answer from until it is done
+            return self._loaded.wait(self.COLD_WAIT)
+        try:
+            if not self._load():
+                self.rebuild()
+        finally:
+            self._loaded.set()
+        return True
+
+    def _maybe_revalidate(self, force: bool = False) -> None:
+        with self._lock:
+            now = time.time()
+            if self._building or (not force and now - self._last_check < self.REVALIDATE_INTERVAL):
+                return
+            self._last_check = now
+            self._building = True
+        threading.Thread(target=self._revalidate, daemon=True).start()
+
+    def resolve(self, app_name: str) -> str | None:
+        """Return the best executable or shortcut for a spoken app name, or None."""
+        name = (app_name or "").strip().lower().strip('"')
+        q = _app_key(name)
+        if not q:
+            return None
+        if not self._ensure_loaded():
+            return shutil.which(name)
+        self._maybe_revalidate()
+        with self._lock:
+            by_key = self._by_key or {}
+            trigrams = self._trigrams
+
+        def _best(keys):
+            hits = [(rank, len(key), path) for key in keys for rank, path in by_key.get(key, ())]
+            return min(hits)[2] if hits else None
+
+        # Aliases and exact names first
+        exact = [_app_key(a) for a in self._aliases.get(name, [])] + [q]
+        found = _best(exact)
+        if found:
+            return found
+        keys = list(by_key)
+        found = _best([k for k in keys if k.startswith(q)]) or _best([k for k in keys if q in k])
+        if found:
+            return found
+        # Fuzzy fallback for misheard names ("spotfy", "postmen"): shortlist
+        # keys sharing the most trigrams, then score only those
+        shared: dict[str, int] = {}
+        for gram in {q[i:i + 3] for i in range(max(1, len(q) - 2))}:
+            for key in trigrams.get(gram, ()):
+                shared[key] = shared.get(key, 0) + 1
+        near = sorted(shared, key=shared.get, reverse=True)[:25]
+        return _best(difflib.get_close_matches(q, near, n=3, cutoff=0.75))
+
+
+app_catalog = AppCatalog(_data_path("app_catalog.json"))
+
+
+def _find_app_executable(app_name: str) -> str | None:
+    """Find an application executable by a friendly name.
+
+    Answers from the cached AppCatalog, which covers (in preference order):
+    - Known aliases mapping
+    - PATH
+    - Registry App Paths (HKCU/HKLM)
+    - Start Menu shortcuts (*.lnk) under ProgramData and AppData
+    - Common install directories under Program Files / LocalAppData
+    """
+    try:
+        return app_catalog.resolve(app_name)
+    except Exception:
+        return None
+
+
+def _natural_ack(text: str) -> None:
+    # Acknowledgements barge in over anything still being said
+    speak(text, priority=SPEECH_PRIORITY_HIGH, interrupt=True)
+    try:
+        if UI.instance is not None:
+            UI.instance.log_assistant(text)
+    except Exception:
+        pass
+
+
+def _empathetic_response(query: str) -> str | None:
+    """Return a kind, supportive response if the query sounds personal/sad."""
+    q = (query or "").lower()
+    triggers_any = (
+        "how are you" in q or
+        "bad day" in q or
+        "sad" in q or
+        "upset" in q or
+        "lonely" in q or
+        "stressed" in q or
+        "anxious" in q or
+        "depressed" in q or
+        "not okay" in q or
+        "feeling down" in q or
+        "i feel bad" in q or
+        "i'm tired" in q or
+        "i am tired" in q or
+        "burned out" in q or
+        "heartbroken" in q or
+        "i'm angry" in q or
+        "i am angry" in q
+    )
+    if not triggers_any:
+        return None
+    options = [
+        "I'm here with you. I'm sorry it's been rough—want to tell me more about it?",
+        "That sounds heavy. You don't have to carry it alone; I'm listening if you want to share.",
+        "It's okay to feel this way. Take a deep breath. Would a small break or a glass of water help?",
+        "I'm on your side. One step at a time—we'll get through this together.",
+        "Thanks for being honest with me. You matter more than you know. How can I support you right now?",
         "I believe in you. Even tough days end. Want me to put on calming music or open a journal?",
         "Sending you a little encouragement: you’ve done hard things before, and you can again.",
     ]
@@ -1179,15 +3783,292 @@ def _set_current_dir(path: str) -> bool:
     global CURRENT_DIR
     try:
         abs_path = os.path.abspath(path)
-        if os.path.isdir(abs_path):
-            CURRENT_DIR = abs_path
-            return True
+        with _STATE_LOCK:
+            if os.path.isdir(abs_path):
+                CURRENT_DIR = abs_path
+                return True
         return False
     except Exception:
         return False
 
 
+# ----- Filesystem index -----
+_INDEX_SKIP_DIRS = {"appdata", "node_modules", "__pycache__", "site-packages", "$recycle.bin", "venv"}
+
+
+def _index_skips(dirname: str) -> bool:
+    lower = dirname.lower()
+    return lower.startswith('.') or lower in _INDEX_SKIP_DIRS
+
+
+def _name_grams(name: str) -> set[str]:
+    return {name[i:i + 3] for i in range(len(name) - 2)}
+
+
+class FileIndex:
+    """Persistent file and folder name index backed by SQLite.
+
+    A background thread walks the indexed roots and records every entry's
+    lowercased name. Each directory's mtime is stored too, so later passes
+    only re-list directories whose contents changed; unchanged directories
+    are traversed from the index itself. Lookups rank exact, then prefix,
+    then substring matches instead of returning the first ``os.walk`` hit.
+    Substring candidates come from a trigram side table (``grams``, keyed
+    by the entry's rowid) rather than a scan of every name; FTS5's trigram
+    tokenizer would do the same but is missing from older bundled SQLite.
+    Queries under three characters have no trigram and still scan.
+    """
+
+    LOOKUP_GRAMS = 4
+
+    REFRESH_INTERVAL = 120.0
+    COMMIT_INTERVAL = 0.5
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            path TEXT PRIMARY KEY,
+            parent TEXT NOT NULL,
+            name TEXT NOT NULL,
+            is_dir INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_name ON entries(name, is_dir);
+        CREATE INDEX IF NOT EXISTS entries_parent ON entries(parent);
+        CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS roots (path TEXT PRIMARY KEY, complete INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE IF NOT EXISTS grams (gram TEXT NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (gram, id))
+            WITHOUT ROWID;
+    """
+
+    def __init__(self, db_path: str):
+        self._db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = None
+        self._complete: set[str] = set()
+        self._pending: list[str] = []
+        self._wake = threading.Event()
+        self._thread = None
+        self._committed_at = 0.0
+
+    def _commit_soon(self) -> None:
+        # Lookups share this connection and see uncommitted rows, so a walk only
+        # needs to commit now and then rather than once per directory
+        now = time.monotonic()
+        if now - self._committed_at >= self.COMMIT_INTERVAL:
+            self._db().commit()
+            self._committed_at = now
+
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self._db_path, check_same_thread=False)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                # A rebuildable cache: losing the last commits on power loss is fine, an fsync per directory is not
+                conn.execute("PRAGMA synchronous=NORMAL")
+            except Exception:
+                pass
+            had_grams = conn.execute("SELECT 1 FROM sqlite_master WHERE name='grams'").fetchone() is not None
+            conn.executescript(self._SCHEMA)
+            if not had_grams:
+                # Index built before the trigram table existed
+                conn.executemany("INSERT OR IGNORE INTO grams(gram, id) VALUES (?, ?)",
+                                 ((g, rowid) for rowid, name in conn.execute("SELECT rowid, name FROM entries").fetchall()
+                                  for g in _name_grams(name)))
+                conn.commit()
+            self._complete = {r[0] for r in conn.execute("SELECT path FROM roots WHERE complete=1")}
+            self._conn = conn
+        return self._conn
+
+    def start(self, roots) -> None:
+        """Index ``roots`` in the background and keep them fresh."""
+        roots = [os.path.abspath(r) for r in roots if r and os.path.isdir(r)]
+        for r in roots:
+            # Folders nested in another root are indexed as part of it
+            if not any(r.startswith(o.rstrip(os.sep) + os.sep) for o in roots):
+                self.add_root(r)
+
+    def add_root(self, root: str) -> None:
+        if not root or not os.path.isdir(root):
+            return
+        root = os.path.abspath(root)
+        with self._lock:
+            db = self._db()
+            db.execute("INSERT OR IGNORE INTO roots(path, complete) VALUES (?, 0)", (root,))
+            db.commit()
+            if root not in self._pending:
+                self._pending.append(root)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def covers(self, path: str) -> bool:
+        """True when ``path`` lies inside a fully indexed root and is not skipped."""
+        try:
+            path = os.path.abspath(path)
+            with self._lock:
+                self._db()
+                complete = list(self._complete)
+            for root in complete:
+                if path == root:
+                    return True
+                if path.startswith(root.rstrip(os.sep) + os.sep):
+                    rel = os.path.relpath(path, root)
+                    if not any(_index_skips(part) for part in rel.split(os.sep)):
+                        return True
+        except Exception:
+            pass
+        return False
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                roots = list(self._pending)
+                roots += [r for r in self._complete if r not in roots]
+                self._pending.clear()
+            for root in roots:
+                try:
+                    self.refresh(root)
+                except Exception:
+                    pass
+            self._wake.wait(self.REFRESH_INTERVAL)
+            self._wake.clear()
+
+    def refresh(self, root: str) -> None:
+        """Bring the index for ``root`` up to date, re-listing only changed directories."""
+        root = os.path.abspath(root)
+        stack = [root]
+        while stack:
+            stack.extend(self._refresh_dir(stack.pop()))
+        with self._lock:
+            db = self._db()
+            db.execute("INSERT OR REPLACE INTO roots(path, complete) VALUES (?, 1)", (root,))
+            db.commit()
+            self._complete.add(root)
+
+    def _refresh_dir(self, path: str) -> list[str]:
+        """Re-list ``path`` if its mtime changed; return its subdirectories to descend into."""
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            with self._lock:
+                self._drop_tree(path)
+                self._db().commit()
+            return []
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT mtime FROM dirs WHERE path=?", (path,)).fetchone()
+            if row is not None and row[0] == mtime:
+                subdirs = [r[0] for r in db.execute("SELECT path FROM entries WHERE parent=? AND is_dir=1", (path,))]
+                return [d for d in subdirs if not _index_skips(os.path.basename(d))]
+        rows = []
+        try:
+            with os.scandir(path) as it:
+                for e in it:
+                    try:
+                        is_dir = e.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    rows.append((e.path, path, e.name.lower(), int(is_dir)))
+        except OSError:
+            return []
+        new_dirs = {p for p, _parent, _name, is_dir in rows if is_dir}
+        with self._lock:
+            db = self._db()
+            old_dirs = {r[0] for r in db.execute("SELECT path FROM entries WHERE parent=? AND is_dir=1", (path,))}
+            for gone in old_dirs - new_dirs:
+                self._drop_tree(gone)
+            self._drop_grams("parent=?", (path,))
+            db.execute("DELETE FROM entries WHERE parent=?", (path,))
+            db.executemany("INSERT OR REPLACE INTO entries(path, parent, name, is_dir) VALUES (?, ?, ?, ?)", rows)
+            db.executemany("INSERT OR IGNORE INTO grams(gram, id) VALUES (?, ?)",
+                           ((g, rowid) for rowid, name in
+                            db.execute("SELECT rowid, name FROM entries WHERE parent=?", (path,)).fetchall()
+                            for g in _name_grams(name)))
+            db.execute("INSERT OR REPLACE INTO dirs(path, mtime) VALUES (?, ?)", (path, mtime))
+            self._commit_soon()
+        return [d for d in new_dirs if not _index_skips(os.path.basename(d))]
+
+    def _drop_tree(self, path: str) -> None:
+        db = self._db()
+        prefix = path.rstrip(os.sep) + os.sep
+        self._drop_grams("path=? OR substr(path, 1, ?)=?", (path, len(prefix), prefix))
+        for table in ("entries", "dirs"):
+            db.execute(f"DELETE FROM {table} WHERE path=? OR substr(path, 1, ?)=?", (path, len(prefix), prefix))
+
+    def _drop_grams(self, where: str, params) -> None:
+        """Delete the trigram rows of the entries matching ``where``, by primary key."""
+        db = self._db()
+        rows = db.execute(f"SELECT rowid, name FROM entries WHERE {where}", params).fetchall()
+        db.executemany("DELETE FROM grams WHERE gram=? AND id=?", ((g, rowid) for rowid, name in rows
+                                                                   for g in _name_grams(name)))
+
+    def lookup(self, name: str, want_file: bool = True, roots=None) -> str | None:
+        """Best match for ``name`` under ``roots`` (earlier roots preferred), or None."""
+        q = (name or "").strip().lower()
+        if not q:
+            return None
+        roots = [os.path.abspath(r) for r in (roots or []) if r]
+        # Pick up entries created moments ago directly inside the searched roots
+        for r in roots:
+            if self.covers(r):
+                self._refresh_dir(r)
+        is_dir = 0 if want_file else 1
+        with self._lock:
+            db = self._db()
+            rows = db.execute("SELECT path, name FROM entries WHERE is_dir=? AND name>=? AND name<?",
+                              (is_dir, q, q + "\U0010ffff")).fetchall()
+        in_roots = lambda path: not roots or any(path.startswith(r.rstrip(os.sep) + os.sep) for r in roots)
+        grams = sorted(_name_grams(q))
+        # An exact or prefix hit always outranks a substring one
+        if not any(in_roots(path) for path, _name in rows):
+            if grams:
+                # Entries holding a few of the query's trigrams, spread across it, then the exact substring test
+                step = max(1, len(grams) // self.LOOKUP_GRAMS)
+                picked = grams[::step][:self.LOOKUP_GRAMS]
+                sql = ("SELECT path, name FROM entries WHERE rowid IN ("
+                       + " INTERSECT ".join(["SELECT id FROM grams WHERE gram=?"] * len(picked))
+                       + ") AND is_dir=? AND instr(name, ?)>0")
+                args = picked + [is_dir, q]
+            else:
+                # One or two characters have no trigram: scan the names as before
+                sql = "SELECT path, name FROM entries WHERE is_dir=? AND instr(name, ?)>0"
+                args = [is_dir, q]
+            with self._lock:
+                rows += self._db().execute(sql, args).fetchall()
+        best = None
+        best_key = None
+        for path, entry_name in rows:
+            root_rank = len(roots)
+            for i, r in enumerate(roots):
+                if path.startswith(r.rstrip(os.sep) + os.sep):
+                    root_rank = i
+                    break
+            if roots and root_rank == len(roots):
+                continue
+            if entry_name == q:
+                kind = 0
+            elif entry_name.startswith(q):
+                kind = 1
+            else:
+                kind = 2
+            key = (kind, root_rank, path.count(os.sep), len(path))
+            if best_key is None or key < best_key:
+                best, best_key = path, key
+        return best
+
+
+file_index = FileIndex(_data_path("file_index.sqlite3"))
+
+
 def _find_first(root: str, name: str, want_file: bool = True):
+    with tracer.span("file_search"):
+        return _find_first_untraced(root, name, want_file)
+
+
+def _find_first_untraced(root: str, name: str, want_file: bool):
+    if file_index.covers(root):
+        return file_index.lookup(name, want_file=want_file, roots=[root])
+    # Outside the indexed roots (usually a folder the user moved into): walk it
+    # this once instead of growing the index with every directory visited
     name_lower = name.lower()
     for base, dirs, files in os.walk(root):
         if want_file:
@@ -1201,22 +4082,26 @@ def _find_first(root: str, name: str, want_file: bool = True):
     return None
 
 
+def _user_common_roots() -> list[str]:
+    home = os.path.expanduser("~")
+    return [
+        CURRENT_DIR,
+        home,
+        os.path.join(home, "Desktop"),
+        os.path.join(home, "Documents"),
+        os.path.join(home, "Downloads"),
+        os.path.join(home, "Pictures"),
+        os.path.join(home, "Music"),
+        os.path.join(home, "Videos"),
+    ]
+
+
 def _search_user_common_roots(name: str, want_file: bool = True):
     try:
-        home = os.path.expanduser("~")
-        roots = [
-            CURRENT_DIR,
-            home,
-            os.path.join(home, "Desktop"),
-            os.path.join(home, "Documents"),
-            os.path.join(home, "Downloads"),
-            os.path.join(home, "Pictures"),
-            os.path.join(home, "Music"),
-            os.path.join(home, "Videos"),
-        ]
+        roots = [r for r in _user_common_roots() if r and os.path.isdir(r)]
+        if roots and all(file_index.covers(r) for r in roots):
+            return file_index.lookup(name, want_file=want_file, roots=roots)
         for r in roots:
-            if not r or not os.path.isdir(r):
-                continue
             found = _find_first(r, name, want_file=want_file)
             if found:
                 return found
@@ -1225,6 +4110,293 @@ def _search_user_common_roots(name: str, want_file: bool = True):
     return None
 
 
+# ----- Music library -----
+_MUSIC_FIELDS = ("title", "artist", "file", "album")
+_MUSIC_FIELD_WEIGHTS = (1.0, 0.9, 0.85, 0.6)
+_MUSIC_STOPWORDS = {"the", "a", "an", "by", "song", "track", "music", "from", "of"}
+_TRACK_NUMBER_RE = re.compile(r"^\s*(?:\d{1,3}|[a-d]\d{1,2})\s*(?:[-._)]\s*|\s+)")
+
+
+def _music_roots() -> list[str]:
+    home = os.path.expanduser("~")
+    extra = [p for p in os.environ.get('JARVIS_MUSIC_DIRS', '').split(os.pathsep) if p]
+    return extra + [os.path.join(home, "Music"), os.path.join(home, "Downloads"), os.path.join(home, "Desktop")]
+
+
+def _read_audio_tags(path: str) -> tuple[str, str, str, float]:
+    """(title, artist, album, duration) from ID3/Vorbis/MP4 tags, else guessed from "Artist - Title" file names."""
+    title = artist = album = ""
+    duration = 0.0
+    mutagen = _optional_import('mutagen')
+    if mutagen is not None:
+        try:
+            audio = mutagen.File(path, easy=True)
+            if audio is not None:
+                tags = audio.tags or {}
+                first = lambda key: str((tags.get(key) or [""])[0]).strip()
+                title, artist, album = first('title'), first('artist'), first('album')
+                duration = float(getattr(audio.info, 'length', 0.0) or 0.0)
+        except Exception:
+            pass
+    if not duration and path.lower().endswith(".wav"):
+        try:
+            with wave.open(path, "rb") as wf:
+                duration = wf.getnframes() / float(wf.getframerate() or 1)
+        except Exception:
+            pass
+    if not title:
+        stem = _TRACK_NUMBER_RE.sub("", os.path.splitext(os.path.basename(path))[0]).replace("_", " ")
+        guess_artist, sep, guess_title = stem.partition(" - ")
+        title = (guess_title if sep else stem).strip()
+        artist = artist or (guess_artist.strip() if sep else "")
+    return title, artist, album, duration
+
+
+class MusicLibrary:
+    """Persistent index of local audio files and their tags, backed by SQLite.
+
+    A background thread scans the music roots every REFRESH_INTERVAL. A
+    file's tags (title, artist, album, duration) are read - with mutagen when
+    it is installed, from "Artist - Title" file names otherwise - only when
+    its mtime or size changed, so rescanning an unchanged library only lists
+    directories.
+
+    Lookups use an in-memory word index built from the table: each query word
+    matches whole words of a track's title, artist, file name or album, word
+    prefixes, or - through a trigram shortlist - misheard words. Tracks are
+    ranked by how much of the query they cover, title and artist weighing
+    more than album.
+    """
+
+    REFRESH_INTERVAL = 300.0
+    MIN_SCORE = 0.5
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tracks (
+            path TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            album TEXT NOT NULL,
+            duration REAL NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: str, roots=None):
+        self._db_path = db_path
+        self._roots = roots
+        self._lock = threading.RLock()
+        self._conn = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._ready = threading.Event()
+        self._tracks: list[tuple[str, str, str, str, float]] = []  # (path, title, artist, album, duration)
+        self._by_path: dict[str, int] = {}
+        self._postings: dict[str, array.array] = {}  # word -> track * 4 + field
+        self._words: list[str] = []
+        self._trigrams: dict[str, list[str]] = {}
+
+    def _db(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self._db_path, check_same_thread=False)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+            except Exception:
+                pass
+            conn.executescript(self._SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def roots(self) -> list[str]:
+        roots = self._roots if self._roots is not None else _music_roots()
+        roots = [os.path.abspath(r) for r in roots if r and os.path.isdir(r)]
+        # Folders nested in another root are scanned as part of it
+        return [r for r in roots if not any(r.startswith(o.rstrip(os.sep) + os.sep) for o in roots)]
+
+    def start(self) -> None:
+        """Load the saved index and keep it fresh in the background."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            self._load()
+        except Exception:
+            pass
+        while True:
+            try:
+                self.scan()
+            except Exception:
+                pass
+            self._ready.set()
+            self._wake.wait(self.REFRESH_INTERVAL)
+            self._wake.clear()
+
+    def rescan(self) -> None:
+        self.start()
+        self._wake.set()
+
+    def ready(self) -> bool:
+        """True once the index has been loaded or scanned at least once."""
+        return self._ready.is_set()
+
+    def _load(self) -> None:
+        with self._lock:
+            rows = self._db().execute("SELECT path, title, artist, album, duration FROM tracks").fetchall()
+        if rows:
+            self._install(rows)
+            self._ready.set()
+
+    def scan(self) -> int:
+        """Index new and changed files under the roots and drop removed ones; returns how many changed."""
+        with self._lock:
+            known = {p: (m, s) for p, m, s in self._db().execute("SELECT path, mtime, size FROM tracks")}
+        seen: set[str] = set()
+        changed = []
+        stack = self.roots()
+        while stack:
+            folder = stack.pop()
+            try:
+                with os.scandir(folder) as it:
+                    for e in it:
+                        try:
+                            if e.is_dir(follow_symlinks=False):
+                                if not _index_skips(e.name):
+                                    stack.append(e.path)
+                                continue
+                            if not _is_audio_file(e.name):
+                                continue
+                            st = e.stat()
+                        except OSError:
+                            continue
+                        seen.add(e.path)
+                        if known.get(e.path) != (st.st_mtime, st.st_size):
+                            changed.append((e.path, st.st_mtime, st.st_size))
+            except OSError:
+                continue
+        removed = [p for p in known if p not in seen]
+        if not changed and not removed:
+            if not self._tracks and known:
+                self._load()
+            return 0
+        rows = [(path, mtime, size) + _read_audio_tags(path) for path, mtime, size in changed]
+        with self._lock:
+            db = self._db()
+            db.executemany("DELETE FROM tracks WHERE path=?", [(p,) for p in removed])
+            db.executemany("INSERT OR REPLACE INTO tracks(path, mtime, size, title, artist, album, duration) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            db.commit()
+        self._load()
+        return len(changed) + len(removed)
+
+    def _install(self, rows) -> None:
+        postings: dict[str, array.array] = {}
+        tracks = []
+        for idx, (path, title, artist, album, duration) in enumerate(rows):
+            tracks.append((path, title, artist, album, duration))
+            stem = os.path.splitext(os.path.basename(path))[0]
+            seen = set()
+            for field, text in enumerate((title, artist, stem, album)):
+                for word in set(_tokenize(text)) - seen:
+                    # A word counts once per track, for its best field
+                    seen.add(word)
+                    postings.setdefault(word, array.array('l')).append(idx * 4 + field)
+        trigrams: dict[str, list[str]] = {}
+        for word in postings:
+            for gram in {word[i:i + 3] for i in range(max(1, len(word) - 2))}:
+                trigrams.setdefault(gram, []).append(word)
+        with self._lock:
+            self._tracks = tracks
+            self._by_path = {track[0]: idx for idx, track in enumerate(tracks)}
+            self._postings = postings
+            self._words = sorted(postings)
+            self._trigrams = trigrams
+
+    @staticmethod
+    def _expand(word: str, postings, words: list[str], trigrams) -> list[tuple[str, float]]:
+        """Index words a query word may stand for, with a similarity in 0..1."""
+        if word in postings:
+            return [(word, 1.0)]
+        matches = []
+        if len(word) >= 3:
+            lo = bisect.bisect_left(words, word)
+            hi = bisect.bisect_left(words, word + "\U0010ffff")
+            matches += [(w, 0.9) for w in words[lo:min(hi, lo + 50)] if w != word]
+        if not matches and len(word) >= 4:
+            shared: dict[str, int] = {}
+            for gram in {word[i:i + 3] for i in range(len(word) - 2)}:
+                for w in trigrams.get(gram, ()):
+                    shared[w] = shared.get(w, 0) + 1
+            for w in sorted(shared, key=shared.get, reverse=True)[:25]:
+                ratio = difflib.SequenceMatcher(None, word, w).ratio()
+                if ratio >= 0.75:
+                    matches.append((w, ratio * 0.85))
+        return matches
+
+    def search(self, query: str, limit: int = 5) -> list[tuple[float, str]]:
+        """Best ``(score, path)`` matches for a spoken title and/or artist, best first."""
+        self.start()
+        q_words = [w for w in _tokenize(_normalize_spoken_path_tokens(query)) if w not in _MUSIC_STOPWORDS]
+        if not q_words:
+            return []
+        # One consistent snapshot: a rescan's _install swaps all of these together
+        with self._lock:
+            tracks, postings, words, trigrams = self._tracks, self._postings, self._words, self._trigrams
+        # per track: best match for each query word
+        best: dict[int, list[float]] = {}
+        for qi, word in enumerate(q_words):
+            for match, similarity in self._expand(word, postings, words, trigrams):
+                for code in postings.get(match, ()):
+                    track, field = divmod(code, 4)
+                    score = similarity * _MUSIC_FIELD_WEIGHTS[field]
+                    slots = best.get(track)
+                    if slots is None:
+                        slots = best[track] = [0.0] * len(q_words)
+                    if score > slots[qi]:
+                        slots[qi] = score
+        phrase = " ".join(q_words)
+        ranked = []
+        for track, slots in best.items():
+            score = sum(slots) / len(q_words)
+            if score < self.MIN_SCORE:
+                continue
+            path, title, artist, _album, _duration = tracks[track]
+            title_words = [w for w in _tokenize(title) if w not in _MUSIC_STOPWORDS]
+            if " ".join(title_words) == phrase:
+                score += 0.5
+            # Prefer tighter titles: "yesterday" over "yesterday once more"
+            score -= 0.01 * max(0, len(title_words) - len(q_words))
+            ranked.append((score, path))
+        ranked.sort(key=lambda r: (-r[0], len(r[1])))
+        return ranked[:limit]
+
+    def find(self, query: str) -> str | None:
+        hits = self.search(query, limit=1)
+        return hits[0][1] if hits else None
+
+    def random_track(self) -> str | None:
+        self.start()
+        with self._lock:
+            tracks = self._tracks
+        return random.choice(tracks)[0] if tracks else None
+
+    def describe(self, path: str) -> str:
+        """"Title by Artist" for a path in the index, else the file name."""
+        with self._lock:
+            idx = self._by_path.get(path)
+            track = self._tracks[idx] if idx is not None else None
+        if track is None:
+            return os.path.basename(path)
+        _path, title, artist, _album, _duration = track
+        return f"{title} by {artist}" if title and artist else (title or os.path.basename(path))
+
+
+music_library = MusicLibrary(_data_path("music_library.sqlite3"))
+
+
 def _run_command(cmd: list[str], cwd: str = None) -> bool:
     try:
         subprocess.Popen(cmd, cwd=cwd or CURRENT_DIR, shell=False)
@@ -1238,722 +4410,2343 @@ def _run_command(cmd: list[str], cwd: str = None) -> bool:
             return False
 
 
-def _run_shell_string(command_str: str, cwd: str | None = None) -> bool:
-    """Run an arbitrary shell command string in the given working directory.
+def _run_shell_string(command_str: str, cwd: str | None = None) -> bool:
+    """Run an arbitrary shell command string in the given working directory.
+
+    This uses `shell=True` to allow compound commands and builtins.
+    """
+    try:
+        if not command_str or not command_str.strip():
+            return False
+        subprocess.Popen(command_str, cwd=cwd or CURRENT_DIR, shell=True)
+        return True
+    except Exception:
+        return False
+
+
+def _resolve_name_to_path(name: str, want_file: bool) -> str | None:
+    """Resolve a spoken name to a file or folder path, searching CURRENT_DIR and user roots."""
+    name = _normalize_spoken_path_tokens(name)
+    # Try absolute or relative direct
+    for cand in (name, os.path.join(CURRENT_DIR, name)):
+        try:
+            if want_file and os.path.isfile(cand):
+                return os.path.abspath(cand)
+            if not want_file and os.path.isdir(cand):
+                return os.path.abspath(cand)
+        except Exception:
+            pass
+    # Search trees
+    found = _find_first(CURRENT_DIR, name, want_file=want_file) or _search_user_common_roots(name, want_file=want_file)
+    return found
+
+
+def _normalize_spoken_path_tokens(text: str) -> str:
+    """Convert spoken tokens like 'underscore' -> '_', 'slash' -> '\\', 'space' -> ' '."""
+    try:
+        t = " " + (text or "") + " "
+        # Replace common spoken separators
+        replacements = [
+            (" underscore ", "_"),
+            (" dash ", "-"),
+            (" hyphen ", "-"),
+            (" dot ", "."),
+            (" period ", "."),
+            (" space ", " "),
+            (" backslash ", "\\"),
+            (" slash ", "\\"),  # favor Windows path
+            (" forward slash ", "\\"),
+        ]
+        for k, v in replacements:
+            t = t.replace(k, v)
+        # Collapse extra spaces around separators
+        t = t.strip().strip('"').strip()
+        return t
+    except Exception:
+        return (text or "").strip().strip('"')
+
+
+_LLM_ENV_VARS = (
+    'LLM_PROVIDER',
+    'OPENROUTER_API_KEY', 'OPENROUTER_BASE_URL', 'OPENROUTER_MODEL',
+    'OPENAI_API_KEY', 'OPENAI_BASE_URL', 'OPENAI_MODEL',
+    'GOOGLE_API_KEY', 'GEMINI_MODEL',
+    'ANTHROPIC_API_KEY', 'ANTHROPIC_MODEL',
+    'JARVIS_LLM_PROVIDERS',
+)
+_LLM_HTTP_CLIENT = None
+_DEFAULT_SYSTEM_PROMPT = "You are a helpful desktop assistant."
+
+
+def _llm_http_client():
+    """Return the pooled keep-alive HTTP client shared by the SDK clients (None without httpx)."""
+    global _LLM_HTTP_CLIENT
+    httpx = _optional_import('httpx')
+    if _LLM_HTTP_CLIENT is None and httpx is not None:
+        try:
+            _LLM_HTTP_CLIENT = httpx.Client(
+                limits=httpx.Limits(max_connections=16, max_keepalive_connections=8, keepalive_expiry=120.0),
+                timeout=httpx.Timeout(60.0, connect=10.0),
+            )
+        except Exception:
+            _LLM_HTTP_CLIENT = None
+    return _LLM_HTTP_CLIENT
+
+
+def _http_client_kwargs() -> dict:
+    client = _llm_http_client()
+    return {"http_client": client} if client is not None else {}
+
+
+class _LLMProviderRegistry:
+    """Caches the configured providers and their SDK clients.
+
+    The clients are built once and reused, so HTTP keep-alive and TLS
+    sessions survive between questions. They are rebuilt only when one of
+    the LLM-related environment variables changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._selections: list[tuple] = []
+
+    def all(self) -> list[tuple]:
+        """Every usable ``(provider, client, model)``, preferred provider first."""
+        signature = tuple(os.environ.get(k) for k in _LLM_ENV_VARS)
+        with self._lock:
+            if signature != self._signature:
+                self._selections = _build_llm_providers()
+                self._signature = signature
+            return self._selections
+
+    def get(self):
+        selections = self.all()
+        return selections[0] if selections else (None, None, None)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._signature = None
+
+
+llm_providers = _LLMProviderRegistry()
+
+
+def _select_llm_provider():
+    """Return a tuple (provider, client_or_model_callable, model_name) based on env vars.
+    Provider is one of: 'openrouter', 'openai', 'gemini', 'anthropic', or None if unavailable.
+    """
+    return llm_providers.get()
+
+
+_LLM_PROVIDER_ALIASES = {
+    'openrouter': 'openrouter', 'open-router': 'openrouter', 'router': 'openrouter',
+    'openai': 'openai',
+    'gemini': 'gemini', 'google': 'gemini',
+    'anthropic': 'anthropic', 'claude': 'anthropic', 'xai': 'anthropic',
+}
+
+
+def _build_llm_providers() -> list[tuple]:
+    """Construct every provider usable for failover, preferred one first.
+
+    JARVIS_LLM_PROVIDERS lists the backups in order (e.g. "openai,anthropic");
+    by default every other provider with credentials is a backup.
+    """
+    preferred = (os.environ.get('LLM_PROVIDER') or DEFAULT_LLM_PROVIDER).lower().strip()
+    backups = os.environ.get('JARVIS_LLM_PROVIDERS')
+    names = [preferred] + ([n.strip().lower() for n in backups.split(',')] if backups is not None
+                           else ['openrouter', 'openai', 'gemini', 'anthropic'])
+    selections, seen = [], set()
+    for name in names:
+        canonical = _LLM_PROVIDER_ALIASES.get(name)
+        if canonical is None or canonical in seen:
+            continue
+        seen.add(canonical)
+        selection = _build_llm_provider(name)
+        if selection[0]:
+            selections.append(selection)
+    if len(selections) > 1:
+        # With a backup to fail over to, retrying the same endpoint inside the SDK only adds delay
+        for i, (provider, client, model) in enumerate(selections):
+            try:
+                selections[i] = (provider, client.with_options(max_retries=0), model)
+            except Exception:
+                pass
+    return selections
+
+
+def _build_llm_provider(preferred: str | None = None):
+    """Construct the client for one provider (default: the preferred one, see _select_llm_provider)."""
+    if preferred is None:
+        preferred = (os.environ.get('LLM_PROVIDER') or DEFAULT_LLM_PROVIDER).lower().strip()
+    openai_sdk = _optional_import('openai') if preferred in ('', 'openai', 'openrouter', 'open-router', 'router') else None
+    OpenAI = getattr(openai_sdk, 'OpenAI', None)
+    genai = _optional_import('google.generativeai') if preferred in ('', 'gemini', 'google') else None
+    anthropic = _optional_import('anthropic') if preferred in ('', 'anthropic', 'claude', 'xai') else None
+
+    # OpenRouter (uses OpenAI SDK)
+    if (preferred in ('openrouter', 'open-router', 'router')) and OpenAI is not None and ((os.environ.get('OPENROUTER_API_KEY') or DEFAULT_OPENROUTER_API_KEY)):
+        try:
+            base_url = os.environ.get('OPENROUTER_BASE_URL', DEFAULT_OPENROUTER_BASE)
+            api_key = os.environ.get('OPENROUTER_API_KEY', DEFAULT_OPENROUTER_API_KEY)
+            client = OpenAI(api_key=api_key, base_url=base_url, **_http_client_kwargs())
+            model = os.environ.get('OPENROUTER_MODEL', DEFAULT_OPENROUTER_MODEL)
+            return 'openrouter', client, model
+        except Exception:
+            pass
+
+    # OpenAI
+    if (preferred in ('', 'openai')) and OpenAI is not None and os.environ.get('OPENAI_API_KEY'):
+        try:
+            client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'), **_http_client_kwargs())
+            model = os.environ.get('OPENAI_MODEL', 'gpt-4o-mini')
+            return 'openai', client, model
+        except Exception:
+            pass
+
+    # Gemini
+    if (preferred in ('', 'gemini', 'google')) and genai is not None and os.environ.get('GOOGLE_API_KEY'):
+        try:
+            genai.configure(api_key=os.environ.get('GOOGLE_API_KEY'))
+            model = os.environ.get('GEMINI_MODEL', 'gemini-1.5-flash')
+            gm = genai.GenerativeModel(model)
+            return 'gemini', gm, model
+        except Exception:
+            pass
+
+    # Anthropic
+    if (preferred in ('', 'anthropic', 'claude', 'xai')) and anthropic is not None and os.environ.get('ANTHROPIC_API_KEY'):
+        try:
+            client = anthropic.Anthropic(api_key=os.environ.get('ANTHROPIC_API_KEY'), **_http_client_kwargs())
+            model = os.environ.get('ANTHROPIC_MODEL', 'claude-3.5-sonnet')
+            return 'anthropic', client, model
+        except Exception:
+            pass
+
+    return None, None, None
+
+
+def _normalize_prompt(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace: 'What's  the capital?' -> "what's the capital"."""
+    return " ".join(_tokenize(text))
+
+
+# Answers to these go stale within hours, so they get LLMResponseCache.volatile_ttl
+_VOLATILE_PROMPT_RE = re.compile(
+    r"\b(?:today|tonight|tomorrow|yesterday|now|right now|currently|current|latest|recent|this (?:week|month|year)"
+    r"|weather|forecast|temperature|news|headlines?|score|scores|stocks?|price|prices|exchange rate|time|date)\b")
+
+
+_MINHASH_PRIME = (1 << 61) - 1
+_MINHASH_PERMS = [((i * 0x9E3779B97F4A7C15 + 1) % _MINHASH_PRIME or 1, (i * 0xC2B2AE3D27D4EB4F) % _MINHASH_PRIME)
+                  for i in range(1, 65)]
+_MINHASH_BANDS = 16  # 16 bands x 4 rows
+
+
+def _minhash(text: str) -> tuple[int, ...]:
+    """MinHash signature over word unigrams, bigrams and character trigrams."""
+    words = text.split()
+    shingles = set(words) | {" ".join(words[i:i + 2]) for i in range(len(words) - 1)}
+    shingles |= {text[i:i + 3] for i in range(max(0, len(text) - 2))}
+    if not shingles:
+        return ()
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles]
+    return tuple(min((a * h + b) % _MINHASH_PRIME for h in hashes) for a, b in _MINHASH_PERMS)
+
+
+class LLMResponseCache:
+    """Local cache of fallback answers, persisted as JSON between sessions.
+
+    Entries are keyed by normalized prompt, system prompt and the label of
+    the model that actually answered, expire after ``ttl`` seconds (or
+    ``volatile_ttl`` for time-dependent prompts such as today's weather or
+    news; 0 keeps those out of the cache) and are evicted
+    least-recently-used beyond ``max_entries``. With ``fuzzy`` on, a miss also checks near-duplicate
+    prompts through MinHash/LSH and accepts one whose estimated Jaccard
+    similarity reaches ``threshold``.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str | None, max_entries: int = 500, ttl: float = 7 * 24 * 3600,
+                 fuzzy: bool = False, threshold: float = 0.8, enabled: bool = True, volatile_ttl: float = 0.0):
+        self._path = path
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.volatile_ttl = volatile_ttl
+        self.fuzzy = fuzzy
+        self.threshold = threshold
+        self._lock = threading.RLock()
+        self._entries: collections.OrderedDict[str, dict] = collections.OrderedDict()
+        self._bands: dict[tuple, set[str]] = {}
+        self._loaded = False
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(norm_prompt: str, system_prompt: str, model: str) -> str:
+        return f"{model}\x1f{system_prompt}\x1f{norm_prompt}"
+
+    def _expired(self, entry: dict, now: float) -> bool:
+        return now - entry.get("created", 0) > min(self.ttl, entry.get("ttl", self.ttl))
+
+    def _band_keys(self, signature, system_prompt: str, model: str):
+        rows = len(signature) // _MINHASH_BANDS
+        return [(model, system_prompt, b, signature[b * rows:(b + 1) * rows]) for b in range(_MINHASH_BANDS)] if rows else []
+
+    def _index(self, key: str, entry: dict) -> None:
+        entry["sig"] = tuple(entry.get("sig") or _minhash(entry["prompt"]))
+        for band in self._band_keys(entry["sig"], entry["system"], entry["model"]):
+            self._bands.setdefault(band, set()).add(key)
+
+    def _unindex(self, key: str, entry: dict) -> None:
+        for band in self._band_keys(entry.get("sig") or (), entry["system"], entry["model"]):
+            bucket = self._bands.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._bands[band]
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self._path:
+            return
+        try:
+            with open(self._path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+            if data.get("version") != self.VERSION:
+                return
+            now = time.time()
+            for entry in sorted(data.get("entries", []), key=lambda e: e.get("last_used", 0)):
+                if self._expired(entry, now):
+                    continue
+                key = self._key(entry["prompt"], entry["system"], entry["model"])
+                self._entries[key] = entry
+                self._index(key, entry)
+        except Exception:
+            pass
+
+    def _save(self) -> None:
+        if not self._path:
+            return
+        try:
+            entries = [{k: v for k, v in e.items() if k != "sig"} for e in self._entries.values()]
+            tmp = self._path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump({"version": self.VERSION, "entries": entries}, fh)
+            os.replace(tmp, self._path)
+        except Exception:
+            pass
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unindex(key, entry)
+
+    def get(self, prompt: str, system_prompt: str, model: str) -> str | None:
+        if not self.enabled:
+            return None
+        norm = _normalize_prompt(prompt)
+        key = self._key(norm, system_prompt, model)
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                self._drop(key)
+                entry = None
+            if entry is None and self.fuzzy and norm:
+                entry = self._nearest(norm, system_prompt, model, now)
+                if entry is not None:
+                    key = self._key(entry["prompt"], system_prompt, model)
+                    self.near_hits += 1
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["last_used"] = now
+            self._entries.move_to_end(key)
+            return entry["reply"]
+
+    def _nearest(self, norm: str, system_prompt: str, model: str, now: float):
+        signature = _minhash(norm)
+        candidates = set()
+        for band in self._band_keys(signature, system_prompt, model):
+            candidates |= self._bands.get(band, set())
+        best, best_score = None, self.threshold
+        for key in candidates:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry, now):
+                continue
+            score = sum(1 for a, b in zip(signature, entry["sig"]) if a == b) / len(signature)
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def put(self, prompt: str, system_prompt: str, model: str, reply: str) -> None:
+        norm = _normalize_prompt(prompt)
+        if not self.enabled or not norm or not reply:
+            return
+        volatile = bool(_VOLATILE_PROMPT_RE.search(norm))
+        if volatile and self.volatile_ttl <= 0:
+            return
+        key = self._key(norm, system_prompt, model)
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            self._drop(key)
+            entry = {"prompt": norm, "system": system_prompt, "model": model, "reply": reply,
+                     "created": now, "last_used": now}
+            if volatile:
+                entry["ttl"] = self.volatile_ttl
+            self._entries[key] = entry
+            self._index(key, entry)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+            self._save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bands.clear()
+            self._loaded = True
+            self._save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._ensure_loaded()
+            return {"entries": len(self._entries), "hits": self.hits, "near_hits": self.near_hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+
+llm_cache = LLMResponseCache(
+    _data_path("llm_cache.json"),
+    enabled=os.environ.get('JARVIS_LLM_CACHE', '1').strip() != '0',
+    max_entries=int(os.environ.get('JARVIS_LLM_CACHE_SIZE', '500') or 500),
+    ttl=float(os.environ.get('JARVIS_LLM_CACHE_TTL', str(7 * 24 * 3600)) or 7 * 24 * 3600),
+    fuzzy=os.environ.get('JARVIS_LLM_CACHE_FUZZY', '0').strip() == '1',
+    volatile_ttl=float(os.environ.get('JARVIS_LLM_CACHE_VOLATILE_TTL', '0') or 0),
+)
+
+
+# ----- Conversation memory -----
+_TOKEN_ESTIMATE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough BPE token count: one per punctuation mark or short word, one per ~6 letters of longer words."""
+    return sum(max(1, (len(piece) + 2) // 6) for piece in _TOKEN_ESTIMATE_RE.findall(text or "")) + 1
+
+
+def _first_sentence(text: str, limit: int = 160) -> str:
+    text = " ".join((text or "").split())
+    m = _SENTENCE_END_RE.search(text)
+    if m is not None:
+        text = text[:m.start() + 1]
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + "…"
+
+
+class ConversationMemory:
+    """Recent LLM exchanges of this session, fitted into a token budget.
+
+    ``context`` returns the system prompt and the history to send with a new
+    question: as many recent turns as fit in ``budget`` tokens (estimated
+    locally, no tokenizer download), newest first. Turns that no longer fit
+    are folded into a running summary of at most ``summary_budget`` tokens
+    that rides along in the system prompt. Folding first writes a cheap
+    extractive summary so the budget holds immediately; when a
+    ``summarizer`` is given it rewrites the summary in the background. The
+    conversation starts over after ``idle`` seconds without a question.
+    """
+
+    def __init__(self, budget: int = 1500, summary_budget: int = 300, idle: float = 1800.0, summarizer=None):
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.idle = idle
+        self.summarizer = summarizer
+        self._lock = threading.Lock()
+        self._turns: collections.deque = collections.deque()  # (role, text, tokens)
+        self._turn_tokens = 0
+        self._summary = ""
+        self._version = 0
+        self._summarizing = False
+        self._last_used = 0.0
+
+    def _expire(self, now: float) -> None:
+        if self._last_used and now - self._last_used > self.idle:
+            self._turns.clear()
+            self._turn_tokens = 0
+            self._summary = ""
+            self._version += 1
+        self._last_used = now
+
+    def clear(self) -> None:
+        with self._lock:
+            self._turns.clear()
+            self._turn_tokens = 0
+            self._summary = ""
+            self._version += 1
+
+    def context(self, prompt: str, system_prompt: str = _DEFAULT_SYSTEM_PROMPT) -> tuple[str, list[dict]]:
+        """Return ``(system_prompt, history)`` for a new question, within the budget."""
+        if self.budget <= 0:
+            return system_prompt, []
+        with self._lock:
+            self._expire(time.monotonic())
+            if self._summary:
+                system_prompt = f"{system_prompt}\n\nEarlier in this conversation: {self._summary}"
+            room = self.budget - _estimate_tokens(system_prompt) - _estimate_tokens(prompt)
+            history: list[dict] = []
+            turns = list(self._turns)
+            # Whole exchanges only, so the history never starts with an assistant turn
+            for i in range(len(turns) - 2, -1, -2):
+                cost = turns[i][2] + turns[i + 1][2]
+                if cost > room:
+                    break
+                room -= cost
+                history[:0] = [{"role": turns[i][0], "content": turns[i][1]},
+                               {"role": turns[i + 1][0], "content": turns[i + 1][1]}]
+            return system_prompt, history
+
+    def add(self, question: str, reply: str) -> None:
+        """Record one exchange and fold the oldest ones if the history outgrew its share of the budget."""
+        if self.budget <= 0 or not question or not reply:
+            return
+        folded = []
+        with self._lock:
+            self._expire(time.monotonic())
+            for role, text in (("user", question), ("assistant", reply)):
+                tokens = _estimate_tokens(text)
+                self._turns.append((role, text, tokens))
+                self._turn_tokens += tokens
+            while self._turn_tokens > self.budget - self.summary_budget and len(self._turns) > 2:
+                user, assistant = self._turns.popleft(), self._turns.popleft()
+                self._turn_tokens -= user[2] + assistant[2]
+                folded.append((user[1], assistant[1]))
+            if not folded:
+                return
+            notes = " ".join(f"The user asked: {_first_sentence(q)} You answered: {_first_sentence(a)}"
+                             for q, a in folded)
+            previous = self._summary
+            self._summary = self._fit_summary(f"{previous} {notes}".strip())
+            self._version += 1
+            version = self._version
+            if self.summarizer is None or self._summarizing:
+                return
+            self._summarizing = True
+        text = "\n".join([previous] + [f"User: {q}\nAssistant: {a}" for q, a in folded]).strip()
+        threading.Thread(target=self._summarize, args=(text, version), daemon=True).start()
+
+    def _fit_summary(self, text: str) -> str:
+        """Drop the oldest sentences until the summary fits its budget."""
+        while _estimate_tokens(text) > self.summary_budget:
+            m = _SENTENCE_END_RE.search(text)
+            if m is None or m.end() >= len(text):
+                words = text.split()
+                return " ".join(words[len(words) // 4 + 1:])
+            text = text[m.end():]
+        return text
+
+    def _summarize(self, text: str, version: int) -> None:
+        try:
+            summary = self.summarizer(text, self.summary_budget)
+        except Exception:
+            summary = None
+        with self._lock:
+            self._summarizing = False
+            # A newer fold has already replaced the summary this one was based on
+            if summary and self._version == version:
+                self._summary = self._fit_summary(" ".join(summary.split()))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"turns": len(self._turns) // 2, "history_tokens": self._turn_tokens,
+                    "summary_tokens": _estimate_tokens(self._summary) if self._summary else 0}
+
+
+def _llm_summarize(text: str, max_tokens: int) -> str | None:
+    """Condense earlier exchanges with the configured model (used off the reply path)."""
+    provider, client, model = _select_llm_provider()
+    if not provider:
+        return None
+    words = max(20, int(max_tokens * 0.6))
+    prompt = (f"Summarize this conversation in at most {words} words, in the third person. Keep names, "
+              f"places, numbers and anything the user may refer back to.\n\n{text}")
+    return _llm_complete(provider, client, model, prompt, "You write brief, factual summaries.") or None
+
+
+conversation = ConversationMemory(
+    budget=int(os.environ.get('JARVIS_MEMORY_TOKENS', '1500') or 0),
+    summary_budget=int(os.environ.get('JARVIS_MEMORY_SUMMARY_TOKENS', '300') or 300),
+    idle=float(os.environ.get('JARVIS_MEMORY_IDLE', '1800') or 1800),
+    summarizer=_llm_summarize if os.environ.get('JARVIS_MEMORY_SUMMARIZE', '1').strip() != '0' else None,
+)
+
+
+def _llm_messages(system_prompt: str, history, prompt: str) -> list[dict]:
+    return [{"role": "system", "content": system_prompt}] + list(history or []) + [{"role": "user", "content": prompt}]
+
+
+def _gemini_prompt(system_prompt: str, history, prompt: str) -> str:
+    lines = [f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}" for m in history or []]
+    return "\n".join([f"{system_prompt}\n"] + lines + [f"User: {prompt}"])
+
+
+# What the assistant says to open questions when no LLM provider is configured
+_NO_LLM_REPLY = "I can hear you. For open-ended questions, add API keys to enable smart answers."
+
+
+def llm_generate_response(prompt: str, system_prompt: str = _DEFAULT_SYSTEM_PROMPT, history=None) -> str:
+    """Answer ``prompt``; ``history`` is a list of earlier user/assistant messages (see ConversationMemory)."""
+    provider, client, model = _select_llm_provider()
+    if not provider:
+        return _NO_LLM_REPLY
+    model_label = f"{provider}:{model}"
+    # A follow-up only means something with its history, so only stand-alone questions use the cache
+    cached = llm_cache.get(prompt, system_prompt, model_label) if not history else None
+    if cached is not None:
+        return cached
+    try:
+        reply = llm_router.complete(prompt, system_prompt, history)
+    except Exception as e:
+        return f"I can hear you, but I couldn't contact the model: {e}"
+    if reply and not history:
+        llm_cache.put(prompt, system_prompt, llm_router.answered_by() or model_label, reply)
+    return reply
+
+
+def _llm_complete(provider, client, model, prompt: str, system_prompt: str, history=None) -> str:
+    """Run one non-streaming completion on the given provider client; raises on errors."""
+    if provider in ('openai', 'openrouter'):
+        extra_headers = None
+        if provider == 'openrouter':
+            referer = os.environ.get('OPENROUTER_SITE_URL', '')
+            title = os.environ.get('OPENROUTER_SITE_NAME', '')
+            extra_headers = {"HTTP-Referer": referer, "X-Title": title}
+        resp = client.chat.completions.create(
+            model=model,
+            messages=_llm_messages(system_prompt, history, prompt),
+            temperature=0.3,
+            max_tokens=256,
+            extra_headers=extra_headers,
+        )
+        return (resp.choices[0].message.content or "").strip()
+    if provider == 'gemini':
+        # google-generativeai
+        resp = client.generate_content(_gemini_prompt(system_prompt, history, prompt))
+        return (getattr(resp, 'text', None) or "").strip()
+    if provider == 'anthropic':
+        resp = client.messages.create(
+            model=model,
+            max_tokens=256,
+            temperature=0.3,
+            system=system_prompt,
+            messages=_llm_messages(system_prompt, history, prompt)[1:],
+        )
+        # Anthropic returns a list of content blocks; concatenate text parts
+        parts = []
+        for b in getattr(resp, 'content', []) or []:
+            t = getattr(b, 'text', None)
+            if t:
+                parts.append(t)
+        return ("\n".join(parts)).strip() or ""
+    return ""
+
+
+# Speak fallback answers sentence by sentence while the model is still generating
+LLM_STREAMING = os.environ.get('JARVIS_LLM_STREAM', '1').strip() != '0'
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?;])[\"')\]]*\s+|\n+")
+_MAX_UNSPOKEN_CHARS = 220
+
+
+def llm_stream_response(prompt: str, system_prompt: str = _DEFAULT_SYSTEM_PROMPT, history=None):
+    """Yield the reply as text deltas as the provider streams them.
+
+    Raises on transport errors so the caller can decide how to report them.
+    """
+    provider, client, model = _select_llm_provider()
+    if not provider:
+        yield _NO_LLM_REPLY
+        return
+    yield from llm_router.stream(prompt, system_prompt, history)
+
+
+def _llm_stream(provider, client, model, prompt: str, system_prompt: str, history=None):
+    """Stream one completion from the given provider client as text deltas; raises on errors."""
+    if provider in ('openai', 'openrouter'):
+        extra_headers = None
+        if provider == 'openrouter':
+            referer = os.environ.get('OPENROUTER_SITE_URL', '')
+            title = os.environ.get('OPENROUTER_SITE_NAME', '')
+            extra_headers = {"HTTP-Referer": referer, "X-Title": title}
+        stream = client.chat.completions.create(
+            model=model,
+            messages=_llm_messages(system_prompt, history, prompt),
+            temperature=0.3,
+            max_tokens=256,
+            extra_headers=extra_headers,
+            stream=True,
+        )
+        for chunk in stream:
+            choices = getattr(chunk, 'choices', None) or []
+            delta = getattr(choices[0], 'delta', None) if choices else None
+            text = getattr(delta, 'content', None) if delta is not None else None
+            if text:
+                yield text
+        return
+    if provider == 'gemini':
+        for chunk in client.generate_content(_gemini_prompt(system_prompt, history, prompt), stream=True):
+            text = getattr(chunk, 'text', None)
+            if text:
+                yield text
+        return
+    if provider == 'anthropic':
+        with client.messages.stream(
+            model=model,
+            max_tokens=256,
+            temperature=0.3,
+            system=system_prompt,
+            messages=_llm_messages(system_prompt, history, prompt)[1:],
+        ) as stream:
+            for text in stream.text_stream:
+                if text:
+                    yield text
+
+
+class LLMRouter:
+    """Sends each LLM request to the healthiest configured provider, with failover and optional hedging.
+
+    Every attempt is timed (whole reply for ``complete``, first token for
+    ``stream``) and its outcome kept per provider. A provider whose recent
+    error rate reaches UNHEALTHY drops behind the others until its errors age
+    out of HEALTH_WINDOW. An attempt that fails goes straight to the next
+    provider. With ``hedge`` on, a request still unanswered after the
+    provider's usual (``hedge_quantile``) latency is also sent to the next
+    provider, and the first good answer wins; the other one is dropped.
+    """
+
+    WINDOW = 50
+    HEALTH_WINDOW = 120.0
+    MIN_SAMPLES = 5
+    UNHEALTHY = 0.5
+
+    def __init__(self, registry: _LLMProviderRegistry, hedge: bool = False, hedge_quantile: float = 0.9,
+                 default_hedge_delay: float = 2.0, min_hedge_delay: float = 0.2):
+        self._registry = registry
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self._lock = threading.Lock()
+        self._latency: dict[tuple[str, str], collections.deque] = {}
+        self._outcomes: dict[str, collections.deque] = {}
+        self.hedged = 0
+        self.failovers = 0
+        self._answered = threading.local()
+
+    @staticmethod
+    def _label(selection) -> str:
+        return f"{selection[0]}:{selection[2]}"
+
+    def answered_by(self) -> str | None:
+        """Label of the provider that answered this thread's latest request (after any failover)."""
+        return getattr(self._answered, "label", None)
+
+    def _record(self, label: str, kind: str, latency: float | None, ok: bool) -> None:
+        with self._lock:
+            self._outcomes.setdefault(label, collections.deque(maxlen=self.WINDOW)).append((time.monotonic(), ok))
+            if ok and latency is not None:
+                self._latency.setdefault((label, kind), collections.deque(maxlen=self.WINDOW)).append(latency)
+
+    def error_rate(self, label: str) -> float:
+        cutoff = time.monotonic() - self.HEALTH_WINDOW
+        with self._lock:
+            recent = [ok for t, ok in self._outcomes.get(label, ()) if t >= cutoff]
+        return recent.count(False) / len(recent) if len(recent) >= 3 else 0.0
+
+    def latency(self, label: str, kind: str, quantile: float) -> float | None:
+        with self._lock:
+            samples = sorted(self._latency.get((label, kind), ()))
+        if len(samples) < self.MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * quantile))]
+
+    def ranked(self) -> list[tuple]:
+        """Configured providers, healthy ones first, otherwise in preference order."""
+        return sorted(self._registry.all(), key=lambda sel: self.error_rate(self._label(sel)) >= self.UNHEALTHY)
+
+    def _race(self, kind: str, attempt, discard=None):
+        """Run ``attempt(selection)`` with failover/hedging; return ``(selection, value)`` of the first success."""
+        self._answered.label = None
+        candidates = self.ranked()
+        if not candidates:
+            raise RuntimeError("no LLM provider is configured")
+        started = time.perf_counter()
+        results: queue.Queue = queue.Queue()
+        decided = [False]
+
+        def run(selection):
+            label = self._label(selection)
+            t0 = time.monotonic()
+            try:
+                value = attempt(selection)
+            except Exception as e:
+                self._record(label, kind, None, False)
+                results.put((selection, None, e))
+                return
+            self._record(label, kind, time.monotonic() - t0, True)
+            with self._lock:
+                late, decided[0] = decided[0], True
+            if late:
+                if discard is not None:
+                    try:
+                        discard(value)
+                    except Exception:
+                        pass
+                return
+            results.put((selection, value, None))
+
+        launched = 0
+        pending = 0
+        hedge_at = None
+        error: Exception | None = None
+        while True:
+            if launched == 0 or (pending == 0 and launched < len(candidates)):
+                if launched:
+                    self.failovers += 1
+                selection = candidates[launched]
+                threading.Thread(target=run, args=(selection,), daemon=True).start()
+                launched += 1
+                pending += 1
+                hedge_at = None
+                if self.hedge and launched < len(candidates):
+                    delay = self.latency(self._label(selection), kind, self.hedge_quantile)
+                    delay = self.default_hedge_delay if delay is None else max(self.min_hedge_delay, delay)
+                    hedge_at = time.monotonic() + delay
+            if pending == 0:
+                raise error or RuntimeError("every LLM provider failed")
+            try:
+                timeout = None if hedge_at is None else max(0.0, hedge_at - time.monotonic())
+                selection, value, err = results.get(timeout=timeout)
+            except queue.Empty:
+                # Slower than usual: ask the next provider too and take whichever answers first
+                self.hedged += 1
+                pending += 1
+                selection = candidates[launched]
+                threading.Thread(target=run, args=(selection,), daemon=True).start()
+                launched += 1
+                hedge_at = None
+                continue
+            pending -= 1
+            if err is None:
+                tracer.record("llm", started)
+                self._answered.label = self._label(selection)
+                return selection, value
+            error = err
+
+    def complete(self, prompt: str, system_prompt: str = _DEFAULT_SYSTEM_PROMPT, history=None) -> str:
+        def attempt(selection):
+            reply = _llm_complete(*selection, prompt, system_prompt, history)
+            if not reply:
+                raise ValueError(f"{selection[0]} returned an empty reply")
+            return reply
+        return self._race('complete', attempt)[1]
+
+    def stream(self, prompt: str, system_prompt: str = _DEFAULT_SYSTEM_PROMPT, history=None):
+        """Yield deltas from whichever provider produces the first token; later errors are raised."""
+        def attempt(selection):
+            deltas = _llm_stream(*selection, prompt, system_prompt, history)
+            for text in deltas:
+                if text:
+                    return text, deltas
+            raise ValueError(f"{selection[0]} returned an empty reply")
+        selection, (first, deltas) = self._race('first_token', attempt, discard=lambda value: value[1].close())
+        yield first
+        try:
+            yield from deltas
+        except Exception:
+            self._record(self._label(selection), 'first_token', None, False)
+            raise
+
+    def stats(self) -> list[dict]:
+        rows = []
+        for selection in self._registry.all():
+            label = self._label(selection)
+            rows.append({"provider": label, "error_rate": self.error_rate(label),
+                         "complete_p50": self.latency(label, 'complete', 0.5),
+                         "first_token_p50": self.latency(label, 'first_token', 0.5),
+                         "hedge_after": self.latency(label, 'first_token', self.hedge_quantile)})
+        return rows
+
+
+llm_router = LLMRouter(llm_providers, hedge=os.environ.get('JARVIS_LLM_HEDGE', '0').strip() == '1')
+
+
+def _sentence_chunks(deltas):
+    """Regroup streamed text deltas into whole sentences.
+
+    Overlong runs without punctuation are cut at the last space so speech
+    never waits on an unbounded buffer.
+    """
+    buf = ""
+    for delta in deltas:
+        buf += delta
+        while True:
+            m = _SENTENCE_END_RE.search(buf)
+            if m is None:
+                break
+            sentence, buf = buf[:m.end()].strip(), buf[m.end():]
+            if sentence:
+                yield sentence
+        if len(buf) > _MAX_UNSPOKEN_CHARS:
+            cut = buf.rfind(" ", 0, _MAX_UNSPOKEN_CHARS)
+            cut = cut if cut > 0 else _MAX_UNSPOKEN_CHARS
+            sentence, buf = buf[:cut].strip(), buf[cut:]
+            if sentence:
+                yield sentence
+    if buf.strip():
+        yield buf.strip()
+
+
+def _speak_streamed_reply(prompt: str, system_prompt: str = _DEFAULT_SYSTEM_PROMPT, history=None) -> str:
+    """Stream an LLM answer, speaking and transcribing each sentence as it completes."""
+    spoken = []
+    provider, _client, model = _select_llm_provider()
+    model_label = f"{provider}:{model}"
+    cached = llm_cache.get(prompt, system_prompt, model_label) if provider and not history else None
+    completed = False
+    try:
+        deltas = [cached] if cached is not None else llm_stream_response(prompt, system_prompt, history)
+        for sentence in _sentence_chunks(deltas):
+            if command_cancelled():
+                break
+            spoken.append(sentence)
+            speak(sentence)
+            try:
+                if UI.instance is not None:
+                    UI.instance.stream_assistant(sentence + " ")
+            except Exception:
+                pass
+        # A cancelled answer is neither complete nor worth caching
+        completed = not command_cancelled()
+    except Exception as e:
+        if not spoken:
+            message = f"I can hear you, but I couldn't contact the model: {e}"
+            spoken.append(message)
+            speak(message)
+            try:
+                if UI.instance is not None:
+                    UI.instance.stream_assistant(message)
+            except Exception:
+                pass
+    # Without a provider the stream was just the canned "add API keys" notice
+    answered = completed and bool(spoken) and bool(provider)
+    if not spoken and not command_cancelled():
+        message = "Sorry, I don't have an answer for that yet."
+        spoken.append(message)
+        speak(message)
+        try:
+            if UI.instance is not None:
+                UI.instance.stream_assistant(message)
+        except Exception:
+            pass
+    try:
+        if UI.instance is not None:
+            UI.instance.stream_assistant("", done=True)
+    except Exception:
+        pass
+    if completed and provider and cached is None and spoken and not history:
+        llm_cache.put(prompt, system_prompt, llm_router.answered_by() or model_label, " ".join(spoken))
+    # Only a real answer is returned; apologies and errors are not worth remembering
+    return " ".join(spoken) if answered else ""
+
+
+# ----- Intent routing -----
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:['+][a-z0-9+]*)*")
+_TRIE_END = object()
+
+
+def _tokenize(text: str) -> list[str]:
+    """Split an utterance into lowercase word tokens (punctuation is dropped)."""
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+class _Intent:
+    __slots__ = ("name", "handler", "priority", "order", "requires", "excludes", "pattern", "reply", "speculative",
+                 "grammar")
+
+    def __init__(self, name, handler, priority, order, requires, excludes, pattern, reply=None, speculative=False,
+                 grammar=True):
+        self.name = name
+        self.handler = handler
+        self.priority = priority
+        self.order = order
+        self.requires = requires
+        self.excludes = excludes
+        self.pattern = pattern
+        self.reply = reply
+        self.speculative = speculative
+        self.grammar = grammar
+
+
+class IntentRouter:
+    """Declarative command registry compiled into a token trie plus one combined regex.
+
+    Each intent is triggered by whole-word phrases anywhere in the utterance
+    (``keywords``), at its start (``prefixes``), by the entire utterance
+    (``exact``), or - for intents with no phrases - by ``pattern`` alone.
+    ``requires`` is a list of phrase groups that must each have at least one
+    hit, ``excludes`` phrases veto the intent, and a ``pattern`` on a phrase
+    triggered intent acts as an extra guard. The highest ``priority`` wins;
+    ties go to the intent registered first.
+
+    Matching walks the trie once from every token position, so the cost per
+    utterance depends on its length, not on how many intents are registered.
+
+    Intents whose whole job is to say something register a side-effect-free
+    ``reply`` function instead of a handler; its text goes to the responder.
+    Those, and other cheap idempotent intents marked ``speculative``, can be
+    resolved from a partial transcript with ``speculate`` while the user is
+    still talking: the reply is computed and pre-rendered then, and spoken
+    as soon as ``dispatch`` receives the same final transcript. Capture only
+    ends early on an ``exact`` whole-utterance command; a keyword hit such
+    as "what time" may still grow into "what time does the store close".
+    """
+
+    # A settled speculation older than this is recomputed (a pre-rendered time goes stale)
+    SPECULATION_TTL = 3.0
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._intents: list[_Intent] = []
+        self._triggers: list[tuple[int, str, tuple[str, ...]]] = []  # (intent, kind, tokens)
+        self._trie: dict | None = None
+        self._exact: dict[str, list[int]] = {}
+        self._combined: re.Pattern | None = None
+        self._group_to_intent: dict[str, int] = {}
+        self._fallback = None
+        self._responder = None
+        self._prepare = None
+        # Speculations per recognition session: session -> (query, intent, reply text, made at, settled)
+        self._speculated: dict[object, tuple[str, _Intent, str | None, float, bool]] = {}
+
+    def register(self, name: str, handler, *, keywords=(), prefixes=(), exact=(),
+                 requires=(), excludes=(), pattern: str | None = None, priority: int = 0,
+                 reply=None, speculative: bool = False, grammar: bool = True) -> None:
+        """Add an intent; the router recompiles lazily on the next match.
+
+        ``grammar=False`` keeps its phrases out of ``vocabulary``, so only open
+        transcription can trigger it (for shutdown, exit and the like).
+        """
+        with self._lock:
+            idx = len(self._intents)
+            req = tuple(tuple(" ".join(_tokenize(p)) for p in group) for group in requires)
+            exc = tuple(" ".join(_tokenize(p)) for p in excludes)
+            compiled = re.compile(pattern) if pattern else None
+            self._intents.append(_Intent(name, handler, priority, idx, req, exc, compiled,
+                                         reply, speculative or reply is not None, grammar))
+            for p in keywords:
+                self._triggers.append((idx, "any", tuple(_tokenize(p))))
+            for p in prefixes:
+                self._triggers.append((idx, "prefix", tuple(_tokenize(p))))
+            for p in exact:
+                self._triggers.append((idx, "exact", tuple(_tokenize(p))))
+            self._trie = None
+
+    def set_fallback(self, handler) -> None:
+        self._fallback = handler
+
+    def set_responder(self, speak, prepare=None) -> None:
+        """``speak(text)`` delivers replies; ``prepare(text)`` pre-renders a reply found by ``speculate``."""
+        self._responder = speak
+        self._prepare = prepare
+
+    def _compile(self) -> None:
+        trie: dict = {}
+        exact: dict[str, list[int]] = {}
+
+        def _insert(tokens, value):
+            node = trie
+            for tok in tokens:
+                node = node.setdefault(tok, {})
+            node.setdefault(_TRIE_END, []).append(value)
+
+        for idx, kind, tokens in self._triggers:
+            if not tokens:
+                continue
+            if kind == "exact":
+                exact.setdefault(" ".join(tokens), []).append(idx)
+            else:
+                _insert(tokens, (idx, kind))
+        # Phrases used by requires/excludes are tracked as plain hits
+        for intent in self._intents:
+            for phrase in [p for group in intent.requires for p in group] + list(intent.excludes):
+                if phrase:
+                    _insert(tuple(phrase.split()), (None, phrase))
+        # Pattern-only intents share one alternation, ordered by priority
+        triggered = {t[0] for t in self._triggers}
+        pattern_only = sorted(
+            (i for i in self._intents if i.pattern is not None and i.order not in triggered),
+            key=lambda i: (-i.priority, i.order),
+        )
+        group_to_intent = {}
+        parts = []
+        for i in pattern_only:
+            group = f"_i{i.order}"
+            group_to_intent[group] = i.order
+            parts.append(f"(?P<{group}>{i.pattern.pattern})")
+        self._combined = re.compile("|".join(parts)) if parts else None
+        self._group_to_intent = group_to_intent
+        self._exact = exact
+        self._trie = trie
+
+    def match(self, query: str):
+        """Return the winning intent for ``query`` or None."""
+        with self._lock:
+            if self._trie is None:
+                self._compile()
+            trie, exact, combined = self._trie, self._exact, self._combined
+        tokens = _tokenize(query)
+        candidates: set[int] = set(exact.get(" ".join(tokens), ()))
+        hits: set[str] = set()
+        for start in range(len(tokens)):
+            node = trie
+            for pos in range(start, len(tokens)):
+                node = node.get(tokens[pos])
+                if node is None:
+                    break
+                for idx, kind in node.get(_TRIE_END, ()):
+                    if idx is None:
+                        hits.add(kind)
+                    elif kind == "any" or start == 0:
+                        candidates.add(idx)
+        if combined is not None:
+            m = combined.search(query)
+            if m and m.lastgroup in self._group_to_intent:
+                candidates.add(self._group_to_intent[m.lastgroup])
+        best = None
+        for idx in candidates:
+            intent = self._intents[idx]
+            if best is not None and (intent.priority, -intent.order) <= (best.priority, -best.order):
+                continue
+            if any(not any(p in hits for p in group) for group in intent.requires):
+                continue
+            if any(p in hits for p in intent.excludes):
+                continue
+            if intent.pattern is not None and not intent.pattern.search(query):
+                continue
+            best = intent
+        return best
+
+    def vocabulary(self) -> list[str]:
+        """Phrases that are complete commands on their own, e.g. for a constrained recognizer grammar.
+
+        A forced-choice grammar maps noise to its nearest phrase, so intents
+        registered with ``grammar=False`` are left out.
+        """
+        with self._lock:
+            phrases = set()
+            for idx, kind, tokens in self._triggers:
+                intent = self._intents[idx]
+                if tokens and kind != "prefix" and intent.grammar and not intent.requires and intent.pattern is None:
+                    phrases.add(" ".join(tokens))
+            return sorted(phrases)
+
+    def speculate(self, query: str, session=None) -> bool:
+        """Resolve a partial transcript of recognition ``session`` ahead of ``dispatch``.
+
+        For a speculative intent the reply is computed and handed to the
+        ``prepare`` callback; nothing is executed. Returns True only when
+        ``query`` is also an ``exact`` whole-utterance trigger of that intent,
+        i.e. capture may end now; keyword and prefix hits wait for the normal
+        endpoint. The result is only used once ``settle`` confirms it matches
+        the session's final transcript, and for at most SPECULATION_TTL
+        seconds.
+        """
+        intent = self.match(query)
+        if intent is None or not intent.speculative:
+            with self._lock:
+                self._speculated.pop(session, None)
+            return False
+        with self._lock:
+            exact = self._exact.get(" ".join(_tokenize(query)), ())
+            complete = any(self._intents[idx] is intent for idx in exact)
+        text = None
+        if intent.reply is not None:
+            try:
+                text = intent.reply(query)
+            except Exception:
+                return False
+            if text and self._prepare is not None:
+                try:
+                    self._prepare(text)
+                except Exception:
+                    pass
+        with self._lock:
+            self._speculated[session] = (query, intent, text, time.monotonic(), False)
+        return complete
+
+    def settle(self, session, query: str | None) -> None:
+        """Keep ``session``'s speculation for ``dispatch`` only if it was made for the final ``query``."""
+        with self._lock:
+            entry = self._speculated.pop(session, None)
+            if entry is not None and query and entry[0] == query:
+                self._speculated[session] = entry[:4] + (True,)
+
+    def _take_speculation(self, query: str):
+        now = time.monotonic()
+        with self._lock:
+            found = None
+            for session, entry in list(self._speculated.items()):
+                if now - entry[3] > self.SPECULATION_TTL:
+                    del self._speculated[session]
+                elif found is None and entry[4] and entry[0] == query:
+                    found = self._speculated.pop(session)
+            return found
+
+    def dispatch(self, query: str) -> bool:
+        """Run the matching handler; handlers return False to end the session."""
+        with tracer.span("route"):
+            speculated = self._take_speculation(query)
+            intent = speculated[1] if speculated is not None else self.match(query)
+        with tracer.span("handler"):
+            if intent is not None and intent.reply is not None and self._responder is not None:
+                text = speculated[2] if speculated is not None else intent.reply(query)
+                if text:
+                    self._responder(text)
+                return True
+            handler = intent.handler if intent is not None else self._fallback
+            if handler is None:
+                return True
+            return handler(query) is not False
+
+
+intent_router = IntentRouter()
+
+
+def _strip_command_prefix(query: str, prefixes) -> str:
+    """Return the argument text after the first matching command prefix."""
+    for p in prefixes:
+        if query.startswith(p):
+            return query[len(p):].strip()
+    return query.strip()
+
+
+def _intent_wikipedia(query: str) -> None:
+    q = query.replace("wikipedia", "").strip()
+    if q:
+        search_wikipedia(q)
+    else:
+        speak("What should I search on Wikipedia?")
+
+
+def _intent_play(query: str) -> None:
+    song_name = query
+    for k in ("play music", "play song", "play track"):
+        if k in query:
+            song_name = query.split(k, 1)[1]
+    song_name = song_name.strip()
+    wants_online = PLAY_ON_WEB_BY_DEFAULT or any(x in query for x in ("play online", "play on web", "play from web", "online"))
+    if wants_online:
+        if _play_online_background(song_name or "music"):
+            pass
+        elif _play_from_web(song_name or "music"):
+            _speak_and_log("Playing on the web")
+        else:
+            _speak_and_log("I couldn't play that online.")
+    else:
+        play_music(song_name)
+
+
+def _intent_queue(query: str) -> None:
+    song_name = _strip_command_prefix(query, ("queue song", "queue track", "add to queue", "add to the queue", "queue"))
+    if not song_name:
+        _speak_and_log("What should I queue?")
+        return
+    wants_online = PLAY_ON_WEB_BY_DEFAULT or "online" in song_name.split()
+    if wants_online:
+        song_name = song_name.replace("online", "").strip()
+    path = None if wants_online else _find_audio_file(song_name)
+    if path is not None:
+        result = _AudioPlayer.instance().enqueue_file(path)
+        if result:
+            _speak_and_log(f"{result.capitalize()} {music_library.describe(path)}")
+            return
+    if not _queue_online(song_name):
+        _speak_and_log("I couldn't queue that.")
+
+
+def _intent_play_radio(query: str) -> None:
+    name = _strip_command_prefix(query, ("play radio", "play album", "play playlist"))
+    if not name:
+        _speak_and_log("Which artist or song should I play?")
+        return
+    search = f"{name} full album" if query.startswith("play album") else f"{name} radio mix"
+    if not _play_online_radio(search):
+        _speak_and_log("I couldn't find that online.")
+
+
+def _intent_play_online_default(query: str) -> None:
+    global PLAY_ON_WEB_BY_DEFAULT
+    with _STATE_LOCK:
+        PLAY_ON_WEB_BY_DEFAULT = True
+    _speak_and_log("Okay, I will play music online by default.")
+
+
+def _intent_play_local_default(query: str) -> None:
+    global PLAY_ON_WEB_BY_DEFAULT
+    with _STATE_LOCK:
+        PLAY_ON_WEB_BY_DEFAULT = False
+    _speak_and_log("Okay, I will play music locally by default.")
+
+
+def _intent_pause(query: str) -> None:
+    if not pause_playback():
+        pause_music()
+    else:
+        _speak_and_log("Paused.")
+
+
+def _intent_resume(query: str) -> None:
+    if not resume_playback():
+        resume_music()
+    else:
+        _speak_and_log("Resumed.")
+
+
+def _intent_stop_music(query: str) -> None:
+    if not stop_playback():
+        stop_music()
+    else:
+        _speak_and_log("Stopped.")
+
+
+def _intent_next(query: str) -> None:
+    if not next_track():
+        _press_media_key(VK_MEDIA_NEXT_TRACK)
+    _speak_and_log("Next.")
+
+
+def _parse_duration(text: str) -> float | None:
+    """Seconds in "90 seconds", "2 minutes", "1 minute 30" or "1:30"; None if there is no number."""
+    m = re.search(r"(\d+):(\d{1,2})", text)
+    if m:
+        return int(m.group(1)) * 60 + int(m.group(2))
+    total, found = 0.0, False
+    for number, unit in re.findall(r"(\d+(?:\.\d+)?)\s*(minutes?|mins?|seconds?|secs?)?", text):
+        found = True
+        total += float(number) * (60 if unit.startswith("min") else 1)
+    return total if found else None
+
+
+def _intent_seek(query: str) -> None:
+    seconds = _parse_duration(query)
+    absolute = query.startswith(("seek to", "jump to"))
+    if seconds is None:
+        if absolute:
+            _speak_and_log("Where should I jump to?")
+            return
+        seconds = 10
+    if query.startswith(("skip back", "go back", "rewind")):
+        seconds = -seconds
+    if not _AudioPlayer.instance().seek(seconds, relative=not absolute):
+        _speak_and_log("Nothing is playing.")
+
+
+def _intent_now_playing(query: str) -> None:
+    info = _AudioPlayer.instance().now_playing()
+    if info is None:
+        _speak_and_log("Nothing is playing.")
+        return
+    clock = lambda t: f"{int(t) // 60}:{int(t) % 60:02d}"
+    where = f", {clock(info['position'])} of {clock(info['length'])}" if info["length"] else ""
+    more = f", {info['upcoming']} more queued" if info["upcoming"] else ""
+    verb = "Playing" if info["state"] == "playing" else "Paused on"
+    _speak_and_log(f"{verb} {info['title']}{where}{more}.")
+
+
+def _intent_open_youtube(query: str) -> None:
+    wb.open("youtube.com")
+
+
+def _intent_open_google(query: str) -> None:
+    wb.open("https://www.google.com")
+    _speak_and_log("Opening Google")
+
+
+def _intent_open_app(query: str) -> None:
+    # Open application by name or path
+    if query in ("open browser", "open the browser", "open web browser"):
+        _open_default_browser()
+        _speak_and_log("Opening your browser")
+        return
+    target = _strip_command_prefix(query, ("open", "launch")).strip('"')
+    if not target:
+        _speak_and_log("Open what?")
+        return
+    target = _normalize_spoken_path_tokens(target)
+    opened = False
+    # Try common system apps
+    common = {
+        "notepad": "notepad.exe",
+        "calculator": "calc.exe",
+        "paint": "mspaint.exe",
+        "explorer": "explorer.exe",
+        "cmd": "cmd.exe",
+        "powershell": "powershell.exe",
+        "chrome": r"C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe",
+        "edge": r"C:\\Program Files (x86)\\Microsoft\\Edge\\Application\\msedge.exe",
+        "vlc": r"C:\\Program Files\\VideoLAN\\VLC\\vlc.exe",
+        "discord": "discord",
+    }
+    try:
+        tl = target.lower()
+        if tl == "discord":
+            if _open_discord():
+                _speak_and_log("Opening Discord")
+                opened = True
+        # If target is a folder path, open it in Explorer
+        if not opened and os.path.isdir(target):
+            dest = os.path.abspath(target)
+            try:
+                os.startfile(dest)
+            except Exception:
+                pass
+            try:
+                _set_current_dir(dest)
+            except Exception:
+                pass
+            _speak_and_log(f"Opening folder {target}")
+            opened = True
+        if not opened:
+            exe = common.get(tl) or _find_app_executable(target) or target
+            # If it's a .lnk, let shell handle it; otherwise, try to spawn
+            if isinstance(exe, str) and exe.lower().endswith('.lnk'):
+                os.startfile(exe)
+            else:
+                subprocess.Popen(exe if (isinstance(exe, str) and (exe.endswith('.exe') or ' ' in exe)) else [exe], shell=True)
+            _speak_and_log(f"Opening {target}")
+            opened = True
+    except Exception:
+        pass
+    if not opened:
+        # Try to resolve as a folder name by search
+        found_dir = _find_first(CURRENT_DIR, target, want_file=False) or _search_user_common_roots(target, want_file=False)
+        if found_dir and os.path.isdir(found_dir):
+            try:
+                os.startfile(found_dir)
+            except Exception:
+                pass
+            try:
+                _set_current_dir(found_dir)
+            except Exception:
+                pass
+            _speak_and_log(f"Opening folder {os.path.basename(found_dir)}")
+        else:
+            _speak_and_log(f"I couldn't open {target}.")
+
+
+def _intent_create_folder(query: str) -> None:
+    name = _strip_command_prefix(query, ("create folder", "make folder")).strip('"')
+    if not name:
+        _speak_and_log("What should I name the folder?")
+        return
+    path = os.path.abspath(name)
+    if _create_folder(path):
+        _speak_and_log(f"Created folder {name}")
+    else:
+        _speak_and_log(f"I couldn't create folder {name}")
+
+
+def _intent_delete(query: str) -> None:
+    name = _strip_command_prefix(query, ("delete folder", "remove folder", "delete file")).strip('"')
+    if not name:
+        _speak_and_log("What should I delete?")
+        return
+    path = os.path.abspath(name)
+    if _delete_folder(path):
+        _speak_and_log(f"Deleted {name}")
+    else:
+        _speak_and_log(f"I couldn't delete {name}")
+
+
+def _intent_rename(query: str) -> None:
+    # rename <old> to <new>
+    m = re.search(r"rename\s+\"?([^\"]+)\"?\s+to\s+\"?([^\"]+)\"?", query)
+    if m:
+        old, new = m.group(1).strip(), m.group(2).strip()
+        if _rename_item(old, new):
+            _speak_and_log(f"Renamed {old} to {new}")
+        else:
+            _speak_and_log(f"I couldn't rename {old}")
+    else:
+        _speak_and_log("Please say rename <old> to <new>.")
+
+
+def _intent_git_clone(query: str) -> None:
+    url = query.split("git clone", 1)[1].strip()
+    if not url:
+        _speak_and_log("Which repository should I clone?")
+        return
+    if _git_clone(url):
+        _speak_and_log("Repository cloned.")
+    else:
+        _speak_and_log("I couldn't clone that repository.")
+
+
+def _intent_git_push(query: str) -> None:
+    # Try to extract remote URL and commit message; if missing, prompt via UI or console
+    m = re.search(r"(https?://\S+\.git)", query)
+    remote = m.group(1) if m else None
+    msg = None
+    cm = re.search(r"message\s+\"([^\"]+)\"", query)
+    if cm:
+        msg = cm.group(1)
+    if remote is None:
+        # Prompt user
+        if tk is not None and UI.instance is not None:
+            try:
+                # Simple blocking prompt using a tiny dialog
+                import tkinter.simpledialog as sd
+                remote = sd.askstring("Git Remote", "Enter remote URL (ends with .git):")
+            except Exception:
+                remote = None
+        if remote is None:
+            try:
+                remote = input("Enter remote URL (ends with .git): ").strip()
+            except Exception:
+                remote = None
+    if not msg:
+        msg = "update"
+    if not remote:
+        _speak_and_log("I need a remote URL ending with .git to push.")
+    else:
+        if _git_init_commit_push(remote, message=msg):
+            _speak_and_log("Changes committed and pushed to GitHub.")
+        else:
+            _speak_and_log("I couldn't push to GitHub.")
+
+
+def _intent_type(query: str) -> None:
+    # Type text at cursor position
+    text = _strip_command_prefix(query, ("type",))
+    if not text:
+        _speak_and_log("What should I type?")
+        return
+    try:
+        _optional_import('pyautogui').typewrite(text)
+        _speak_and_log("Typed your text.")
+    except Exception:
+        _speak_and_log("I couldn't type that.")
+
+
+def _intent_search(query: str) -> None:
+    # Search the web (default browser)
+    q = _strip_command_prefix(query, ("search",))
+    if not q:
+        _speak_and_log("What should I search for?")
+        return
+    wb.open(f"https://www.google.com/search?q={q}")
+    _speak_and_log(f"Searching for {q}")
+
+
+def _intent_amazon_search(query: str) -> None:
+    # Simple Amazon search helper
+    # Extract following words after 'search' or 'find'
+    kw = query
+    for k in ("search", "find", "for"):
+        if k in query:
+            kw = query.split(k, 1)[1]
+            break
+    kw = kw.replace("on amazon", "").replace("amazon", "").strip()
+    if kw == "for" or kw.startswith("for "):
+        kw = kw[len("for"):].strip()
+    if not kw:
+        _speak_and_log("What should I search for on Amazon?")
+        return
+    kw = urllib.parse.quote_plus(kw)
+    wb.open(f"https://www.amazon.in/s?k={kw}")
+    _speak_and_log("Opening Amazon search")
+
+
+def _intent_youtube_search(query: str) -> None:
+    # YouTube search helper, optionally target Chrome
+    kw = query
+    for k in ("search for", "search", "find"):
+        if k in query:
+            kw = query.split(k, 1)[1]
+            break
+    for noise in ("in google chrome", "in chrome", "on youtube", "youtube"):
+        kw = kw.replace(noise, "")
+    if not kw.strip():
+        _speak_and_log("What should I search for on YouTube?")
+        return
+    kw = urllib.parse.quote_plus(kw.strip())
+    url = f"https://www.youtube.com/results?search_query={kw}"
+    if "in chrome" in query or "in google chrome" in query:
+        _open_in_chrome(url)
+    else:
+        wb.open(url)
+    _speak_and_log("Opening YouTube search")
+
+
+def _intent_open_in_chrome(query: str) -> None:
+    # Generic "in chrome open <site>" handler
+    # Extract a URL-ish token after 'open'/'go to'
+    m = re.search(r"(?:open|go to)\s+([\w\.-]+\.[a-z]{2,})(?:\s|$)", query)
+    if m:
+        host = m.group(1)
+        if not host.startswith("http"):
+            url = f"https://{host}"
+        else:
+            url = host
+        _open_in_chrome(url)
+        _speak_and_log(f"Opening {host} in Chrome")
+    else:
+        _speak_and_log("Please specify a website to open in Chrome")
+
+
+def _intent_go_to_folder(query: str) -> None:
+    # Accept variants like: open folder X, open folder named X, open directory X
+    name = _strip_command_prefix(query, ("go to folder", "cd to", "open folder", "open directory"))
+    if name == "named" or name.startswith("named "):
+        name = name[len("named"):].strip()
+    if not name:
+        _speak_and_log("Which folder?")
+        return
+    name = _normalize_spoken_path_tokens(name)
+    # try absolute, then relative to CURRENT_DIR, then search from CURRENT_DIR
+    candidates = [name, os.path.join(CURRENT_DIR, name)]
+    dest = None
+    for c in candidates:
+        if os.path.isdir(c):
+            dest = c
+            break
+    if dest is None:
+        found = _find_first(CURRENT_DIR, name, want_file=False)
+        if found:
+            dest = found
+    if dest is None:
+        # Search common user roots like Desktop, Documents, Downloads
+        found = _search_user_common_roots(name, want_file=False)
+        if found:
+            dest = found
+    if dest and _set_current_dir(dest):
+        _speak_and_log(f"Moved to {dest}")
+        try:
+            # Also open in Explorer for visual confirmation
+            os.startfile(dest)
+        except Exception:
+            pass
+    else:
+        _speak_and_log(f"I couldn't find folder {name}")
+
+
+def _intent_go_to_and_run(query: str) -> None:
+    # Example: go to C:\\Projects\\myapp and run npm start
+    try:
+        parts = query.replace("go to ", "", 1).split(" and run ", 1)
+        folder = parts[0].strip().strip('"')
+        cmd = parts[1].strip()
+        # Resolve folder
+        resolved = folder
+        if not os.path.isabs(resolved):
+            # try relative to CURRENT_DIR
+            candidate = os.path.join(CURRENT_DIR, resolved)
+            if os.path.isdir(candidate):
+                resolved = candidate
+        if not os.path.isdir(resolved):
+            found = _find_first(CURRENT_DIR, folder, want_file=False)
+            if not found:
+                found = _search_user_common_roots(folder, want_file=False)
+            if found:
+                resolved = found
+        if os.path.isdir(resolved):
+            if _run_shell_string(cmd, cwd=resolved):
+                _speak_and_log(f"Running {cmd} in {resolved}")
+            else:
+                _speak_and_log("I couldn't run that command.")
+        else:
+            _speak_and_log(f"I couldn't find folder {folder}")
+    except Exception:
+        _speak_and_log("Please say: go to <folder> and run <command>.")
+
+
+def _intent_in_that_open(query: str) -> None:
+    # Example: in that open logs, in that go to src
+    name = _strip_command_prefix(query, ("in that open", "in that go to")).strip('"')
+    if not name:
+        _speak_and_log("Which folder?")
+        return
+    dest = _resolve_name_to_path(name, want_file=False)
+    if dest and _set_current_dir(dest):
+        try:
+            os.startfile(dest)
+        except Exception:
+            pass
+        _speak_and_log(f"Opened folder {os.path.basename(dest)}")
+    else:
+        _speak_and_log(f"I couldn't find folder {name}")
+
+
+def _intent_in_that_run(query: str) -> None:
+    # Example: in that run npm start, in that run python app.py
+    cmd = _strip_command_prefix(query, ("in that run", "in that execute"))
+    if not cmd:
+        _speak_and_log("What should I run there?")
+        return
+    if _run_shell_string(cmd, cwd=CURRENT_DIR):
+        _speak_and_log(f"Running {cmd}")
+    else:
+        _speak_and_log("I couldn't run that command.")
+
+
+def _intent_in_that_open_file(query: str) -> None:
+    # Example: in that open file app.py
+    name = _strip_command_prefix(query, ("in that open file", "in that find file")).strip('"')
+    if not name:
+        _speak_and_log("Which file should I open?")
+        return
+    fp = _resolve_name_to_path(name, want_file=True)
+    if fp and os.path.isfile(fp):
+        try:
+            os.startfile(fp)
+            _speak_and_log(f"Opened {os.path.basename(fp)}")
+        except Exception:
+            _speak_and_log("I found it but could not open the file.")
+    else:
+        _speak_and_log(f"I couldn't find {name}")
+
+
+def _intent_run(query: str) -> None:
+    # Run arbitrary command in CURRENT_DIR
+    cmd = _strip_command_prefix(query, ("run", "execute"))
+    if not cmd:
+        _speak_and_log("What should I run?")
+        return
+    if _run_shell_string(cmd, cwd=CURRENT_DIR):
+        _speak_and_log(f"Running {cmd}")
+    else:
+        _speak_and_log("I couldn't run that command.")
+
+
+def _intent_open_file(query: str) -> None:
+    # Support: open file X, open file named X, find file X
+    name = _strip_command_prefix(query, ("open file named", "open file", "find file"))
+    if not name:
+        _speak_and_log("Which file should I open?")
+        return
+    name = _normalize_spoken_path_tokens(name)
+    # First: try exact/partial match in CURRENT_DIR
+    found = _find_first(CURRENT_DIR, name, want_file=True)
+    # If user says 'in my pc', search common user folders too
+    if (not found) and (" in my pc" in query or " in my pc." in query):
+        found = _search_user_common_roots(name, want_file=True)
+    if found:
+        try:
+            os.startfile(found)
+            _speak_and_log(f"Opened {os.path.basename(found)}")
+        except Exception:
+            _speak_and_log("I found it but could not open the file.")
+    else:
+        _speak_and_log(f"I couldn't find {name}")
+
+
+def _intent_npm_install(query: str) -> None:
+    if _run_project_command("install", cwd=CURRENT_DIR) or _run_command(["npm", "install"], cwd=CURRENT_DIR):
+        _speak_and_log("Running install in this project")
+    else:
+        _speak_and_log("I couldn't run install here")
+
+
+def _intent_npm_start(query: str) -> None:
+    if _run_project_command("start", cwd=CURRENT_DIR) or _run_command(["npm", "start"], cwd=CURRENT_DIR):
+        _speak_and_log("Starting the app")
+    else:
+        _speak_and_log("I couldn't start the app here")
+
+
+def _intent_makemigrations(query: str) -> None:
+    if _run_project_command("makemigrations", cwd=CURRENT_DIR):
+        _speak_and_log("Running makemigrations")
+    else:
+        _speak_and_log("I couldn't run makemigrations here")
+
+
+def _intent_migrate(query: str) -> None:
+    if _run_project_command("migrate", cwd=CURRENT_DIR):
+        _speak_and_log("Running migrate")
+    else:
+        _speak_and_log("I couldn't run migrate here")
+
+
+def _pwd_reply(query: str) -> str:
+    return f"You are in {CURRENT_DIR}"
+
+
+def _intent_list_files(query: str) -> None:
+    try:
+        items = os.listdir(CURRENT_DIR)
+        if not items:
+            _speak_and_log("This folder is empty.")
+        else:
+            preview = ", ".join(items[:20])
+            _speak_and_log(f"Files here: {preview}")
+    except Exception:
+        _speak_and_log("I couldn't list the files here.")
+
+
+def _intent_set_name(query: str) -> None:
+    set_name()
+
+
+def _intent_list_voices(query: str) -> None:
+    list_voices()
+
+
+def _intent_set_voice(query: str) -> None:
+    set_voice_from_query(query)
+
+
+def _intent_voice_index(index: int):
+    def _handler(query: str) -> None:
+        set_voice_by_index(index)
+        _speak_and_log(f"Voice set to {index + 1}")
+    return _handler
+
+
+def _intent_system_voice(query: str) -> None:
+    enable_system_voice()
+    _speak_and_log("System voice enabled")
+
+
+def _intent_engine_voice(query: str) -> None:
+    enable_engine_voice()
+    _speak_and_log("Engine voice enabled")
+
+
+def _intent_screenshot(query: str) -> None:
+    screenshot()
+    speak("I've taken screenshot, please check it")
+
+
+def _intent_joke(query: str) -> None:
+    joke = _optional_import('pyjokes').get_joke()
+    speak(joke)
+    print(joke)
+    try:
+        if UI.instance is not None:
+            UI.instance.log_assistant(joke)
+    except Exception:
+        pass
+
+
+def _intent_cache_stats(query: str) -> None:
+    s = llm_cache.stats()
+    _speak_and_log(f"Answer cache: {s['entries']} entries, {s['hits']} hits "
+                   f"({s['near_hits']} near matches), {s['misses']} misses, {s['evictions']} evictions.")
+    if audio_cache.enabled:
+        a = audio_cache.stats()
+        _speak_and_log(f"Audio cache: {a['tracks']} tracks, {a['bytes'] / (1 << 20):.0f} of "
+                       f"{a['max_bytes'] / (1 << 20):.0f} MB, hit ratio {a['hit_ratio']:.0%} "
+                       f"({a['hits']} hits, {a['misses']} misses), {a['evictions']} evictions.")
+
+
+def _intent_rescan_music(query: str) -> None:
+    music_library.rescan()
+    _speak_and_log("Updating the music library in the background.")
+
+
+def _intent_latency_stats(query: str) -> None:
+    stats = tracer.stats()
+    if not stats:
+        _speak_and_log("I haven't timed any commands yet.")
+        return
+    lines = [f"{stage}: p50 {row['p50']:.0f} ms, p95 {row['p95']:.0f} ms, p99 {row['p99']:.0f} ms "
+             f"({row['count']} samples)" for stage, row in stats.items()]
+    print("\n".join(lines))
+    try:
+        if UI.instance is not None:
+            for line in lines:
+                UI.instance.log("System", line)
+    except Exception:
+        pass
+    stages = [stage for stage in stats if stage != "total"]
+    message = ""
+    if "total" in stats:
+        message = f"A command typically takes {stats['total']['p50']:.0f} milliseconds end to end. "
+    if stages:
+        slowest = max(stages, key=lambda stage: stats[stage]['p95'])
+        message += (f"The slowest stage is {slowest.replace('_', ' ')}, "
+                    f"at {stats[slowest]['p95']:.0f} milliseconds for the 95th percentile. ")
+    speak(message + "The full table is in the transcript.")
+
+
+def _intent_provider_stats(query: str) -> None:
+    parts = []
+    for row in llm_router.stats():
+        latency = row['first_token_p50'] if row['first_token_p50'] is not None else row['complete_p50']
+        timing = f"typically {latency * 1000:.0f} milliseconds" if latency is not None else "no timings yet"
+        parts.append(f"{row['provider']}: {row['error_rate'] * 100:.0f} percent errors, {timing}")
+    if not parts:
+        _speak_and_log("No language model provider is configured.")
+        return
+    _speak_and_log("; ".join(parts) + f". Hedged {llm_router.hedged} and failed over {llm_router.failovers} times.")
+
+
+def _intent_forget_conversation(query: str) -> None:
+    conversation.clear()
+    _speak_and_log("Okay, starting a new conversation.")
+
+
+def _intent_train_wake_word(query: str) -> None:
+    if not audio_stream.start():
+        _speak_and_log("I couldn't access the microphone.")
+        return
+    enroll = getattr(wake_detector, 'enroll', None)
+    if enroll is None:
+        _speak_and_log("The offline wake word detector is turned off.")
+        return
+    saved = 0
+    for _ in range(3):
+        speak("Please say Jarvis.")
+        tts.wait_idle(10)
+        audio, _ = audio_stream.capture_phrase(timeout=5, phrase_limit=2, pause=0.4)
+        if audio is not None and enroll(audio):
+            saved += 1
+    _speak_and_log(f"Saved {saved} wake word samples." if saved else "I didn't hear anything. Please try again.")
+
+
+def _hear_me_reply(query: str) -> str:
+    return "Yes, I can hear you clearly."
+
+
+def _model_reply(query: str) -> str:
+    return f"I am using model {_current_model_label()}."
+
+
+def _intent_audio_test(query: str) -> None:
+    _speak_and_log("This is a voice test. If you can hear me, audio is working.")
+
+
+def _intent_empathy(query: str) -> None:
+    msg = _empathetic_response(query)
+    if not msg:
+        msg = "I'm here with you. Thanks for sharing that with me—how can I support you right now?"
+    _speak_and_log(msg)
+
+
+def _intent_stop_speaking(query: str) -> None:
+    stop_speaking()
+    _speak_and_log("Stopped speaking.")
+
 
-    This uses `shell=True` to allow compound commands and builtins.
-    """
-    try:
-        if not command_str or not command_str.strip():
-            return False
-        subprocess.Popen(command_str, cwd=cwd or CURRENT_DIR, shell=True)
-        return True
-    except Exception:
-        return False
+def _intent_enable_startup(query: str) -> None:
+    if register_startup():
+        speak("I will start automatically when you log in.")
+    else:
+        speak("I could not enable startup on this system.")
 
 
-def _resolve_name_to_path(name: str, want_file: bool) -> str | None:
-    """Resolve a spoken name to a file or folder path, searching CURRENT_DIR and user roots."""
-    name = _normalize_spoken_path_tokens(name)
-    # Try absolute or relative direct
-    for cand in (name, os.path.join(CURRENT_DIR, name)):
-        try:
-            if want_file and os.path.isfile(cand):
-                return os.path.abspath(cand)
-            if not want_file and os.path.isdir(cand):
-                return os.path.abspath(cand)
-        except Exception:
-            pass
-    # Search trees
-    found = _find_first(CURRENT_DIR, name, want_file=want_file) or _search_user_common_roots(name, want_file=want_file)
-    return found
+def _intent_disable_startup(query: str) -> None:
+    if unregister_startup():
+        speak("I will not start automatically anymore.")
+    else:
+        speak("Startup entry was not found.")
 
 
-def _normalize_spoken_path_tokens(text: str) -> str:
-    """Convert spoken tokens like 'underscore' -> '_', 'slash' -> '\\', 'space' -> ' '."""
-    try:
-        t = " " + (text or "") + " "
-        # Replace common spoken separators
-        replacements = [
-            (" underscore ", "_"),
-            (" dash ", "-"),
-            (" hyphen ", "-"),
-            (" dot ", "."),
-            (" period ", "."),
-            (" space ", " "),
-            (" backslash ", "\\"),
-            (" slash ", "\\"),  # favor Windows path
-            (" forward slash ", "\\"),
-        ]
-        for k, v in replacements:
-            t = t.replace(k, v)
-        # Collapse extra spaces around separators
-        t = t.strip().strip('"').strip()
-        return t
-    except Exception:
-        return (text or "").strip().strip('"')
+def _intent_shutdown(query: str) -> bool:
+    speak("Shutting down the system, goodbye!")
+    os.system("shutdown /s /f /t 1")
+    return False
 
 
-def _select_llm_provider():
-    """Return a tuple (provider, client_or_model_callable, model_name) based on env vars.
-    Provider is one of: 'openai', 'gemini', 'anthropic', or None if unavailable.
-    """
-    preferred = (os.environ.get('LLM_PROVIDER') or DEFAULT_LLM_PROVIDER).lower().strip()
+def _intent_restart(query: str) -> bool:
+    speak("Restarting the system, please wait!")
+    os.system("shutdown /r /f /t 1")
+    return False
 
-    # OpenRouter (uses OpenAI SDK)
-    if (preferred in ('openrouter', 'open-router', 'router')) and OpenAI is not None and ((os.environ.get('OPENROUTER_API_KEY') or DEFAULT_OPENROUTER_API_KEY)):
-        try:
-            base_url = os.environ.get('OPENROUTER_BASE_URL', DEFAULT_OPENROUTER_BASE)
-            api_key = os.environ.get('OPENROUTER_API_KEY', DEFAULT_OPENROUTER_API_KEY)
-            client = OpenAI(api_key=api_key, base_url=base_url)
-            model = os.environ.get('OPENROUTER_MODEL', DEFAULT_OPENROUTER_MODEL)
-            return 'openrouter', client, model
-        except Exception:
-            pass
 
-    # OpenAI
-    if (preferred in ('', 'openai')) and OpenAI is not None and os.environ.get('OPENAI_API_KEY'):
-        try:
-            client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
-            model = os.environ.get('OPENAI_MODEL', 'gpt-4o-mini')
-            return 'openai', client, model
-        except Exception:
-            pass
+def _intent_exit(query: str) -> bool:
+    speak("Going offline. Have a good day!")
+    return False
 
-    # Gemini
-    if (preferred in ('', 'gemini', 'google')) and genai is not None and os.environ.get('GOOGLE_API_KEY'):
-        try:
-            genai.configure(api_key=os.environ.get('GOOGLE_API_KEY'))
-            model = os.environ.get('GEMINI_MODEL', 'gemini-1.5-flash')
-            gm = genai.GenerativeModel(model)
-            return 'gemini', gm, model
-        except Exception:
-            pass
 
-    # Anthropic
-    if (preferred in ('', 'anthropic', 'claude', 'xai')) and anthropic is not None and os.environ.get('ANTHROPIC_API_KEY'):
-        try:
-            client = anthropic.Anthropic(api_key=os.environ.get('ANTHROPIC_API_KEY'))
-            model = os.environ.get('ANTHROPIC_MODEL', 'claude-3.5-sonnet')
-            return 'anthropic', client, model
-        except Exception:
-            pass
+def _intent_llm_fallback(query: str) -> None:
+    # Fallback to LLM for general queries, with the earlier exchanges for follow-ups
+    system_prompt, history = conversation.context(query)
+    if LLM_STREAMING:
+        conversation.add(query, _speak_streamed_reply(query, system_prompt, history))
+        return
+    reply = llm_generate_response(query, system_prompt, history)
+    if not reply:
+        reply = "Sorry, I don't have an answer for that yet."
+    elif not reply.startswith("I can hear you"):
+        conversation.add(query, reply)
+    speak(reply)
+    try:
+        if UI.instance is not None:
+            UI.instance.log_assistant(reply)
+    except Exception:
+        pass
 
-    return None, None, None
 
+_EMPATHY_TRIGGERS = (
+    "how are you", "bad day", "feeling down", "i feel bad", "i'm tired", "i am tired", "sad", "upset",
+    "lonely", "stressed", "anxious", "depressed", "not okay", "burned out", "heartbroken", "i'm angry", "i am angry",
+)
 
-def llm_generate_response(prompt: str, system_prompt: str = "You are a helpful desktop assistant.") -> str:
-    provider, client, model = _select_llm_provider()
-    if not provider:
-        return "I can hear you. For open-ended questions, add API keys to enable smart answers."
-    try:
-        if provider in ('openai', 'openrouter'):
-            extra_headers = None
-            if provider == 'openrouter':
-                referer = os.environ.get('OPENROUTER_SITE_URL', '')
-                title = os.environ.get('OPENROUTER_SITE_NAME', '')
-                extra_headers = {"HTTP-Referer": referer, "X-Title": title}
-            resp = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.3,
-                max_tokens=256,
-                extra_headers=extra_headers,
-            )
-            return (resp.choices[0].message.content or "").strip()
-        if provider == 'gemini':
-            # google-generativeai
-            full_prompt = f"{system_prompt}\n\nUser: {prompt}"
-            resp = client.generate_content(full_prompt)
-            return (getattr(resp, 'text', None) or "").strip()
-        if provider == 'anthropic':
-            resp = client.messages.create(
-                model=model,
-                max_tokens=256,
-                temperature=0.3,
-                system=system_prompt,
-                messages=[{"role": "user", "content": prompt}],
-            )
-            # Anthropic returns a list of content blocks; concatenate text parts
-            parts = []
-            for b in getattr(resp, 'content', []) or []:
-                t = getattr(b, 'text', None)
-                if t:
-                    parts.append(t)
-            return ("\n".join(parts)).strip() or ""
-    except Exception as e:
-        return f"I can hear you, but I couldn't contact the model: {e}"
-    return ""
+
+def _register_builtin_intents(router: IntentRouter) -> None:
+    """Register the built-in commands.
+
+    Commands that take free text (paths, song names, shell commands) outrank
+    bare keywords so that e.g. "play song time after time" plays a song instead
+    of announcing the time; more specific prefixes outrank the generic ones
+    they share words with ("open file" over "open", "in that open file" over
+    "in that open", "always play online" over "play online").
+    """
+    r = router.register
+    # Settings that reuse the words of other commands
+    r("play_online_default", _intent_play_online_default, keywords=("always play online", "play online by default"), priority=95)
+    r("play_local_default", _intent_play_local_default, keywords=("play locally", "don't play online", "do not play online"), priority=95)
+    # Specific prefixes
+    r("in_that_open_file", _intent_in_that_open_file, prefixes=("in that open file", "in that find file"), priority=92)
+    r("open_file", _intent_open_file, prefixes=("find file", "open file", "open file named"), priority=92)
+    r("open_youtube", _intent_open_youtube, keywords=("open youtube",), priority=91)
+    r("open_google", _intent_open_google, keywords=("open google",), priority=91)
+    r("go_to_folder", _intent_go_to_folder, prefixes=("go to folder", "cd to", "open folder", "open directory"), priority=90)
+    r("go_to_and_run", _intent_go_to_and_run, pattern=r"^go to .+ and run ", priority=89)
+    r("in_that_open", _intent_in_that_open, prefixes=("in that open", "in that go to"), priority=88)
+    r("in_that_run", _intent_in_that_run, prefixes=("in that run", "in that execute"), priority=88)
+    r("amazon_search", _intent_amazon_search, keywords=("amazon",), requires=[("search", "find")], priority=87)
+    r("youtube_search", _intent_youtube_search, keywords=("youtube",), requires=[("search", "find", "in chrome")], priority=87)
+    r("open_in_chrome", _intent_open_in_chrome, keywords=("in chrome", "in google chrome"), requires=[("open", "go to")], priority=87)
+    r("wikipedia", _intent_wikipedia, keywords=("wikipedia",), priority=86)
+    r("play_radio", _intent_play_radio, prefixes=("play radio", "play album", "play playlist"), priority=86)
+    r("queue", _intent_queue, prefixes=("queue song", "queue track", "add to queue", "add to the queue", "queue"), priority=85)
+    r("play", _intent_play, keywords=("play music", "play online", "play on web", "play from web"), prefixes=("play song", "play track"), priority=85)
+    r("create_folder", _intent_create_folder, prefixes=("create folder", "make folder"), priority=85)
+    r("delete", _intent_delete, prefixes=("delete folder", "remove folder", "delete file"), priority=85)
+    r("rename", _intent_rename, prefixes=("rename",), priority=85)
+    r("git_clone", _intent_git_clone, prefixes=("git clone",), priority=85)
+    r("git_push", _intent_git_push, prefixes=("push to github", "git push", "commit and push"), priority=85)
+    r("type", _intent_type, prefixes=("type",), priority=85)
+    r("search", _intent_search, prefixes=("search",), priority=85)
+    r("npm_install", _intent_npm_install, prefixes=("npm install", "install npm"), priority=84)
+    r("npm_start", _intent_npm_start, keywords=("run the app", "start the app"), prefixes=("npm start",), priority=84)
+    r("run", _intent_run, prefixes=("run", "execute"), priority=83)
+    r("open_app", _intent_open_app, prefixes=("open", "launch"), exact=("open browser", "open the browser", "open web browser"), priority=80)
+    # Bare keywords
+    # The exact forms of the usual questions let capture end without waiting for trailing silence
+    r("time", None, reply=_time_reply, keywords=("time",),
+      exact=("what time is it", "what's the time", "what is the time", "tell me the time"), priority=60)
+    r("date", None, reply=_date_reply, keywords=("date",),
+      exact=("what is the date", "what's the date", "what is today's date", "what's today's date"), priority=59)
+    r("pause", _intent_pause, keywords=("pause music", "pause song"), exact=("pause",), priority=57, speculative=True)
+    r("resume", _intent_resume, keywords=("resume music", "continue music"), exact=("resume",), priority=57, speculative=True)
+    r("stop_music", _intent_stop_music, keywords=("stop music", "stop song"), exact=("stop",), priority=57, speculative=True)
+    r("next", _intent_next, keywords=("next song",), exact=("next", "next song", "next track"), priority=57,
+      speculative=True)
+    r("seek", _intent_seek, prefixes=("seek to", "jump to", "skip forward", "skip ahead", "skip back", "go back",
+                                      "rewind", "fast forward"), priority=57)
+    r("now_playing", _intent_now_playing,
+      keywords=("what's playing", "what is playing", "what song is this", "what's this song"), priority=57)
+    r("makemigrations", _intent_makemigrations, keywords=("make migrations", "makemigrations"), priority=53)
+    r("migrate", _intent_migrate, keywords=("migrate",), priority=52)
+    r("pwd", None, reply=_pwd_reply, keywords=("what is my current folder", "current folder"), exact=("pwd",), priority=51)
+    r("list_files", _intent_list_files, prefixes=("list files", "show files"), exact=("ls",), priority=51)
+    r("set_name", _intent_set_name, keywords=("change your name",), priority=50)
+    r("list_voices", _intent_list_voices, keywords=("list voices", "what voices"), priority=50)
+    r("set_voice", _intent_set_voice, keywords=("change voice", "set voice"), priority=50)
+    r("voice_one", _intent_voice_index(0), keywords=("use voice one", "voice one"), priority=49)
+    r("voice_two", _intent_voice_index(1), keywords=("use voice two", "voice two"), priority=49)
+    r("voice_three", _intent_voice_index(2), keywords=("use voice three", "voice three"), priority=49)
+    r("system_voice", _intent_system_voice, keywords=("use system voice", "force system voice"), priority=48)
+    r("engine_voice", _intent_engine_voice, keywords=("use engine voice", "disable system voice"), priority=48)
+    r("screenshot", _intent_screenshot, keywords=("screenshot",), priority=45)
+    r("joke", _intent_joke, keywords=("tell me a joke",), priority=45)
+    r("hear_me", None, reply=_hear_me_reply, keywords=("can you hear me", "are you there"),
+      exact=("can you hear me", "are you there"), priority=45)
+    r("train_wake_word", _intent_train_wake_word, keywords=("train wake word", "train the wake word"), priority=45)
+    r("cache_stats", _intent_cache_stats, keywords=("cache stats", "cache statistics"), priority=45)
+    r("rescan_music", _intent_rescan_music,
+      keywords=("rescan music", "update music library", "refresh music library"), priority=45)
+    r("latency_stats", _intent_latency_stats,
+      keywords=("latency stats", "latency statistics", "timing stats", "show latency"), priority=45)
+    r("provider_stats", _intent_provider_stats, keywords=("provider stats", "provider statistics"), priority=45)
+    r("forget_conversation", _intent_forget_conversation,
+      keywords=("new conversation", "forget our conversation", "forget this conversation", "clear conversation"),
+      priority=45)
+    r("model", None, reply=_model_reply, keywords=("which model are you", "what model are you"), priority=45)
+    r("audio_test", _intent_audio_test, keywords=("audio test", "test audio"), priority=45)
+    r("empathy", _intent_empathy, keywords=_EMPATHY_TRIGGERS, priority=30)
+    r("stop_speaking", _intent_stop_speaking, keywords=("stop speaking", "stop voice", "be quiet", "mute"), priority=29)
+    r("enable_startup", _intent_enable_startup, keywords=("enable startup", "start on startup"), priority=20)
+    r("disable_startup", _intent_disable_startup, keywords=("disable startup", "stop startup"), priority=20)
+    # Never in the constrained grammar: noise must not be forced into these
+    r("shutdown", _intent_shutdown, keywords=("shutdown",), priority=15, grammar=False)
+    r("restart", _intent_restart, keywords=("restart",), priority=15, grammar=False)
+    r("exit", _intent_exit, keywords=("offline", "exit", "quit"), priority=10, grammar=False)
+    router.set_fallback(_intent_llm_fallback)
+
+
+_register_builtin_intents(intent_router)
+intent_router.set_responder(_speak_and_log, prepare=lambda text: tts.prepare(text))
+
+
+def _strip_wake_word(query: str) -> str:
+    # Normalize common wake phrases
+    for wake in ("hey jarvis", "ok jarvis", "okay jarvis", "jarvis"):
+        if query.startswith(wake):
+            return query[len(wake):].strip(" ,.")
+    return query
+
+
+def _speculate_partial(text: str, session=None) -> bool:
+    """Partial transcript callback: pre-resolve the command; True if capture can end now."""
+    query = _strip_wake_word((text or "").lower().strip())
+    return bool(query) and intent_router.speculate(query, session)
 
 
 def _handle_query(query: str) -> bool:
-    global PLAY_ON_WEB_BY_DEFAULT
+    """Handle a single recognized query. Return True to continue loop, False to exit."""
     # Wake-word handling: "jarvis" acknowledges and optionally strips the name
     if "jarvis" in query:
-        cleaned = query
-        # Normalize common wake phrases
-        for wake in ("hey jarvis", "ok jarvis", "okay jarvis", "jarvis"):
-            if cleaned.startswith(wake):
-                cleaned = cleaned[len(wake):].strip(" ,.")
-                break
+        cleaned = _strip_wake_word(query)
         if not cleaned:
             _natural_ack("Yes, I'm listening.")
             return True
         _natural_ack("Sure")
         query = cleaned
 
-    """Handle a single recognized query. Return True to continue loop, False to exit."""
     if not query:
         return True
+    return intent_router.dispatch(query)
 
-    if "time" in query:
-        time_announce()
-    elif "date" in query:
-        date_announce()
-    elif "wikipedia" in query:
-        q = query.replace("wikipedia", "").strip()
-        if q:
-            search_wikipedia(q)
-        else:
-            speak("What should I search on Wikipedia?")
-    elif "play music" in query or query.startswith("play song ") or query.startswith("play track ") or "play online" in query or "play on web" in query or "play from web" in query:
-        song_name = query
-        for k in ("play music", "play song", "play track"):
-            if k in query:
-                song_name = query.split(k, 1)[1]
-        song_name = song_name.strip()
-        wants_online = PLAY_ON_WEB_BY_DEFAULT or any(x in query for x in ("play online", "play on web", "play from web", "online"))
-        if wants_online:
-            if _play_online_background(song_name or "music"):
-                pass
-            elif _play_from_web(song_name or "music"):
-                _speak_and_log("Playing on the web")
-            else:
-                _speak_and_log("I couldn't play that online.")
-        else:
-            play_music(song_name)
-    elif "always play online" in query or "play online by default" in query:
-        PLAY_ON_WEB_BY_DEFAULT = True
-        _speak_and_log("Okay, I will play music online by default.")
-    elif "play locally" in query or "don't play online" in query or "do not play online" in query:
-        PLAY_ON_WEB_BY_DEFAULT = False
-        _speak_and_log("Okay, I will play music locally by default.")
-    elif "pause music" in query or "pause song" in query or query.strip() == "pause":
-        if not pause_online():
-            pause_music()
-        else:
-            _speak_and_log("Paused.")
-    elif "resume music" in query or "continue music" in query or query.strip() == "resume":
-        if not resume_online():
-            resume_music()
-        else:
-            _speak_and_log("Resumed.")
-    elif "stop music" in query or "stop song" in query or query.strip() == "stop":
-        if not stop_online():
-            stop_music()
-        else:
-            _speak_and_log("Stopped.")
-    elif "next song" in query or query.strip() == "next":
-        if not next_online():
-            _press_media_key(VK_MEDIA_NEXT_TRACK)
-        _speak_and_log("Next.")
-    elif "open youtube" in query:
-        wb.open("youtube.com")
-    elif "open google" in query:
-        wb.open("https://www.google.com")
-        _speak_and_log("Opening Google")
-    elif ((query.startswith("open ") and not (query.startswith("open folder ") or query.startswith("open folder named ") or query.startswith("open directory ") or query.startswith("open directory named "))) or
-          query.startswith("launch ") or
-          query in ("open browser", "open the browser", "open web browser")):
-        # Open application by name or path
-        if query in ("open browser", "open the browser", "open web browser"):
-            _open_default_browser()
-            _speak_and_log("Opening your browser")
-            return True
-        target = query.replace("open ", "", 1).replace("launch ", "", 1).strip().strip('"')
-        target = _normalize_spoken_path_tokens(target)
-        opened = False
-        # Try common system apps
-        common = {
-            "notepad": "notepad.exe",
-            "calculator": "calc.exe",
-            "paint": "mspaint.exe",
-            "explorer": "explorer.exe",
-            "cmd": "cmd.exe",
-            "powershell": "powershell.exe",
-            "chrome": r"C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe",
-            "edge": r"C:\\Program Files (x86)\\Microsoft\\Edge\\Application\\msedge.exe",
-            "vlc": r"C:\\Program Files\\VideoLAN\\VLC\\vlc.exe",
-            "discord": "discord",
-        }
-        try:
-            tl = target.lower()
-            if tl == "discord":
-                if _open_discord():
-                    _speak_and_log("Opening Discord")
-                    opened = True
-            # If target is a folder path, open it in Explorer
-            if not opened and os.path.isdir(target):
-                dest = os.path.abspath(target)
-                try:
-                    os.startfile(dest)
-                except Exception:
-                    pass
-                try:
-                    _set_current_dir(dest)
-                except Exception:
-                    pass
-                _speak_and_log(f"Opening folder {target}")
-                opened = True
-            if not opened:
-                exe = common.get(tl) or _find_app_executable(target) or target
-                # If it's a .lnk, let shell handle it; otherwise, try to spawn
-                if isinstance(exe, str) and exe.lower().endswith('.lnk'):
-                    os.startfile(exe)
-                else:
-                    subprocess.Popen(exe if (isinstance(exe, str) and (exe.endswith('.exe') or ' ' in exe)) else [exe], shell=True)
-                _speak_and_log(f"Opening {target}")
-                opened = True
-        except Exception:
-            pass
-        if not opened:
-            # Try to resolve as a folder name by search
-            found_dir = _find_first(CURRENT_DIR, target, want_file=False) or _search_user_common_roots(target, want_file=False)
-            if found_dir and os.path.isdir(found_dir):
-                try:
-                    os.startfile(found_dir)
-                except Exception:
-                    pass
-                try:
-                    _set_current_dir(found_dir)
-                except Exception:
-                    pass
-                _speak_and_log(f"Opening folder {os.path.basename(found_dir)}")
-            else:
-                _speak_and_log(f"I couldn't open {target}.")
-    elif query.startswith("create folder ") or query.startswith("make folder "):
-        name = query.split("folder", 1)[1].strip().strip('"')
-        path = os.path.abspath(name)
-        if _create_folder(path):
-            _speak_and_log(f"Created folder {name}")
-        else:
-            _speak_and_log(f"I couldn't create folder {name}")
-    elif query.startswith("delete folder ") or query.startswith("remove folder ") or query.startswith("delete file "):
-        name = query.split(" ", 2)[2].strip().strip('"')
-        path = os.path.abspath(name)
-        if _delete_folder(path):
-            _speak_and_log(f"Deleted {name}")
-        else:
-            _speak_and_log(f"I couldn't delete {name}")
-    elif query.startswith("rename "):
-        # rename <old> to <new>
-        m = re.search(r"rename\s+\"?([^\"]+)\"?\s+to\s+\"?([^\"]+)\"?", query)
-        if m:
-            old, new = m.group(1).strip(), m.group(2).strip()
-            if _rename_item(old, new):
-                _speak_and_log(f"Renamed {old} to {new}")
-            else:
-                _speak_and_log(f"I couldn't rename {old}")
-        else:
-            _speak_and_log("Please say rename <old> to <new>.")
-    elif query.startswith("git clone "):
-        url = query.split("git clone", 1)[1].strip()
-        if _git_clone(url):
-            _speak_and_log("Repository cloned.")
-        else:
-            _speak_and_log("I couldn't clone that repository.")
-    elif query.startswith("push to github") or query.startswith("git push") or query.startswith("commit and push"):
-        # Try to extract remote URL and commit message; if missing, prompt via UI or console
-        m = re.search(r"(https?://\S+\.git)", query)
-        remote = m.group(1) if m else None
-        msg = None
-        cm = re.search(r"message\s+\"([^\"]+)\"", query)
-        if cm:
-            msg = cm.group(1)
-        if remote is None:
-            # Prompt user
-            if tk is not None and UI.instance is not None:
-                try:
-                    # Simple blocking prompt using a tiny dialog
-                    import tkinter.simpledialog as sd
-                    remote = sd.askstring("Git Remote", "Enter remote URL (ends with .git):")
-                except Exception:
-                    remote = None
-            if remote is None:
-                try:
-                    remote = input("Enter remote URL (ends with .git): ").strip()
-                except Exception:
-                    remote = None
-        if not msg:
-            msg = "update"
-        if not remote:
-            _speak_and_log("I need a remote URL ending with .git to push.")
-        else:
-            if _git_init_commit_push(remote, message=msg):
-                _speak_and_log("Changes committed and pushed to GitHub.")
-            else:
-                _speak_and_log("I couldn't push to GitHub.")
-    elif query.startswith("type "):
-        # Type text at cursor position
-        text = query.replace("type ", "", 1)
-        try:
-            pyautogui.typewrite(text)
-            _speak_and_log("Typed your text.")
-        except Exception:
-            _speak_and_log("I couldn't type that.")
-    elif query.startswith("search "):
-        # Search the web (default browser)
-        q = query.replace("search ", "", 1)
-        wb.open(f"https://www.google.com/search?q={q}")
-        _speak_and_log(f"Searching for {q}")
-    elif "amazon" in query and ("search" in query or "find" in query):
-        # Simple Amazon search helper
-        import urllib.parse as _u
-        # Extract following words after 'search' or 'find'
-        kw = query
-        for k in ("search", "find", "for"):
-            if k in query:
-                kw = query.split(k, 1)[1]
-                break
-        kw = _u.quote_plus(kw.strip())
-        wb.open(f"https://www.amazon.in/s?k={kw}")
-        _speak_and_log("Opening Amazon search")
-    elif ("youtube" in query and ("search" in query or "find" in query)) or ("in chrome" in query and "youtube" in query):
-        # YouTube search helper, optionally target Chrome
-        import urllib.parse as _u
-        kw = query
-        for k in ("search for", "search", "find"):
-            if k in query:
-                kw = query.split(k, 1)[1]
-                break
-        kw = _u.quote_plus(kw.strip())
-        url = f"https://www.youtube.com/results?search_query={kw}"
-        if "in chrome" in query or "in google chrome" in query:
-            _open_in_chrome(url)
-        else:
-            wb.open(url)
-        _speak_and_log("Opening YouTube search")
-    elif ("in chrome" in query or "in google chrome" in query) and ("open" in query or "go to" in query):
-        # Generic "in chrome open <site>" handler
-        # Extract a URL-ish token after 'open'/'go to'
-        m = re.search(r"(?:open|go to)\s+([\w\.-]+\.[a-z]{2,})(?:\s|$)", query)
-        if m:
-            host = m.group(1)
-            if not host.startswith("http"):
-                url = f"https://{host}"
-            else:
-                url = host
-            _open_in_chrome(url)
-            _speak_and_log(f"Opening {host} in Chrome")
-        else:
-            _speak_and_log("Please specify a website to open in Chrome")
-    elif query.startswith("go to folder ") or query.startswith("cd to ") or query.startswith("open folder ") or query.startswith("open folder named "):
-        # Accept variants like: open folder X, open folder named X
-        if query.startswith("open folder named "):
-            name = query.replace("open folder named ", "", 1).strip()
-        else:
-            name = query.split(" ", 2)[2].strip()
-        name = _normalize_spoken_path_tokens(name)
-        # try absolute, then relative to CURRENT_DIR, then search from CURRENT_DIR
-        candidates = [name, os.path.join(CURRENT_DIR, name)]
-        dest = None
-        for c in candidates:
-            if os.path.isdir(c):
-                dest = c
-                break
-        if dest is None:
-            found = _find_first(CURRENT_DIR, name, want_file=False)
-            if found:
-                dest = found
-        if dest is None:
-            # Search common user roots like Desktop, Documents, Downloads
-            found = _search_user_common_roots(name, want_file=False)
-            if found:
-                dest = found
-        if dest and _set_current_dir(dest):
-            _speak_and_log(f"Moved to {dest}")
-            try:
-                # Also open in Explorer for visual confirmation
-                os.startfile(dest)
-            except Exception:
-                pass
-        else:
-            _speak_and_log(f"I couldn't find folder {name}")
-    elif query.startswith("go to ") and " and run " in query:
-        # Example: go to C:\\Projects\\myapp and run npm start
-        try:
-            parts = query.replace("go to ", "", 1).split(" and run ", 1)
-            folder = parts[0].strip().strip('"')
-            cmd = parts[1].strip()
-            # Resolve folder
-            resolved = folder
-            if not os.path.isabs(resolved):
-                # try relative to CURRENT_DIR
-                candidate = os.path.join(CURRENT_DIR, resolved)
-                if os.path.isdir(candidate):
-                    resolved = candidate
-            if not os.path.isdir(resolved):
-                found = _find_first(CURRENT_DIR, folder, want_file=False)
-                if not found:
-                    found = _search_user_common_roots(folder, want_file=False)
-                if found:
-                    resolved = found
-            if os.path.isdir(resolved):
-                if _run_shell_string(cmd, cwd=resolved):
-                    _speak_and_log(f"Running {cmd} in {resolved}")
-                else:
-                    _speak_and_log("I couldn't run that command.")
-            else:
-                _speak_and_log(f"I couldn't find folder {folder}")
-        except Exception:
-            _speak_and_log("Please say: go to <folder> and run <command>.")
-    elif query.startswith("in that open ") or query.startswith("in that go to "):
-        # Example: in that open logs, in that go to src
-        name = query.split(" ", 2)[2].strip().strip('"')
-        dest = _resolve_name_to_path(name, want_file=False)
-        if dest and _set_current_dir(dest):
-            try:
-                os.startfile(dest)
-            except Exception:
-                pass
-            _speak_and_log(f"Opened folder {os.path.basename(dest)}")
-        else:
-            _speak_and_log(f"I couldn't find folder {name}")
-    elif query.startswith("in that run ") or query.startswith("in that execute "):
-        # Example: in that run npm start, in that run python app.py
-        cmd = query.split(" ", 3)[3].strip()
-        if _run_shell_string(cmd, cwd=CURRENT_DIR):
-            _speak_and_log(f"Running {cmd}")
-        else:
-            _speak_and_log("I couldn't run that command.")
-    elif query.startswith("in that open file ") or query.startswith("in that find file "):
-        # Example: in that open file app.py
-        name = query.split(" ", 4)[4].strip().strip('"')
-        fp = _resolve_name_to_path(name, want_file=True)
-        if fp and os.path.isfile(fp):
-            try:
-                os.startfile(fp)
-                _speak_and_log(f"Opened {os.path.basename(fp)}")
-            except Exception:
-                _speak_and_log("I found it but could not open the file.")
-        else:
-            _speak_and_log(f"I couldn't find {name}")
-    elif query.startswith("go to ") and " and run " in query:
-        # Example: go to C:\Projects\myapp and run npm start
-        try:
-            parts = query.replace("go to ", "", 1).split(" and run ", 1)
-            folder = parts[0].strip().strip('"')
-            cmd = parts[1].strip()
-            # Resolve folder
-            resolved = folder
-            if not os.path.isabs(resolved):
-                # try relative to CURRENT_DIR
-                candidate = os.path.join(CURRENT_DIR, resolved)
-                if os.path.isdir(candidate):
-                    resolved = candidate
-            if not os.path.isdir(resolved):
-                found = _find_first(CURRENT_DIR, folder, want_file=False)
-                if found:
-                    resolved = found
-            if os.path.isdir(resolved):
-                if _run_shell_string(cmd, cwd=resolved):
-                    _speak_and_log(f"Running {cmd} in {resolved}")
-                else:
-                    _speak_and_log("I couldn't run that command.")
-            else:
-                _speak_and_log(f"I couldn't find folder {folder}")
-        except Exception:
-            _speak_and_log("Please say: go to <folder> and run <command>.")
-    elif query.startswith("run ") or query.startswith("execute "):
-        # Run arbitrary command in CURRENT_DIR
-        cmd = query.split(" ", 1)[1].strip()
-        if _run_shell_string(cmd, cwd=CURRENT_DIR):
-            _speak_and_log(f"Running {cmd}")
-        else:
-            _speak_and_log("I couldn't run that command.")
-    elif query.startswith("find file ") or query.startswith("open file ") or query.startswith("open file named "):
-        # Support: open file X, open file named X, find file X
-        name = query
-        if query.startswith("open file named "):
-            name = query.replace("open file named ", "", 1)
-        else:
-            name = query.split(" ", 2)[2]
-        name = _normalize_spoken_path_tokens(name)
-        # First: try exact/partial match in CURRENT_DIR
-        found = _find_first(CURRENT_DIR, name, want_file=True)
-        # If user says 'in my pc', search common user folders too
-        if (not found) and (" in my pc" in query or " in my pc." in query):
-            found = _search_user_common_roots(name, want_file=True)
-        if found:
-            try:
-                os.startfile(found)
-                _speak_and_log(f"Opened {os.path.basename(found)}")
-            except Exception:
-                _speak_and_log("I found it but could not open the file.")
-        else:
-            _speak_and_log(f"I couldn't find {name}")
-    elif query.startswith("npm install") or query.startswith("install npm"):
-        if _run_project_command("install", cwd=CURRENT_DIR) or _run_command(["npm", "install"], cwd=CURRENT_DIR):
-            _speak_and_log("Running install in this project")
-        else:
-            _speak_and_log("I couldn't run install here")
-    elif query.startswith("npm start") or "run the app" in query or "start the app" in query:
-        if _run_project_command("start", cwd=CURRENT_DIR) or _run_command(["npm", "start"], cwd=CURRENT_DIR):
-            _speak_and_log("Starting the app")
-        else:
-            _speak_and_log("I couldn't start the app here")
-    elif "make migrations" in query or "makemigrations" in query:
-        if _run_project_command("makemigrations", cwd=CURRENT_DIR):
-            _speak_and_log("Running makemigrations")
-        else:
-            _speak_and_log("I couldn't run makemigrations here")
-    elif "migrate" in query and "makemigrations" not in query:
-        if _run_project_command("migrate", cwd=CURRENT_DIR):
-            _speak_and_log("Running migrate")
-        else:
-            _speak_and_log("I couldn't run migrate here")
-    elif "what is my current folder" in query or "current folder" in query or query.strip() == "pwd":
-        _speak_and_log(f"You are in {CURRENT_DIR}")
-    elif query.startswith("list files") or query.startswith("show files") or query.strip() == "ls":
-        try:
-            items = os.listdir(CURRENT_DIR)
-            if not items:
-                _speak_and_log("This folder is empty.")
-            else:
-                preview = ", ".join(items[:20])
-                _speak_and_log(f"Files here: {preview}")
-        except Exception:
-            _speak_and_log("I couldn't list the files here.")
-    elif "change your name" in query:
-        set_name()
-    elif "list voices" in query or "what voices" in query:
-        list_voices()
-    elif "change voice" in query or "set voice" in query:
-        set_voice_from_query(query)
-    elif "use voice one" in query or "voice one" in query:
-        set_voice_by_index(0)
-        _speak_and_log("Voice set to 1")
-    elif "use voice two" in query or "voice two" in query:
-        set_voice_by_index(1)
-        _speak_and_log("Voice set to 2")
-    elif "use voice three" in query or "voice three" in query:
-        set_voice_by_index(2)
-        _speak_and_log("Voice set to 3")
-    elif "use system voice" in query or "force system voice" in query:
-        enable_system_voice()
-        _speak_and_log("System voice enabled")
-    elif "use engine voice" in query or "disable system voice" in query:
-        enable_engine_voice()
-        _speak_and_log("Engine voice enabled")
-    elif "screenshot" in query:
-        screenshot()
-        speak("I've taken screenshot, please check it")
-    elif "tell me a joke" in query:
-        joke = pyjokes.get_joke()
-        speak(joke)
-        print(joke)
-        try:
-            if UI.instance is not None:
-                UI.instance.log_assistant(joke)
-        except Exception:
-            pass
-    elif "can you hear me" in query or "are you there" in query:
-        _speak_and_log("Yes, I can hear you clearly.")
-    elif "which model are you" in query or "what model are you" in query:
-        _speak_and_log(f"I am using model {_current_model_label()}.")
-    elif "audio test" in query or "test audio" in query:
-        _speak_and_log("This is a voice test. If you can hear me, audio is working.")
-    elif any(t in query for t in ("how are you", "bad day", "feeling down", "i feel bad", "i'm tired", "i am tired", "sad", "upset", "lonely", "stressed", "anxious", "depressed", "not okay", "burned out", "heartbroken", "i'm angry", "i am angry")):
-        msg = _empathetic_response(query)
-        if not msg:
-            msg = "I'm here with you. Thanks for sharing that with me—how can I support you right now?"
-        _speak_and_log(msg)
-    elif "stop speaking" in query or "stop voice" in query or "be quiet" in query or "mute" in query:
-        stop_speaking()
-        _speak_and_log("Stopped speaking.")
-    elif "enable startup" in query or "start on startup" in query:
-        if register_startup():
-            speak("I will start automatically when you log in.")
-        else:
-            speak("I could not enable startup on this system.")
-    elif "disable startup" in query or "stop startup" in query:
-        if unregister_startup():
-            speak("I will not start automatically anymore.")
-        else:
-            speak("Startup entry was not found.")
-    elif "shutdown" in query:
-        speak("Shutting down the system, goodbye!")
-        os.system("shutdown /s /f /t 1")
-        return False
-    elif "restart" in query:
-        speak("Restarting the system, please wait!")
-        os.system("shutdown /r /f /t 1")
-        return False
-    elif "offline" in query or "exit" in query or "quit" in query:
-        speak("Going offline. Have a good day!")
-        return False
-    else:
-        # Fallback to LLM for general queries
-        reply = llm_generate_response(query)
-        if not reply:
-            reply = "Sorry, I don't have an answer for that yet."
-        speak(reply)
+
+# ----- Event loop -----
+COMMAND_WORKERS = int(os.environ.get('JARVIS_COMMAND_WORKERS', '8') or 8)
+COMMAND_QUEUE_LIMIT = int(os.environ.get('JARVIS_COMMAND_QUEUE', '8') or 8)
+_command_cancel: contextvars.ContextVar = contextvars.ContextVar('jarvis_command_cancel', default=None)
+
+
+def command_cancelled() -> bool:
+    """True when the command running on this thread has been cancelled; long handlers poll it."""
+    event = _command_cancel.get()
+    return event is not None and event.is_set()
+
+
+class AssistantCore:
+    """asyncio event loop, on its own thread, that owns every input and command.
+
+    Producers - the wake word listener, push-to-talk, typed commands from
+    stdin and the UI - are coroutines or thread-safe ``submit``/``listen``
+    calls. Each command becomes a task; handlers are blocking code, so tasks
+    run them on a bounded executor of ``workers`` threads, and blocking I/O
+    (microphone capture, recognizers, stdin) on a separate small executor.
+    At most ``queue_limit`` commands wait for a worker; beyond that
+    ``dispatch`` makes the producer wait for room (saying so once per
+    backlog) instead of piling up tasks or dropping commands. ``cancel``
+    cancels waiting commands and flags running ones (see
+    ``command_cancelled``).
+    """
+
+    IO_WORKERS = 4
+
+    def __init__(self, workers: int = COMMAND_WORKERS, queue_limit: int = COMMAND_QUEUE_LIMIT):
+        self.workers = max(1, workers)
+        self.queue_limit = queue_limit
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._start_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._command_pool = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='jarvis-command')
+        self._io_pool = concurrent.futures.ThreadPoolExecutor(self.IO_WORKERS, thread_name_prefix='jarvis-io')
+        self._slots: asyncio.Semaphore | None = None
+        self._capacity: asyncio.Semaphore | None = None
+        self._mic: asyncio.Lock | None = None
+        self._commands: dict[asyncio.Task, threading.Event] = {}
+        self._background: set[asyncio.Task] = set()
+        self._backlogged = False
+        self.deferred = 0
+        self.stopped = threading.Event()
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self.loop is None:
+                threading.Thread(target=self._run, name='jarvis-core', daemon=True).start()
+                self._ready.wait()
+
+    def _run(self) -> None:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._slots = asyncio.Semaphore(self.workers)
+        self._capacity = asyncio.Semaphore(self.workers + max(0, self.queue_limit))
+        self._mic = asyncio.Lock()
+        self.loop = loop
+        self._ready.set()
+        loop.run_forever()
+
+    async def run_blocking(self, func, *args, io: bool = False):
+        """Run ``func(*args)`` on the command or I/O executor, keeping the caller's context."""
+        ctx = contextvars.copy_context()
+        pool = self._io_pool if io else self._command_pool
+        return await self.loop.run_in_executor(pool, functools.partial(ctx.run, func, *args))
+
+    # Thread-safe entry points for producers
+    def submit(self, query: str, trace: _Trace | None = None) -> concurrent.futures.Future:
+        """Queue a recognized or typed command; the future resolves to False when it asked to exit."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(self.command(query, trace), self.loop)
+
+    def listen(self, start: int | None = None) -> concurrent.futures.Future | None:
+        """Capture one spoken command and queue it; None when the microphone is already taken."""
+        self.start()
+        if self._mic.locked():
+            return None
+        return asyncio.run_coroutine_threadsafe(self.listen_and_dispatch(start, "push_to_talk"), self.loop)
+
+    def spawn(self, coro) -> concurrent.futures.Future:
+        """Run a producer coroutine (e.g. the wake word listener) on the loop."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def cancel(self) -> None:
+        """Cancel every other command: waiting ones are dropped, running ones are asked to stop."""
+        if self.loop is None:
+            return
+        current = _command_cancel.get()
+
+        def _cancel():
+            for task, event in list(self._commands.items()):
+                if event is not current:
+                    event.set()
+                    task.cancel()
+        self.loop.call_soon_threadsafe(_cancel)
+
+    # Coroutines
+    async def dispatch(self, query: str, trace: _Trace | None = None) -> asyncio.Task:
+        """Start ``query`` as its own task once there is room for it; returns the task.
+
+        The caller waits here while ``workers + queue_limit`` commands are
+        already in flight, which slows the producer down instead of dropping
+        the command.
+        """
+        if self._capacity.locked():
+            self.deferred += 1
+            if not self._backlogged:
+                self._backlogged = True
+                speak("I'm still working on your earlier requests; I'll get to that next.")
+        await self._capacity.acquire()
+        if not self._capacity.locked():
+            self._backlogged = False
+        task = asyncio.ensure_future(self._command(query, trace))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        task.add_done_callback(lambda _task: self._capacity.release())
+        return task
+
+    async def command(self, query: str, trace: _Trace | None = None) -> bool:
+        """Handle one command; ``trace`` continues the trace of the capture that produced it."""
+        return await (await self.dispatch(query, trace))
+
+    async def _command(self, query: str, trace: _Trace | None) -> bool:
+        if trace is None:
+            trace = tracer.begin("text")
+        tracer.activate(trace)
+        cancel = threading.Event()
+        self._commands[asyncio.current_task()] = cancel
+        error = None
         try:
+            await self._slots.acquire()
+            try:
+                _command_cancel.set(cancel)
+                cont = await self.run_blocking(_handle_query, query)
+            except Exception as e:
+                # A failing handler must not take the input producers down with it
+                error = f"{type(e).__name__}: {e}"
+                print(f"Command error ({query!r}): {error}")
+                speak("Sorry, something went wrong with that command.")
+                cont = True
+            finally:
+                self._slots.release()
+        except asyncio.CancelledError:
+            return True
+        finally:
+            cancel.set()
+            self._commands.pop(asyncio.current_task(), None)
+            tracer.handled(trace, query, error)
+        if not cont:
+            self.stopped.set()
             if UI.instance is not None:
-                UI.instance.log_assistant(reply)
-        except Exception:
-            pass
-    return True
-
+                UI.instance.close()
+        return cont
 
-def _listen_once_thread():
-    try:
-        query = takecommand()
+    async def listen_and_dispatch(self, start: int | None = None, source: str = "voice") -> None:
+        """Capture a command from the microphone, then handle it as its own task."""
+        if self._mic.locked():
+            return
+        trace = tracer.begin(source)
+        async with self._mic:
+            if UI.instance is not None:
+                UI.instance.set_status("Listening… Speak now")
+            try:
+                query = await self.run_blocking(takecommand, start, io=True)
+            finally:
+                if UI.instance is not None:
+                    UI.instance.set_status("Ready. Press N to talk.")
         if query is None:
             # Give user feedback when nothing was captured
             speak("Sorry, I didn't catch that.")
+            tracer.handled(trace)
             return
-        cont = _handle_query(query)
-        if not cont:
-            try:
-                if UI.instance is not None and tk is not None:
-                    UI.instance.root.after(0, UI.instance.root.quit)
-            except Exception:
-                pass
-    finally:
-        try:
-            if UI.instance is not None:
-                UI.instance.set_status("Ready. Press N to talk.")
-                UI.instance._listening_lock.release()
-        except Exception:
-            pass
+        # Not awaited: the microphone is free for the next command while this one runs
+        await self.dispatch(query, trace)
+
 
+core = AssistantCore()
 
-def _wake_listener(stop_event: threading.Event) -> None:
-    recognizer = sr.Recognizer()
-    recognizer.dynamic_energy_threshold = True
-    while not stop_event.is_set():
+
+async def _wake_producer(core: AssistantCore) -> None:
+    cursor = None
+    while True:
         if not WAKE_ENABLED:
-            time.sleep(0.2)
+            await asyncio.sleep(0.2)
+            cursor = None
+            continue
+        if not await core.run_blocking(audio_stream.start, io=True):
+            await asyncio.sleep(2)
             continue
         try:
-            with sr.Microphone() as source:
-                try:
-                    recognizer.adjust_for_ambient_noise(source, duration=0.3)
-                except Exception:
-                    pass
-                audio = recognizer.listen(source, timeout=2, phrase_time_limit=3)
+            audio, cursor = await core.run_blocking(
+                functools.partial(audio_stream.capture_phrase, cursor, timeout=2, phrase_limit=3,
+                                  pause=WAKE_PHRASE_PAUSE), io=True)
+            # Only phrases the local detector accepts go to the cloud recognizer
+            if audio is None or not await core.run_blocking(wake_detector.detect, audio, io=True):
+                continue
             try:
-                text = recognizer.recognize_google(audio, language="en-US").lower()
+                text = (await core.run_blocking(
+                    functools.partial(recognizer.recognize_google, audio, language="en-US"), io=True)).lower()
             except Exception:
                 continue
             if "jarvis" in text:
+                # Only a bare wake word makes a template; "jarvis play music" would widen the gate
+                if _is_bare_wake_phrase(text):
+                    wake_detector.confirmed(audio)
                 _speak_and_log("Yes, I'm listening.")
-                # Immediately run a one-shot listen for the command
-                _listen_once_thread()
+                # The command is captured from the frame right after the wake phrase
+                await core.listen_and_dispatch(cursor, "wake_word")
+                cursor = None
+        except asyncio.CancelledError:
+            raise
         except Exception:
             continue
 
@@ -2000,7 +6793,7 @@ def unregister_startup(shortcut_name: str = 'Jarvis Assistant.lnk') -> bool:
         return False
 
 
-def _stdin_listener() -> None:
+async def _stdin_producer(core: AssistantCore) -> None:
     """Read typed commands from stdin and pass them to the handler.
 
     Useful when the user types commands into the terminal like
@@ -2008,7 +6801,7 @@ def _stdin_listener() -> None:
     """
     while True:
         try:
-            raw = input().strip()
+            raw = (await core.run_blocking(input, io=True)).strip()
         except EOFError:
             break
         except Exception:
@@ -2016,25 +6809,41 @@ def _stdin_listener() -> None:
         if not raw:
             continue
         q = raw.lower()
-        if q in ("exit", "quit"):
-            break
-        cont = _handle_query(q)
-        if not cont:
+        if q in ("exit", "quit") or core.stopped.is_set():
             break
+        # Typed commands run concurrently like spoken ones; only a full queue holds the reader back
+        await core.dispatch(q)
 
 
 if __name__ == "__main__":
-    # Ensure auto-start on Windows login (best-effort)
-    try:
-        registered = register_startup()
-        if registered:
-            print("Startup registration ensured.")
-    except Exception:
-        pass
+    # Pre-render fixed phrases in the background (on the speech thread)
+    phrase_audio.register(_COMMON_PHRASES)
+    # Ensure auto-start on Windows login (best-effort, off the startup path)
+    def _ensure_startup_registration():
+        try:
+            import pythoncom  # type: ignore
+            pythoncom.CoInitialize()
+        except Exception:
+            pass
+        try:
+            if register_startup():
+                print("Startup registration ensured.")
+        except Exception:
+            pass
+    if not HEADLESS:
+        threading.Thread(target=_ensure_startup_registration, daemon=True).start()
 
+    # The speech thread initialises the voice while the UI is being built
     wishme()
-
-    ui = UI()
+    # Open the microphone now so push-to-talk starts capturing immediately
+    threading.Thread(target=audio_stream.start, daemon=True).start()
+    # Build/refresh the file name index in the background
+    file_index.start(_user_common_roots())
+    music_library.start()
+    stream_cache.warm()
+    app_catalog.warm()
+
+    ui = UI() if not HEADLESS else None
     if ui and tk is not None:
         # Initial instructions in the transcript
         try:
@@ -2042,17 +6851,19 @@ if __name__ == "__main__":
         except Exception:
             pass
         # Start wake-word listener
-        wake_stop = threading.Event()
-        threading.Thread(target=_wake_listener, args=(wake_stop,), daemon=True).start()
+        core.spawn(_wake_producer(core))
         # Also accept typed commands from terminal/stdin
-        threading.Thread(target=_stdin_listener, daemon=True).start()
+        core.spawn(_stdin_producer(core))
+        ui.root.after(0, _announce_ready)
         ui.run()
     else:
         # Fallback to console push-to-talk: single-shot listens on Enter
-        while True:
+        _announce_ready()
+        while not core.stopped.is_set():
             _inp = input("Press Enter to talk (or type exit): ").strip().lower()
             if _inp in ("exit", "quit"):
                 break
+            trace = tracer.begin("push_to_talk")
             q = takecommand()
-            if not _handle_query(q or ""):
+            if not core.submit(q or "", trace).result():
                 break